@@ -0,0 +1,63 @@
+"""add content-addressed hunk contents
+
+Revision ID: f4c1a6e8d273
+Revises: e7b2d4a9c851
+Create Date: 2025-02-24 10:27:51.640392
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "f4c1a6e8d273"
+down_revision: Union[str, None] = "e7b2d4a9c851"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+CONTENT_HASH = "encode(sha256(convert_to(content, 'UTF8')), 'hex')"
+
+
+def upgrade() -> None:
+    op.create_table(
+        "hunk_contents",
+        sa.Column("hash", sa.String(length=64), nullable=False),
+        sa.Column("content", sa.Text(), nullable=False),
+        sa.PrimaryKeyConstraint("hash"),
+    )
+    op.add_column(
+        "diff_hunks", sa.Column("content_hash", sa.String(length=64), nullable=True)
+    )
+
+    # Move existing hunk text into hunk_contents, one row per distinct text
+    op.execute(
+        f"INSERT INTO hunk_contents (hash, content) "
+        f"SELECT DISTINCT {CONTENT_HASH}, content FROM diff_hunks"
+    )
+    op.execute(f"UPDATE diff_hunks SET content_hash = {CONTENT_HASH}")
+
+    op.alter_column("diff_hunks", "content_hash", nullable=False)
+    op.create_foreign_key(
+        "diff_hunks_content_hash_fkey",
+        "diff_hunks",
+        "hunk_contents",
+        ["content_hash"],
+        ["hash"],
+    )
+    op.create_index(op.f("ix_diff_hunks_content_hash"), "diff_hunks", ["content_hash"])
+    op.drop_column("diff_hunks", "content")
+
+
+def downgrade() -> None:
+    op.add_column("diff_hunks", sa.Column("content", sa.Text(), nullable=True))
+    op.execute(
+        "UPDATE diff_hunks SET content = hunk_contents.content "
+        "FROM hunk_contents WHERE hunk_contents.hash = diff_hunks.content_hash"
+    )
+    op.alter_column("diff_hunks", "content", nullable=False)
+    op.drop_index(op.f("ix_diff_hunks_content_hash"), table_name="diff_hunks")
+    op.drop_constraint("diff_hunks_content_hash_fkey", "diff_hunks", type_="foreignkey")
+    op.drop_column("diff_hunks", "content_hash")
+    op.drop_table("hunk_contents")
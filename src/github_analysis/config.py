@@ -1,7 +1,9 @@
 import os
+from typing import Annotated, List, Optional
 
 from dotenv import load_dotenv
-from pydantic_settings import BaseSettings, SettingsConfigDict
+from pydantic import field_validator
+from pydantic_settings import BaseSettings, NoDecode, SettingsConfigDict
 
 DOTENV_PATH = os.path.join(
     os.path.dirname(os.path.dirname(os.path.dirname(__file__))), ".env"
@@ -10,8 +12,112 @@ DOTENV_PATH = os.path.join(
 
 class Settings(BaseSettings):
     GITHUB_TOKEN: str
+    # Extra tokens to rotate through, comma separated
+    GITHUB_TOKENS: Annotated[List[str], NoDecode] = []
     OPENAI_API_KEY: str  # Add this
 
+    # Shared aiohttp connection pool for GitHub API calls
+    GITHUB_HTTP_POOL_SIZE: int = 100
+    GITHUB_HTTP_POOL_PER_HOST: int = 20
+    GITHUB_HTTP_KEEPALIVE_TIMEOUT: float = 30.0
+    GITHUB_HTTP_CONNECT_TIMEOUT: float = 10.0
+    GITHUB_HTTP_READ_TIMEOUT: float = 60.0
+    # Number of PRs whose comments and diffs are fetched at the same time
+    GITHUB_FETCH_CONCURRENCY: int = 8
+    # PR listing backend: "rest", or "graphql" to get PRs and review comments
+    # for a whole page in one query
+    GITHUB_FETCH_MODE: str = "rest"
+    GITHUB_GRAPHQL_PAGE_SIZE: int = 50
+    # Conditional-request cache backend: "memory", "database" or "none". The
+    # memory backend keeps no diffs and at most this many entries and bytes
+    GITHUB_RESPONSE_CACHE: str = "memory"
+    GITHUB_RESPONSE_CACHE_SIZE: int = 1000
+    GITHUB_RESPONSE_CACHE_MAX_BYTES: int = 32_000_000
+    # Responses larger than this are not cached
+    GITHUB_RESPONSE_CACHE_MAX_BODY: int = 1_000_000
+    # Rate limit scheduling: requests held back from each token's hourly budget,
+    # burst size, retry limits for rate limited requests and failed PRs, and
+    # seconds before a PR that hit a server error or timeout is first retried
+    GITHUB_RATE_LIMIT_RESERVE: int = 50
+    GITHUB_RATE_LIMIT_BURST: int = 100
+    GITHUB_MAX_RETRIES: int = 5
+    GITHUB_FETCH_MAX_ATTEMPTS: int = 3
+    GITHUB_FETCH_RETRY_DELAY: float = 1.0
+    # Diffs are streamed; bytes read per PR and hunk bytes kept per file, with
+    # anything beyond recorded as truncated
+    GITHUB_DIFF_MAX_SIZE: int = 10_000_000
+    GITHUB_DIFF_MAX_FILE_SIZE: int = 1_000_000
+    # Most PRs persisted per bulk write transaction
+    GITHUB_WRITE_BATCH_SIZE: int = 50
+    # Batch analysis: LLM calls in flight, and PRs per context load,
+    # embeddings call, Qdrant upsert and commit
+    ANALYSIS_LLM_CONCURRENCY: int = 4
+    ANALYSIS_BATCH_SIZE: int = 20
+    # Background analysis jobs: queue backend ("memory" or "database"),
+    # worker tasks per app process, attempts per job, seconds before a job
+    # is cancelled, and base delay before retrying a failed job
+    ANALYSIS_JOB_QUEUE: str = "memory"
+    ANALYSIS_WORKERS: int = 2
+    ANALYSIS_JOB_MAX_ATTEMPTS: int = 3
+    ANALYSIS_JOB_TIMEOUT: float = 600.0
+    ANALYSIS_JOB_RETRY_DELAY: float = 5.0
+
+    # Embedding backend: "openai", "sentence-transformers" (a local model,
+    # needs the sentence-transformers package) or "hashing" (local feature
+    # hashing, for offline runs and tests). EMBEDDING_MODEL defaults to the
+    # backend's own; EMBEDDING_DIMENSIONS shortens OpenAI text-embedding-3
+    # vectors or sizes hashed ones. EMBEDDING_WORKERS processes hash large
+    # batches, 0 for one per core
+    EMBEDDING_PROVIDER: str = "openai"
+    EMBEDDING_MODEL: Optional[str] = None
+    EMBEDDING_DIMENSIONS: Optional[int] = None
+    EMBEDDING_WORKERS: int = 0
+    # Embedding requests: most texts and estimated tokens packed into one
+    # request, and seconds single-text calls wait to share a request
+    EMBEDDING_BATCH_MAX_INPUTS: int = 2048
+    EMBEDDING_BATCH_MAX_TOKENS: int = 250_000
+    EMBEDDING_BATCH_WAIT: float = 0.01
+    # Raw diffs are embedded in chunks of at most this many estimated tokens,
+    # stored as one Qdrant point each, up to EMBEDDING_MAX_CHUNKS per PR
+    EMBEDDING_CHUNK_TOKENS: int = 2000
+    EMBEDDING_MAX_CHUNKS: int = 64
+    # Embedding cache backend: "memory", "database" (an in-memory LRU in
+    # front of Postgres) or "none", and entries kept in memory
+    EMBEDDING_CACHE: str = "memory"
+    EMBEDDING_CACHE_SIZE: int = 10_000
+    # Limits on calls to OpenAI, per model and shared by the whole app
+    # process: requests and tokens per minute (set below the organization's
+    # limits when several processes share a key), most calls in flight (cut
+    # on 429s and grown back on success), seconds per attempt and retries
+    OPENAI_REQUESTS_PER_MINUTE: int = 500
+    OPENAI_TOKENS_PER_MINUTE: int = 300_000
+    OPENAI_MAX_CONCURRENCY: int = 16
+    OPENAI_TIMEOUT: float = 60.0
+    OPENAI_MAX_RETRIES: int = 4
+    # LLM backend: "openai", "local" (an OpenAI-compatible server at
+    # LLM_BASE_URL, authenticated with LLM_API_KEY if it needs a key) or
+    # "fake" (deterministic answers after LLM_FAKE_LATENCY seconds, for load
+    # tests). At most LLM_CONCURRENCY completions run at once, each cancelled
+    # after LLM_TIMEOUT seconds
+    LLM_PROVIDER: str = "openai"
+    LLM_MODEL: str = "gpt-4-turbo-preview"
+    LLM_BASE_URL: Optional[str] = None
+    LLM_API_KEY: Optional[str] = None
+    LLM_CONCURRENCY: int = 8
+    LLM_TIMEOUT: float = 120.0
+    LLM_FAKE_LATENCY: float = 0.0
+    # LLM analysis cache backend: "memory", "database" or "none", and
+    # analyses kept in memory
+    LLM_CACHE: str = "memory"
+    LLM_CACHE_SIZE: int = 1000
+    # Estimated tokens per analysis prompt; diffs up to the map-reduce
+    # threshold are trimmed to fit, larger ones are summarized per file
+    # first in at most LLM_MAX_MAP_CHUNKS calls, LLM_MAP_CONCURRENCY at once
+    LLM_PROMPT_TOKEN_BUDGET: int = 12_000
+    LLM_MAP_REDUCE_THRESHOLD: int = 36_000
+    LLM_MAP_CONCURRENCY: int = 4
+    LLM_MAX_MAP_CHUNKS: int = 16
+
     QDRANT_HOST: str = "localhost"
     QDRANT_PORT: int = 6334
     QDRANT_COLLECTION_NAME: str = "github_changes"
@@ -25,6 +131,18 @@ class Settings(BaseSettings):
 
     model_config = SettingsConfigDict(env_file=DOTENV_PATH, env_file_encoding="utf-8")
 
+    @field_validator("GITHUB_TOKENS", mode="before")
+    @classmethod
+    def split_tokens(cls, value):
+        if isinstance(value, str):
+            return [token.strip() for token in value.split(",") if token.strip()]
+        return value
+
+    @property
+    def github_tokens(self) -> List[str]:
+        """Every configured GitHub token, primary first, without duplicates."""
+        return list(dict.fromkeys([self.GITHUB_TOKEN, *self.GITHUB_TOKENS]))
+
     @property
     def database_url(self) -> str:
         return f"postgresql+asyncpg://{self.db_user}:{self.db_password}@{self.db_host}:{self.db_port}/{self.db_name}"
@@ -1,29 +1,86 @@
-from fastapi import Depends
-from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
+
+import aiohttp
+from fastapi import Depends, Request
 from qdrant_client import QdrantClient
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from github_analysis.config import settings
 from github_analysis.db.config import get_db_session
-from github_analysis.services.github_service import GitHubService
 from github_analysis.services.ai_service import AIService
 from github_analysis.services.analysis_service import AnalysisService
+from github_analysis.services.embedding import EmbeddingService
+from github_analysis.services.github_service import GitHubService
+from github_analysis.services.job_queue import JobWorkerPool
+from github_analysis.services.rate_limiter import GitHubTokenPool
+from github_analysis.services.response_cache import ResponseCache
 
 
 def get_qdrant_client():
     return QdrantClient(host=settings.QDRANT_HOST, port=settings.QDRANT_PORT)
 
 
-def get_ai_service():
-    return AIService(settings.OPENAI_API_KEY)
+def get_ai_service(request: Request) -> AIService:
+    return request.app.state.ai_service
+
+
+def get_embedding_service(request: Request) -> EmbeddingService:
+    return request.app.state.embedding_service
 
 
 def get_analysis_service(
     db: AsyncSession = Depends(get_db_session),
     qdrant: QdrantClient = Depends(get_qdrant_client),
     ai_service: AIService = Depends(get_ai_service),
+    embedding_service: EmbeddingService = Depends(get_embedding_service),
 ) -> AnalysisService:
-    return AnalysisService(db, qdrant, ai_service)
+    return AnalysisService(
+        db,
+        qdrant,
+        ai_service,
+        embedding_service,
+        llm_concurrency=settings.ANALYSIS_LLM_CONCURRENCY,
+        batch_size=settings.ANALYSIS_BATCH_SIZE,
+        collection_name=settings.QDRANT_COLLECTION_NAME,
+    )
+
 
+def get_github_session(request: Request) -> aiohttp.ClientSession:
+    return request.app.state.github_session
 
-def get_github_service(db: AsyncSession = Depends(get_db_session)) -> GitHubService:
-    return GitHubService(db, settings.GITHUB_TOKEN)
+
+def get_response_cache(request: Request) -> Optional[ResponseCache]:
+    return request.app.state.response_cache
+
+
+def get_token_pool(request: Request) -> GitHubTokenPool:
+    return request.app.state.token_pool
+
+
+def get_job_pool(request: Request) -> JobWorkerPool:
+    return request.app.state.job_pool
+
+
+def get_github_service(
+    db: AsyncSession = Depends(get_db_session),
+    session: aiohttp.ClientSession = Depends(get_github_session),
+    response_cache: Optional[ResponseCache] = Depends(get_response_cache),
+    token_pool: GitHubTokenPool = Depends(get_token_pool),
+) -> GitHubService:
+    return GitHubService(
+        db,
+        settings.GITHUB_TOKEN,
+        session,
+        fetch_concurrency=settings.GITHUB_FETCH_CONCURRENCY,
+        response_cache=response_cache,
+        response_cache_max_body=settings.GITHUB_RESPONSE_CACHE_MAX_BODY,
+        max_retries=settings.GITHUB_MAX_RETRIES,
+        max_fetch_attempts=settings.GITHUB_FETCH_MAX_ATTEMPTS,
+        fetch_retry_delay=settings.GITHUB_FETCH_RETRY_DELAY,
+        token_pool=token_pool,
+        fetch_mode=settings.GITHUB_FETCH_MODE,
+        graphql_page_size=settings.GITHUB_GRAPHQL_PAGE_SIZE,
+        max_diff_size=settings.GITHUB_DIFF_MAX_SIZE,
+        max_diff_file_size=settings.GITHUB_DIFF_MAX_FILE_SIZE,
+        write_batch_size=settings.GITHUB_WRITE_BATCH_SIZE,
+    )
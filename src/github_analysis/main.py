@@ -1,13 +1,97 @@
-from fastapi import Depends, FastAPI
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from fastapi import Depends, FastAPI, HTTPException, Request
 from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from github_analysis.db.config import get_db_session
-from github_analysis.dependencies import get_analysis_service, get_github_service
+from github_analysis.config import settings
+from github_analysis.db.config import get_db_session, sessionmanager
+from github_analysis.dependencies import (
+    get_analysis_service,
+    get_github_service,
+    get_job_pool,
+    get_qdrant_client,
+)
+from github_analysis.models.schemas.analysis import AnalyzePRsRequest
+from github_analysis.models.schemas.jobs import JobResponse
+from github_analysis.services.ai_service import AIService
+from github_analysis.services.analysis_cache import create_analysis_cache
 from github_analysis.services.analysis_service import AnalysisService
+from github_analysis.services.embedding import EmbeddingService, EmbeddingType
+from github_analysis.services.embedding_cache import create_embedding_cache
+from github_analysis.services.embedding_providers import create_embedding_provider
 from github_analysis.services.github_service import GitHubService
+from github_analysis.services.http_session import create_github_session
+from github_analysis.services.job_queue import Job, JobWorkerPool, create_job_queue
+from github_analysis.services.llm_providers import create_llm_provider
+from github_analysis.services.openai_rate_limiter import create_openai_rate_limiter
+from github_analysis.services.rate_limiter import GitHubRateLimiter, GitHubTokenPool
+from github_analysis.services.response_cache import create_response_cache
+
+
+async def run_analysis_job(job: Job) -> dict:
+    async with sessionmanager.session() as db:
+        analysis_service = get_analysis_service(
+            db, get_qdrant_client(), app.state.ai_service, app.state.embedding_service
+        )
+        return await analysis_service.run_job(job.kind, job.params)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled session for the lifetime of the app, shared by every request
+    app.state.github_session = create_github_session(settings)
+    app.state.response_cache = create_response_cache(settings, sessionmanager.session)
+    app.state.token_pool = GitHubTokenPool(
+        settings.github_tokens,
+        GitHubRateLimiter(
+            reserve=settings.GITHUB_RATE_LIMIT_RESERVE,
+            burst=settings.GITHUB_RATE_LIMIT_BURST,
+        ),
+    )
+    # Shared by every OpenAI call so they stay within the limits together
+    app.state.openai_rate_limiter = create_openai_rate_limiter(settings)
+    app.state.ai_service = AIService(
+        settings.OPENAI_API_KEY,
+        cache=create_analysis_cache(settings, sessionmanager.session),
+        prompt_token_budget=settings.LLM_PROMPT_TOKEN_BUDGET,
+        map_reduce_threshold=settings.LLM_MAP_REDUCE_THRESHOLD,
+        map_concurrency=settings.LLM_MAP_CONCURRENCY,
+        max_map_chunks=settings.LLM_MAX_MAP_CHUNKS,
+        provider=create_llm_provider(settings, app.state.openai_rate_limiter),
+        rate_limiter=app.state.openai_rate_limiter,
+    )
+    # Shared so concurrent analyses can batch their embedding requests
+    app.state.embedding_service = EmbeddingService(
+        settings.OPENAI_API_KEY,
+        max_batch_inputs=settings.EMBEDDING_BATCH_MAX_INPUTS,
+        max_batch_tokens=settings.EMBEDDING_BATCH_MAX_TOKENS,
+        batch_wait=settings.EMBEDDING_BATCH_WAIT,
+        cache=create_embedding_cache(settings, sessionmanager.session),
+        chunk_tokens=settings.EMBEDDING_CHUNK_TOKENS,
+        max_chunks=settings.EMBEDDING_MAX_CHUNKS,
+        provider=create_embedding_provider(settings, app.state.openai_rate_limiter),
+    )
+    app.state.job_pool = JobWorkerPool(
+        create_job_queue(settings, sessionmanager.session),
+        run_analysis_job,
+        workers=settings.ANALYSIS_WORKERS,
+        max_attempts=settings.ANALYSIS_JOB_MAX_ATTEMPTS,
+        job_timeout=settings.ANALYSIS_JOB_TIMEOUT,
+        retry_delay=settings.ANALYSIS_JOB_RETRY_DELAY,
+    )
+    app.state.job_pool.start()
+    try:
+        yield
+    finally:
+        await app.state.job_pool.stop()
+        await app.state.embedding_service.close()
+        await app.state.ai_service.provider.close()
+        await app.state.github_session.close()
 
-app = FastAPI(title="GitHub Analysis")
+
+app = FastAPI(title="GitHub Analysis", lifespan=lifespan)
 
 
 @app.get("/health")
@@ -21,10 +105,22 @@ async def test_github(
     github_pr_service: GitHubService = Depends(get_github_service),
 ):
     """Temporary endpoint to test GitHub API responses and storage"""
-    results = await github_pr_service.fetch_and_store_prs("python", "cpython", limit=5)
+    results = await github_pr_service.sync_repository("python", "cpython", limit=5)
     return {"results": results, "message": "Data fetch and store attempted"}
 
 
+@app.post("/sync/{owner}/{repo}")
+async def sync_repository(
+    owner: str,
+    repo: str,
+    limit: Optional[int] = None,
+    github_pr_service: GitHubService = Depends(get_github_service),
+):
+    """Backfill a repository, or fetch only the PRs changed since the last sync"""
+    results = await github_pr_service.sync_repository(owner, repo, limit=limit)
+    return {"results": results}
+
+
 @app.get("/health/db", response_model=None)  # Avoid response model validation here
 async def test_db_connection(db: AsyncSession = Depends(get_db_session)):
     try:
@@ -35,9 +131,59 @@ async def test_db_connection(db: AsyncSession = Depends(get_db_session)):
         return {"status": "Database connection failed", "error": str(e)}
 
 
-@app.post("/analyze-pr/{pr_id}")
+@app.get("/health/openai")
+async def openai_stats(request: Request):
+    """Calls, retries, rate limiting and queue wait times of OpenAI calls"""
+    return request.app.state.openai_rate_limiter.stats()
+
+
+@app.post("/analyze-pr/{pr_id}", response_model=JobResponse, status_code=202)
 async def analyze_pr(
-    pr_id: int, analysis_service: AnalysisService = Depends(get_analysis_service)
+    pr_id: int,
+    owner: Optional[str] = None,
+    repo: Optional[str] = None,
+    job_pool: JobWorkerPool = Depends(get_job_pool),
+):
+    """Queue a PR for analysis; poll GET /jobs/{id} for the result"""
+    return await job_pool.submit(
+        "analyze_pr", {"pr_id": pr_id, "owner": owner, "repo": repo}
+    )
+
+
+@app.post("/analyze-prs", response_model=JobResponse, status_code=202)
+async def analyze_prs(
+    request: AnalyzePRsRequest,
+    job_pool: JobWorkerPool = Depends(get_job_pool),
 ):
-    result = await analysis_service.process_pr(pr_id)
-    return result
+    """Queue a list of PRs, or every stored PR of a repository, for batch
+    analysis; poll GET /jobs/{id} for the result"""
+    return await job_pool.submit("analyze_prs", request.model_dump(mode="json"))
+
+
+@app.get("/similar-prs/{pr_id}")
+async def similar_prs(
+    pr_id: int,
+    embedding_type: EmbeddingType = EmbeddingType.RAW_DIFF,
+    limit: int = 5,
+    owner: Optional[str] = None,
+    repo: Optional[str] = None,
+    analysis_service: AnalysisService = Depends(get_analysis_service),
+):
+    """PRs most similar to an analyzed PR; raw diffs are matched chunk by chunk"""
+    try:
+        return {
+            "pr_id": pr_id,
+            "similar": await analysis_service.find_similar_prs(
+                pr_id, embedding_type, limit, owner, repo
+            ),
+        }
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+@app.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str, job_pool: JobWorkerPool = Depends(get_job_pool)):
+    job = await job_pool.queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
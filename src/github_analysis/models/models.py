@@ -3,15 +3,19 @@ import enum
 from sqlalchemy import (
     ARRAY,
     BigInteger,
+    Boolean,
     Column,
     DateTime,
     Enum,
     Float,
     ForeignKey,
+    Index,
     Integer,
     String,
     Text,
     JSON,
+    LargeBinary,
+    UniqueConstraint,
 )
 from sqlalchemy.orm import relationship
 
@@ -27,13 +31,30 @@ class ChangeType(enum.Enum):
 
 class PullRequest(Base):
     __tablename__ = "pull_requests"
+    __table_args__ = (
+        Index(
+            "ix_pull_requests_repo_number",
+            "repo_owner",
+            "repo_name",
+            "number",
+            unique=True,
+        ),
+    )
 
     id = Column(Integer, primary_key=True)
     github_id = Column(BigInteger, unique=True, nullable=False)
-    number = Column(Integer, nullable=False)
+    # Repository the PR belongs to; PR numbers are only unique within one
+    repo_owner = Column(String)
+    repo_name = Column(String)
+    number = Column(Integer, nullable=False, index=True)
     title = Column(String, nullable=False)
     body = Column(String)
     created_at = Column(DateTime(timezone=True), nullable=False)
+    updated_at = Column(DateTime(timezone=True))
+    # Diff was cut off at the per-PR size cap; later files are missing
+    diff_truncated = Column(Boolean, nullable=False, server_default="false")
+    # sha256 of the parsed diff; diffs are only rewritten when it changes
+    diff_hash = Column(String(64))
 
     # Relationships
     comments = relationship(
@@ -54,7 +75,10 @@ class PRComment(Base):
     body = Column(String, nullable=False)
     user_login = Column(String, nullable=False)
     pr_id = Column(
-        Integer, ForeignKey("pull_requests.id", ondelete="CASCADE"), nullable=False
+        Integer,
+        ForeignKey("pull_requests.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
     )
 
     pull_request = relationship("PullRequest", back_populates="comments")
@@ -67,8 +91,13 @@ class PRDiff(Base):
     file_path = Column(String, nullable=False)
     old_file_path = Column(String)  # For renames
     change_type = Column(Enum(ChangeType), nullable=False)
+    # Hunks were cut off at the per-file size cap
+    truncated = Column(Boolean, nullable=False, server_default="false")
     pr_id = Column(
-        Integer, ForeignKey("pull_requests.id", ondelete="CASCADE"), nullable=False
+        Integer,
+        ForeignKey("pull_requests.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
     )
 
     pull_request = relationship("PullRequest", back_populates="diffs")
@@ -85,12 +114,36 @@ class DiffHunk(Base):
     old_lines = Column(Integer, nullable=False)
     new_start = Column(Integer, nullable=False)
     new_lines = Column(Integer, nullable=False)
-    content = Column(Text, nullable=False)
+    content_hash = Column(
+        String(64), ForeignKey("hunk_contents.hash"), nullable=False, index=True
+    )
     diff_id = Column(
-        Integer, ForeignKey("pr_diffs.id", ondelete="CASCADE"), nullable=False
+        Integer,
+        ForeignKey("pr_diffs.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
     )
 
     diff = relationship("PRDiff", back_populates="hunks")
+    # Always loaded with the hunk, so ``content`` is safe under asyncio
+    hunk_content = relationship("HunkContent", lazy="joined")
+
+    @property
+    def content(self) -> str:
+        return self.hunk_content.content
+
+
+class HunkContent(Base):
+    """Hunk text stored once per distinct content, keyed by its sha256.
+
+    Cherry-picks, backports and bot PRs repeat the same hunks many times; the
+    hash doubles as a cache key for anything derived from the text.
+    """
+
+    __tablename__ = "hunk_contents"
+
+    hash = Column(String(64), primary_key=True)
+    content = Column(Text, nullable=False)
 
 
 class PRAnalysis(Base):
@@ -98,7 +151,10 @@ class PRAnalysis(Base):
 
     id = Column(Integer, primary_key=True)
     pr_id = Column(
-        Integer, ForeignKey("pull_requests.id", ondelete="CASCADE"), nullable=False
+        Integer,
+        ForeignKey("pull_requests.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
     )
     embedding = Column(ARRAY(Float))  # Store the vector embedding
     summary = Column(String)  # Store the AI-generated summary
@@ -108,3 +164,73 @@ class PRAnalysis(Base):
 
     # Relationship back to PR
     pull_request = relationship("PullRequest", back_populates="analysis")
+
+
+class RepositorySyncState(Base):
+    __tablename__ = "repository_sync_states"
+    __table_args__ = (UniqueConstraint("owner", "name"),)
+
+    id = Column(Integer, primary_key=True)
+    owner = Column(String, nullable=False)
+    name = Column(String, nullable=False)
+    # High-water mark: every PR updated before this has been synced
+    last_updated_at = Column(DateTime(timezone=True))
+    # ETag of the "most recently updated PR" listing at the last sync
+    etag = Column(String)
+    # Resume point and starting high-water mark of an unfinished backfill
+    cursor = Column(String)
+    backfill_updated_at = Column(DateTime(timezone=True))
+    last_synced_at = Column(DateTime(timezone=True))
+
+
+class GitHubResponseCacheEntry(Base):
+    __tablename__ = "github_response_cache"
+
+    key = Column(String(64), primary_key=True)  # sha256 of Accept + URL
+    url = Column(Text, nullable=False)
+    etag = Column(String)
+    last_modified = Column(String)
+    link = Column(Text)
+    body = Column(Text, nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False)
+
+
+class EmbeddingCacheEntry(Base):
+    __tablename__ = "embedding_cache"
+
+    model = Column(String, primary_key=True)
+    dimensions = Column(Integer, primary_key=True)  # 0 for the model default
+    text_hash = Column(String(64), primary_key=True)  # sha256 of the text
+    vector = Column(LargeBinary, nullable=False)  # Packed float32
+
+
+class AnalysisCacheEntry(Base):
+    __tablename__ = "llm_analysis_cache"
+
+    # sha256 of the model, temperature, response format and messages
+    fingerprint = Column(String(64), primary_key=True)
+    model = Column(String, nullable=False)
+    analysis = Column(JSON, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+
+
+class AnalysisJob(Base):
+    """Background job, claimed by workers with ``FOR UPDATE SKIP LOCKED``."""
+
+    __tablename__ = "analysis_jobs"
+    __table_args__ = (
+        Index("ix_analysis_jobs_status_available_at", "status", "available_at"),
+    )
+
+    id = Column(String(32), primary_key=True)  # uuid4 hex
+    kind = Column(String, nullable=False)
+    params = Column(JSON, nullable=False)
+    status = Column(String, nullable=False)  # queued, running, succeeded, failed
+    attempts = Column(Integer, nullable=False, server_default="0")
+    max_attempts = Column(Integer, nullable=False)
+    result = Column(JSON)
+    error = Column(Text)
+    # When a queued job is due, or when a running job's lease runs out
+    available_at = Column(DateTime(timezone=True), nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False)
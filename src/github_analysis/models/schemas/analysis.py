@@ -0,0 +1,24 @@
+from typing import List, Optional
+
+from pydantic import BaseModel, Field, model_validator
+
+from github_analysis.services.embedding import EmbeddingType
+
+
+class AnalyzePRsRequest(BaseModel):
+    pr_ids: Optional[List[int]] = Field(
+        None, description="PR numbers to analyze; all PRs of the repo if omitted"
+    )
+    owner: Optional[str] = Field(None, description="Repository owner")
+    repo: Optional[str] = Field(None, description="Repository name")
+    embedding_type: EmbeddingType = Field(
+        EmbeddingType.AI_SUMMARY, description="What to embed for each PR"
+    )
+
+    @model_validator(mode="after")
+    def check_selection(self):
+        if (self.owner is None) != (self.repo is None):
+            raise ValueError("owner and repo must be given together")
+        if self.pr_ids is None and self.owner is None:
+            raise ValueError("Pass pr_ids, owner and repo, or both")
+        return self
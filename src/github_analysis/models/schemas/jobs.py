@@ -0,0 +1,17 @@
+from datetime import datetime
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+from github_analysis.services.job_queue import JobStatus
+
+
+class JobResponse(BaseModel):
+    id: str = Field(description="Job ID to poll with GET /jobs/{id}")
+    kind: str = Field(description="What the job does, e.g. analyze_pr")
+    status: JobStatus = Field(description="queued, running, succeeded or failed")
+    attempts: int = Field(description="Attempts started so far")
+    result: Optional[dict] = Field(None, description="Job output once succeeded")
+    error: Optional[str] = Field(None, description="Error of the latest failed attempt")
+    created_at: datetime = Field(description="Job creation timestamp")
+    updated_at: datetime = Field(description="Last status change timestamp")
@@ -1,15 +1,74 @@
+import asyncio
 import json
-from typing import Dict, List
+import logging
+from typing import Dict, List, Optional
 import openai
 from openai import AsyncOpenAI
 from openai.types import ResponseFormatJSONObject
 from openai.types.chat import ChatCompletionMessageParam
 from openai.types.chat.completion_create_params import ResponseFormat
 
+from github_analysis.services.analysis_cache import (
+    AnalysisCache,
+    analysis_fingerprint,
+)
+from github_analysis.services.llm_providers import LLMProvider, OpenAIChatProvider
+from github_analysis.services.openai_rate_limiter import OpenAIRateLimiter
+from github_analysis.services.prompt_budget import (
+    budget_changes,
+    budget_discussion,
+    change_tokens,
+    filter_changes,
+    group_changes,
+)
+from github_analysis.services.tokens import estimate_tokens, trim_text
+
+SYSTEM_PROMPT = (
+    "You are an expert code reviewer and software engineer. Analyze pull "
+    "requests and provide structured insights about code changes."
+)
+# Estimated tokens of the analysis prompt around the PR content
+PROMPT_OVERHEAD_TOKENS = 400
+
 
 class AIService:
-    def __init__(self, api_key: str):
-        self.client = AsyncOpenAI(api_key=api_key)
+    def __init__(
+        self,
+        api_key: str,
+        cache: Optional[AnalysisCache] = None,
+        model: str = "gpt-4-turbo-preview",
+        temperature: float = 0.1,
+        prompt_token_budget: int = 12_000,
+        map_reduce_threshold: int = 36_000,
+        map_concurrency: int = 4,
+        max_map_chunks: int = 16,
+        provider: Optional[LLMProvider] = None,
+        rate_limiter: Optional[OpenAIRateLimiter] = None,
+    ):
+        # OpenAI calls go through rate_limiter, which then retries them
+        self.rate_limiter = rate_limiter
+        self.client = AsyncOpenAI(
+            api_key=api_key, **({"max_retries": 0} if rate_limiter else {})
+        )
+        # Completions run on provider, OpenAI's API unless another backend is
+        # given (see llm_providers)
+        self.provider = provider or OpenAIChatProvider(
+            api_key, model, rate_limiter=rate_limiter
+        )
+        # Analyses are reused while the request fingerprint is unchanged
+        self.cache = cache
+        self.model = self.provider.model
+        self.temperature = temperature
+        # Prompts are kept within prompt_token_budget estimated tokens. Diffs
+        # up to map_reduce_threshold are trimmed to fit; larger ones are
+        # summarized per file first, in at most max_map_chunks LLM calls
+        # with map_concurrency at a time
+        self.prompt_token_budget = prompt_token_budget
+        self.map_reduce_threshold = map_reduce_threshold
+        self.map_concurrency = max(1, map_concurrency)
+        self.max_map_chunks = max(1, max_map_chunks)
+        self.cache_hits = 0
+        self.cache_misses = 0
 
     def _format_changes_for_prompt(self, changes: List[Dict]) -> str:
         """Format code changes in a readable way for the AI"""
@@ -31,6 +90,11 @@ class AIService:
         """Create a detailed prompt for the AI"""
         changes = self._format_changes_for_prompt(pr_context["changes"])
         discussion = self._format_discussion_for_prompt(pr_context["discussion"])
+        changes_heading = (
+            "Changes (summarized per file)"
+            if pr_context.get("changes_summarized")
+            else "Changes"
+        )
 
         return f"""Analyze this pull request and provide a structured summary of the changes.
 
@@ -39,7 +103,7 @@ Title: {pr_context['title']}
 Description:
 {pr_context['description'] or 'No description provided.'}
 
-Changes:
+{changes_heading}:
 {changes}
 
 Discussion:
@@ -62,40 +126,143 @@ Format the response as a JSON object with these keys:
 
     async def analyze_pr(self, pr_context: Dict) -> Dict:
         """Get AI analysis of the PR"""
-        prompt = self._create_analysis_prompt(pr_context)
-        messages = [
-            {
-                "role": "system",
-                "content": "You are an expert code reviewer and software engineer. Analyze pull requests and provide structured insights about code changes.",
-            },
-            {
-                "role": "user",
-                "content": prompt,
-            },
-        ]
+        prompt = self._create_analysis_prompt(await self._fit_to_budget(pr_context))
+        return await self._complete_json(
+            [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt},
+            ]
+        )
 
-        response = await self.client.chat.completions.create(
-            model="gpt-4-turbo-preview",
-            messages=messages,
-            temperature=0.1,
-            response_format={"type": "json_object"},
+    async def _fit_to_budget(self, pr_context: Dict) -> Dict:
+        """Trim the PR context so the analysis prompt fits the token budget.
+
+        The description gets up to an eighth of the budget and the discussion
+        up to a quarter; the diff gets the rest. A diff over
+        ``map_reduce_threshold`` tokens is replaced by per-file summaries.
+        """
+        budget = self.prompt_token_budget - PROMPT_OVERHEAD_TOKENS
+        description = trim_text(pr_context["description"] or "", budget // 8)
+        discussion = budget_discussion(pr_context["discussion"], budget // 4)
+        diff_budget = (
+            budget
+            - estimate_tokens(description)
+            - estimate_tokens(self._format_discussion_for_prompt(discussion))
         )
 
+        changes = filter_changes(pr_context["changes"])
+        summarized = change_tokens(changes) > self.map_reduce_threshold
+        if summarized:
+            changes = await self._summarize_changes(pr_context, changes, diff_budget)
+        return {
+            **pr_context,
+            "description": description,
+            "discussion": discussion,
+            "changes": budget_changes(changes, diff_budget),
+            "changes_summarized": summarized,
+        }
+
+    async def _summarize_changes(
+        self, pr_context: Dict, changes: List[Dict], chunk_tokens: int
+    ) -> List[Dict]:
+        """Map step for very large PRs: summarize groups of files concurrently,
+        returning changes whose only hunk is each file's summary."""
+        groups = group_changes(changes, chunk_tokens)
+        # Files past the last group are listed without a summary
+        unsummarized = [
+            {**change, "changes": []}
+            for group in groups[self.max_map_chunks :]
+            for change in group
+        ]
+        groups = groups[: self.max_map_chunks]
+        slots = asyncio.Semaphore(self.map_concurrency)
+
+        async def summarize(group: List[Dict]) -> Dict:
+            prompt = (
+                "Summarize the changes to each file below, part of the pull "
+                f"request \"{pr_context['title']}\".\n\n"
+                f"Changes:\n{self._format_changes_for_prompt(group)}\n\n"
+                "Format the response as a JSON object mapping each file path to "
+                "a short paragraph describing its changes."
+            )
+            async with slots:
+                return await self._complete_json(
+                    [
+                        {"role": "system", "content": SYSTEM_PROMPT},
+                        {"role": "user", "content": prompt},
+                    ]
+                )
+
+        summaries = await asyncio.gather(*(summarize(group) for group in groups))
+        return [
+            {
+                **change,
+                "changes": (
+                    [str(summary[change["file"]])] if change["file"] in summary else []
+                ),
+            }
+            for group, summary in zip(groups, summaries)
+            for change in group
+        ] + unsummarized
+
+    async def _complete_json(self, messages: List[Dict]) -> Dict:
+        """Run a JSON-mode chat completion, reusing a cached answer to an
+        identical request."""
+        request = {
+            "model": self.model,
+            "messages": messages,
+            "temperature": self.temperature,
+            "response_format": {"type": "json_object"},
+        }
+        fingerprint = analysis_fingerprint(request)
+        cached = await self._cache_get(fingerprint)
+        if cached is not None:
+            self.cache_hits += 1
+            return cached
+        self.cache_misses += 1
+
+        content = await self.provider.complete_json(messages, self.temperature)
+
         try:
-            if response.choices[0].message.content is None:
-                raise ValueError("No content in response")
-            analysis = json.loads(response.choices[0].message.content)
-            return analysis
+            analysis = json.loads(content)
         except json.JSONDecodeError as e:
             raise ValueError(f"Failed to parse AI response: {e}")
+        await self._cache_set(fingerprint, analysis)
+        return analysis
+
+    async def _cache_get(self, fingerprint: str) -> Optional[Dict]:
+        if self.cache is None:
+            return None
+        try:
+            return await self.cache.get(fingerprint)
+        except Exception as e:
+            # The cache only saves LLM calls; never fail an analysis over it
+            logging.warning(f"Analysis cache lookup failed: {e}")
+            return None
+
+    async def _cache_set(self, fingerprint: str, analysis: Dict) -> None:
+        if self.cache is None:
+            return
+        try:
+            await self.cache.set(fingerprint, self.model, analysis)
+        except Exception as e:
+            logging.warning(f"Failed to store analysis in the cache: {e}")
 
     async def create_embeddings(self, analysis: Dict) -> List[float]:
         """Create embeddings from the AI analysis"""
         # Combine relevant fields into a single text for embedding
         text_to_embed = f"{analysis['summary']} {analysis['impact_details']} {' '.join(analysis['key_points'])}"
 
-        response = await self.client.embeddings.create(
-            model="text-embedding-3-small", input=text_to_embed
-        )
+        def request():
+            return self.client.embeddings.create(
+                model="text-embedding-3-small", input=text_to_embed
+            )
+
+        if self.rate_limiter is None:
+            response = await request()
+        else:
+            response = await self.rate_limiter.call(
+                "text-embedding-3-small", estimate_tokens(text_to_embed), request
+            )
 
         return response.data[0].embedding
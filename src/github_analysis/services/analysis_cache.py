@@ -0,0 +1,108 @@
+"""Cache of LLM PR analyses keyed by a fingerprint of the request.
+
+The fingerprint covers everything that decides the answer: model,
+temperature, response format and the full messages, which embed the PR's
+title, description, diff and discussion. Any change to those, or to the
+prompt template, gives a new fingerprint, so stale analyses are never
+reused and need no explicit invalidation.
+"""
+
+import hashlib
+import json
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import AsyncContextManager, Callable, Dict, Optional
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from github_analysis.config import Settings
+from github_analysis.models.models import AnalysisCacheEntry
+
+
+def analysis_fingerprint(request: Dict) -> str:
+    """sha256 of the chat completion request parameters."""
+    canonical = json.dumps(request, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class AnalysisCache(ABC):
+    """Storage backend for LLM analyses, keyed by request fingerprint."""
+
+    @abstractmethod
+    async def get(self, fingerprint: str) -> Optional[Dict]: ...
+
+    @abstractmethod
+    async def set(self, fingerprint: str, model: str, analysis: Dict) -> None: ...
+
+
+class InMemoryAnalysisCache(AnalysisCache):
+    """Process-local LRU cache; analyses are lost on restart."""
+
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, Dict] = OrderedDict()
+
+    async def get(self, fingerprint: str) -> Optional[Dict]:
+        analysis = self._entries.get(fingerprint)
+        if analysis is not None:
+            self._entries.move_to_end(fingerprint)
+        return analysis
+
+    async def set(self, fingerprint: str, model: str, analysis: Dict) -> None:
+        self._entries[fingerprint] = analysis
+        self._entries.move_to_end(fingerprint)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class DatabaseAnalysisCache(AnalysisCache):
+    """Postgres-backed cache shared by every worker and kept across restarts."""
+
+    def __init__(
+        self, session_factory: Callable[[], AsyncContextManager[AsyncSession]]
+    ):
+        self.session_factory = session_factory
+
+    async def get(self, fingerprint: str) -> Optional[Dict]:
+        async with self.session_factory() as session:
+            return await session.scalar(
+                select(AnalysisCacheEntry.analysis).where(
+                    AnalysisCacheEntry.fingerprint == fingerprint
+                )
+            )
+
+    async def set(self, fingerprint: str, model: str, analysis: Dict) -> None:
+        statement = insert(AnalysisCacheEntry).values(
+            fingerprint=fingerprint,
+            model=model,
+            analysis=analysis,
+            created_at=datetime.now(timezone.utc),
+        )
+        async with self.session_factory() as session:
+            await session.execute(
+                statement.on_conflict_do_update(
+                    index_elements=[AnalysisCacheEntry.fingerprint],
+                    set_={
+                        "analysis": statement.excluded.analysis,
+                        "created_at": statement.excluded.created_at,
+                    },
+                )
+            )
+            await session.commit()
+
+
+def create_analysis_cache(
+    settings: Settings,
+    session_factory: Callable[[], AsyncContextManager[AsyncSession]],
+) -> Optional[AnalysisCache]:
+    """Build the analysis cache selected by ``LLM_CACHE``."""
+    if settings.LLM_CACHE == "memory":
+        return InMemoryAnalysisCache(settings.LLM_CACHE_SIZE)
+    elif settings.LLM_CACHE == "database":
+        return DatabaseAnalysisCache(session_factory)
+    elif settings.LLM_CACHE == "none":
+        return None
+    raise ValueError(f"Unknown LLM_CACHE backend: {settings.LLM_CACHE}")
@@ -1,14 +1,66 @@
+import asyncio
 import logging
-from typing import Dict, Tuple
+import uuid
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
 from qdrant_client import QdrantClient
 from qdrant_client.http import models
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import joinedload
 
-from github_analysis.models.models import PullRequest, PRAnalysis, PRDiff
+from github_analysis.models.models import PRAnalysis, PullRequest
 from github_analysis.services.ai_service import AIService
 from github_analysis.services.embedding import EmbeddingService, EmbeddingType
+from github_analysis.services.job_queue import PermanentJobError
+from github_analysis.services.pr_context import (
+    find_pr_id,
+    load_pr_context,
+    load_pr_contexts,
+)
+from github_analysis.services.prompt_budget import filter_changes
+
+# Payload embedding_type of the per-chunk points of a raw diff
+CHUNK_EMBEDDING_TYPE = "raw_diff_chunk"
+# Payload identifying the PR of every point
+PR_PAYLOAD_KEYS = ("pr_db_id", "pr_number", "repo")
+# Namespace of the uuid5 ids of chunk points, derived from PR database id and
+# index
+CHUNK_NAMESPACE = uuid.UUID("3b0f5a6e-9c1d-4e27-8f43-2d6a7b1c9e05")
+
+
+@dataclass
+class PreparedAnalysis:
+    """What to embed and store for one PR."""
+
+    texts: List[str]  # The summary text, or the raw diff's chunks
+    metadata: Dict
+    summary: Optional[str] = None
+    # File of each text when the texts are raw diff chunks
+    chunk_files: Optional[List[str]] = None
+
+
+def aggregate_chunk_scores(
+    matches: List[List[Tuple[int, float]]],
+) -> List[Tuple[int, float, int]]:
+    """Combine per-chunk search results into PR scores, best first.
+
+    ``matches`` holds the ``(pr_id, score)`` hits of each query chunk. A PR
+    scores its best hit per query chunk averaged over all query chunks, so
+    PRs similar to more of the query rank higher. Returns
+    ``(pr_id, score, matched_chunks)``.
+    """
+    best: Dict[int, List[float]] = defaultdict(lambda: [0.0] * len(matches))
+    for query_index, hits in enumerate(matches):
+        for pr_id, score in hits:
+            scores = best[pr_id]
+            scores[query_index] = max(scores[query_index], score)
+    ranked = [
+        (pr_id, sum(scores) / len(matches), sum(1 for s in scores if s > 0))
+        for pr_id, scores in best.items()
+    ]
+    return sorted(ranked, key=lambda item: item[1], reverse=True)
 
 
 class AnalysisService:
@@ -18,114 +70,214 @@ class AnalysisService:
         qdrant_client: QdrantClient,
         ai_service: AIService,
         embedding_service: EmbeddingService,
+        llm_concurrency: int = 4,
+        batch_size: int = 20,
+        collection_name: str = "github_changes",
     ):
         self.db = db
         self.qdrant = qdrant_client
         self.ai = ai_service
         self.embedding_service = embedding_service
+        self.llm_concurrency = max(1, llm_concurrency)
+        self.batch_size = max(1, batch_size)
+        self.collection_name = collection_name
 
+        # Vectors are sized by the embedding provider
         try:
-            self.qdrant.get_collection("github_changes")
+            collection = self.qdrant.get_collection(collection_name)
         except Exception:
             self.qdrant.create_collection(
-                collection_name="github_changes",
+                collection_name=collection_name,
                 vectors_config=models.VectorParams(
-                    size=1536,
+                    size=embedding_service.dimensions,
                     distance=models.Distance.COSINE,
                 ),
             )
+        else:
+            size = collection.config.params.vectors.size
+            if size != embedding_service.dimensions:
+                raise ValueError(
+                    f"Qdrant collection {collection_name} holds {size}-dimensional "
+                    f"vectors, but {embedding_service.model} embeds "
+                    f"{embedding_service.dimensions}; use another collection"
+                )
 
-    async def get_pr_context(self, pr_id: int) -> Tuple[Dict, int]:
-        """Get all PR data and its database ID"""
-        query = (
-            select(PullRequest)
-            .where(PullRequest.number == pr_id)
-            .options(
-                joinedload(PullRequest.diffs).joinedload(PRDiff.hunks),
-                joinedload(PullRequest.comments),
-            )
-        )
-
-        result = await self.db.execute(query)
-        pr = result.unique().scalar_one_or_none()
+    async def get_pr_context(
+        self, pr_id: int, owner: Optional[str] = None, repo: Optional[str] = None
+    ) -> Tuple[Dict, int]:
+        """Get all PR data and its database ID.
 
-        if not pr:
-            raise ValueError(f"PR number {pr_id} not found")
+        PR numbers are only unique within a repository; ``owner`` and ``repo``
+        are needed once PRs from several repositories are stored.
+        """
+        return await load_pr_context(self.db, pr_id, owner, repo)
 
-        diff_context = []
-        for diff in pr.diffs:
-            diff_context.append(
-                {
-                    "file": diff.file_path,
-                    "change_type": diff.change_type.value,
-                    "changes": [hunk.content for hunk in diff.hunks],
-                }
-            )
+    async def get_pr_db_id(
+        self, pr_id: int, owner: Optional[str] = None, repo: Optional[str] = None
+    ) -> int:
+        """Database ID of a PR number; see ``get_pr_context``."""
+        return await find_pr_id(self.db, pr_id, owner, repo)
 
-        # Create comments_context from PR comments
-        comments_context = [
-            {"author": c.user_login, "comment": c.body} for c in pr.comments
-        ]
+    # Points are keyed by the PR's database id: PR numbers repeat across
+    # repositories
 
-        return {
-            "id": pr.number,
-            "title": pr.title,
-            "description": pr.body,
-            "changes": diff_context,
-            "discussion": comments_context,
-        }, pr.id
+    @staticmethod
+    def _point_id(db_id: int, embedding_type: EmbeddingType) -> int:
+        # Even numbers for AI_SUMMARY, odd numbers for RAW_DIFF
+        return db_id * 2 + (0 if embedding_type == EmbeddingType.AI_SUMMARY else 1)
 
-    async def process_pr(
-        self, pr_id: int, embedding_type: EmbeddingType = EmbeddingType.AI_SUMMARY
-    ):
-        pr_context, db_id = await self.get_pr_context(pr_id)
+    @staticmethod
+    def _chunk_point_id(db_id: int, index: int) -> str:
+        return str(uuid.uuid5(CHUNK_NAMESPACE, f"{db_id}:{index}"))
 
+    async def _prepare_analysis(
+        self, pr_context: Dict, embedding_type: EmbeddingType
+    ) -> PreparedAnalysis:
+        """Work out the texts to embed, the metadata to store and the
+        summary."""
         if embedding_type == EmbeddingType.AI_SUMMARY:
             try:
                 # Get AI analysis first
                 content = await self.ai.analyze_pr(pr_context)
-                metadata = content  # Full AI analysis as metadata
-                summary = content.get("summary")
+                text = self.embedding_service.prepare_text_for_embedding(
+                    content, embedding_type
+                )
+                # Full AI analysis as metadata
+                return PreparedAnalysis([text], content, content.get("summary"))
             except Exception as e:
-                logging.error(f"Failed to get AI analysis for PR {pr_id}: {e}")
+                logging.error(
+                    f"Failed to get AI analysis for PR {pr_context['id']}: {e}"
+                )
                 # Fall back to raw diff for AI_SUMMARY if analysis fails
-                content = {"changes": pr_context["changes"]}
-                metadata = {"raw_diff": True, "changes": pr_context["changes"]}
-                summary = None
-            point_id = pr_id * 2  # Even numbers for AI_SUMMARY
+
+        # Use raw diff content, one vector per token-bounded chunk
+        metadata = {"raw_diff": True, "changes": pr_context["changes"]}
+        chunks = self.embedding_service.prepare_chunks_for_embedding(
+            filter_changes(pr_context["changes"])
+        )
+        if not chunks:
+            return PreparedAnalysis([pr_context["title"]], metadata)
+        return PreparedAnalysis(
+            [text for _, text in chunks],
+            metadata,
+            chunk_files=[file for file, _ in chunks],
+        )
+
+    def _build_points(
+        self,
+        db_id: int,
+        pr_context: Dict,
+        embedding_type: EmbeddingType,
+        prepared: PreparedAnalysis,
+        vectors: List[List[float]],
+    ) -> Tuple[List[models.PointStruct], List[float]]:
+        """Qdrant points for one PR, and the vector that stands for the PR.
+
+        Raw diff chunks get a point each; the PR's own point then holds the
+        mean of the chunk vectors.
+        """
+        pr_payload = {
+            "pr_db_id": db_id,
+            "pr_number": pr_context["id"],
+            "repo": pr_context["repo"],
+        }
+        chunk_points = []
+        if prepared.chunk_files is None:
+            pr_vector = vectors[0]
         else:
-            # Use raw diff content
-            content = {"changes": pr_context["changes"]}
-            metadata = {"raw_diff": True, "changes": pr_context["changes"]}
-            summary = None
-            point_id = pr_id * 2 + 1  # Odd numbers for RAW_DIFF
-
-        text_for_embedding = self.embedding_service.prepare_text_for_embedding(
-            content, embedding_type
+            pr_vector = [sum(values) / len(vectors) for values in zip(*vectors)]
+            chunk_points = [
+                models.PointStruct(
+                    id=self._chunk_point_id(db_id, index),
+                    vector=vector,
+                    payload={
+                        **pr_payload,
+                        "embedding_type": CHUNK_EMBEDDING_TYPE,
+                        "file": file,
+                        "chunk": index,
+                    },
+                )
+                for index, (file, vector) in enumerate(
+                    zip(prepared.chunk_files, vectors)
+                )
+            ]
+        pr_point = models.PointStruct(
+            id=self._point_id(db_id, embedding_type),
+            vector=pr_vector,
+            payload={
+                **pr_payload,
+                "context": pr_context,
+                "content": prepared.metadata,
+                "embedding_type": embedding_type.value,
+            },
+        )
+        return [pr_point, *chunk_points], pr_vector
+
+    @staticmethod
+    def _replaces_chunks(
+        embedding_type: EmbeddingType, prepared: PreparedAnalysis
+    ) -> bool:
+        """Whether storing ``prepared`` supersedes the PR's stored raw diff
+        chunks; a raw diff without chunks leaves none behind either."""
+        return (
+            embedding_type == EmbeddingType.RAW_DIFF or prepared.chunk_files is not None
+        )
+
+    def _delete_chunks(self, db_ids: List[int]) -> None:
+        """Drop stored raw diff chunks, which a new diff may have fewer of."""
+        self.qdrant.delete(
+            collection_name=self.collection_name,
+            points_selector=models.FilterSelector(
+                filter=models.Filter(
+                    must=[
+                        models.FieldCondition(
+                            key="embedding_type",
+                            match=models.MatchValue(value=CHUNK_EMBEDDING_TYPE),
+                        ),
+                        models.FieldCondition(
+                            key="pr_db_id", match=models.MatchAny(any=db_ids)
+                        ),
+                    ]
+                )
+            ),
+        )
+
+    async def process_pr(
+        self,
+        pr_id: int,
+        embedding_type: EmbeddingType = EmbeddingType.AI_SUMMARY,
+        owner: Optional[str] = None,
+        repo: Optional[str] = None,
+    ):
+        pr_context, db_id = await self.get_pr_context(pr_id, owner, repo)
+        prepared = await self._prepare_analysis(pr_context, embedding_type)
+        point_id = self._point_id(db_id, embedding_type)
+        if len(prepared.texts) == 1:
+            # Shares a request with concurrent analyses
+            vectors = [await self.embedding_service.create_embedding(prepared.texts[0])]
+        else:
+            vectors = await self.embedding_service.create_embeddings_batch(
+                prepared.texts
+            )
+        points, embeddings = self._build_points(
+            db_id, pr_context, embedding_type, prepared, vectors
         )
-        embeddings = await self.embedding_service.create_embedding(text_for_embedding)
 
         # Store embedding in Qdrant
-        logging.info(f"Storing embedding for PR {pr_id} in Qdrant")
+        logging.info(f"Storing {len(points)} points for PR {pr_id} in Qdrant")
         try:
-            self.qdrant.upsert(
-                collection_name="github_changes",
-                points=[
-                    models.PointStruct(
-                        id=point_id,
-                        vector=embeddings,
-                        payload={
-                            "context": pr_context,
-                            "content": metadata,
-                            "embedding_type": embedding_type.value,
-                        },
-                    )
-                ],
+            # The Qdrant client is synchronous; keep other jobs and requests
+            # moving
+            if self._replaces_chunks(embedding_type, prepared):
+                await asyncio.to_thread(self._delete_chunks, [db_id])
+            await asyncio.to_thread(
+                self.qdrant.upsert, collection_name=self.collection_name, points=points
             )
 
             # Verify point was stored
-            stored_point = self.qdrant.retrieve(
-                collection_name="github_changes",
+            stored_point = await asyncio.to_thread(
+                self.qdrant.retrieve,
+                collection_name=self.collection_name,
                 ids=[point_id],
             )
             if not stored_point:
@@ -140,15 +292,299 @@ class AnalysisService:
         analysis = PRAnalysis(
             pr_id=db_id,
             embedding=embeddings,
-            summary=summary,
-            analysis_metadata=metadata,
+            summary=prepared.summary,
+            analysis_metadata=prepared.metadata,
         )
         self.db.add(analysis)
         await self.db.commit()
 
         return {
             "pr_id": pr_id,
-            "content": metadata,
+            "content": prepared.metadata,
             "embedding_type": embedding_type.value,
             "stored": True,
         }
+
+    async def find_similar_prs(
+        self,
+        pr_id: int,
+        embedding_type: EmbeddingType = EmbeddingType.RAW_DIFF,
+        limit: int = 5,
+        owner: Optional[str] = None,
+        repo: Optional[str] = None,
+    ) -> List[Dict]:
+        """PRs most similar to an analyzed PR, best first, from any stored
+        repository.
+
+        A raw diff stored in chunks is compared chunk by chunk: every chunk is
+        searched for among other PRs' chunks and the hits are combined with
+        ``aggregate_chunk_scores``. Otherwise the PR's single vector is
+        searched for among PRs of the same embedding type. ``owner`` and
+        ``repo`` pick the PR as in ``get_pr_context``.
+        """
+        db_id = await self.get_pr_db_id(pr_id, owner, repo)
+        this_pr = [
+            models.FieldCondition(key="pr_db_id", match=models.MatchValue(value=db_id))
+        ]
+        queries: List[List[float]] = []
+        if embedding_type == EmbeddingType.RAW_DIFF:
+            chunks, _ = await asyncio.to_thread(
+                self.qdrant.scroll,
+                collection_name=self.collection_name,
+                scroll_filter=models.Filter(
+                    must=[
+                        models.FieldCondition(
+                            key="embedding_type",
+                            match=models.MatchValue(value=CHUNK_EMBEDDING_TYPE),
+                        ),
+                        *this_pr,
+                    ]
+                ),
+                limit=self.embedding_service.max_chunks,
+                with_vectors=True,
+            )
+            queries = [chunk.vector for chunk in chunks]
+        search_type = CHUNK_EMBEDDING_TYPE if queries else embedding_type.value
+        if not queries:
+            points = await asyncio.to_thread(
+                self.qdrant.retrieve,
+                collection_name=self.collection_name,
+                ids=[self._point_id(db_id, embedding_type)],
+                with_vectors=True,
+            )
+            if not points:
+                raise ValueError(
+                    f"PR number {pr_id} has no {embedding_type.value} embedding"
+                )
+            queries = [points[0].vector]
+
+        search_filter = models.Filter(
+            must=[
+                models.FieldCondition(
+                    key="embedding_type", match=models.MatchValue(value=search_type)
+                )
+            ],
+            must_not=this_pr,
+        )
+        responses = await asyncio.to_thread(
+            self.qdrant.query_batch_points,
+            collection_name=self.collection_name,
+            requests=[
+                models.QueryRequest(
+                    query=vector,
+                    filter=search_filter,
+                    # Chunks of one PR crowd each other out; look further
+                    limit=limit * 4,
+                    with_payload=list(PR_PAYLOAD_KEYS),
+                )
+                for vector in queries
+            ],
+        )
+        found = {}
+        matches = []
+        for response in responses:
+            for point in response.points:
+                found[point.payload["pr_db_id"]] = point.payload
+            matches.append(
+                [(point.payload["pr_db_id"], point.score) for point in response.points]
+            )
+        return [
+            {
+                "pr_id": found[match_id]["pr_number"],
+                "repo": found[match_id]["repo"],
+                "score": score,
+                "matched_chunks": matched,
+            }
+            for match_id, score, matched in aggregate_chunk_scores(matches)[:limit]
+        ]
+
+    async def run_job(self, kind: str, params: Dict) -> Dict:
+        """Run a background analysis job (see ``job_queue``)."""
+        embedding_type = EmbeddingType(
+            params.get("embedding_type", EmbeddingType.AI_SUMMARY.value)
+        )
+        if kind == "analyze_pr":
+            return await self.process_pr(
+                params["pr_id"],
+                embedding_type,
+                owner=params.get("owner"),
+                repo=params.get("repo"),
+            )
+        elif kind == "analyze_prs":
+            return await self.process_prs(
+                params.get("pr_ids"),
+                owner=params.get("owner"),
+                repo=params.get("repo"),
+                embedding_type=embedding_type,
+            )
+        raise PermanentJobError(f"Unknown analysis job kind: {kind}")
+
+    async def _select_prs(
+        self,
+        pr_ids: Optional[List[int]],
+        owner: Optional[str],
+        repo: Optional[str],
+        results: Dict,
+    ) -> List[int]:
+        """Database ids of the PRs to analyze; numbers that are missing or
+        ambiguous across repositories are reported in ``results``."""
+        query = select(PullRequest.id, PullRequest.number).order_by(PullRequest.id)
+        if pr_ids is not None:
+            query = query.where(PullRequest.number.in_(pr_ids))
+        if owner is not None and repo is not None:
+            query = query.where(
+                PullRequest.repo_owner == owner, PullRequest.repo_name == repo
+            )
+        rows = (await self.db.execute(query)).all()
+
+        counts = Counter(number for _, number in rows)
+        for number in dict.fromkeys(pr_ids or []):
+            if counts[number] == 0:
+                results["errors"].append(
+                    {"pr_id": number, "detail": f"PR number {number} not found"}
+                )
+            elif counts[number] > 1:
+                results["errors"].append(
+                    {
+                        "pr_id": number,
+                        "detail": f"PR number {number} exists in several "
+                        "repositories; pass owner and repo",
+                    }
+                )
+        return [db_id for db_id, number in rows if counts[number] == 1]
+
+    async def process_prs(
+        self,
+        pr_ids: Optional[List[int]] = None,
+        owner: Optional[str] = None,
+        repo: Optional[str] = None,
+        embedding_type: EmbeddingType = EmbeddingType.AI_SUMMARY,
+    ) -> Dict:
+        """Analyze many PRs, selected by number, by repository, or both.
+
+        Work is pipelined. Contexts are loaded ``batch_size`` PRs at a time, up
+        to ``llm_concurrency`` LLM calls run at once, and analyzed PRs are
+        stored in batches: one embeddings call, one Qdrant upsert and one
+        commit per batch.
+        """
+        if pr_ids is None and (owner is None or repo is None):
+            raise ValueError("Pass PR numbers, a repository, or both")
+
+        results = {"processed": [], "errors": []}
+        db_ids = await self._select_prs(pr_ids, owner, repo, results)
+
+        # Holds a batch for the writer plus what the LLM calls in flight hand
+        # over; once full, analysis waits for the writer to catch up
+        analyzed: asyncio.Queue = asyncio.Queue(
+            maxsize=self.batch_size + self.llm_concurrency
+        )
+        llm_slots = asyncio.Semaphore(self.llm_concurrency)
+        # The session must not be used by two tasks at once
+        db_lock = asyncio.Lock()
+        tasks: Set[asyncio.Task] = set()
+
+        async def analyze(db_id: int, pr_context: Dict) -> None:
+            try:
+                prepared = await self._prepare_analysis(pr_context, embedding_type)
+                await analyzed.put((db_id, pr_context, prepared))
+            except Exception as e:
+                results["errors"].append({"pr_id": pr_context["id"], "detail": str(e)})
+            finally:
+                llm_slots.release()
+
+        async def producer() -> None:
+            for start in range(0, len(db_ids), self.batch_size):
+                chunk = db_ids[start : start + self.batch_size]
+                async with db_lock:
+                    contexts = await load_pr_contexts(self.db, chunk)
+                for db_id in chunk:
+                    await llm_slots.acquire()
+                    task = asyncio.create_task(analyze(db_id, contexts[db_id]))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+            await analyzed.put(None)
+
+        async def writer() -> None:
+            done = False
+            while not done:
+                batch = [await analyzed.get()]
+                while len(batch) < self.batch_size and not analyzed.empty():
+                    batch.append(analyzed.get_nowait())
+                if batch[-1] is None:
+                    batch.pop()
+                    done = True
+                if batch:
+                    await self._store_analyses(batch, embedding_type, results, db_lock)
+
+        stages = [asyncio.create_task(producer()), asyncio.create_task(writer())]
+        try:
+            await asyncio.gather(*stages)
+        finally:
+            # After a failure, stop the analyses still in flight too
+            outstanding = [*stages, *tasks]
+            for task in outstanding:
+                task.cancel()
+            await asyncio.gather(*outstanding, return_exceptions=True)
+        return results
+
+    async def _store_analyses(
+        self,
+        batch: List[Tuple[int, Dict, PreparedAnalysis]],
+        embedding_type: EmbeddingType,
+        results: Dict,
+        db_lock: asyncio.Lock,
+    ) -> None:
+        """Embed, upsert and commit a batch of analyzed PRs together."""
+        numbers = [pr_context["id"] for _, pr_context, _ in batch]
+        try:
+            vectors = await self.embedding_service.create_embeddings_batch(
+                [text for _, _, prepared in batch for text in prepared.texts]
+            )
+            points = []
+            pr_vectors = []
+            chunked = []
+            offset = 0
+            for db_id, pr_context, prepared in batch:
+                pr_points, pr_vector = self._build_points(
+                    db_id,
+                    pr_context,
+                    embedding_type,
+                    prepared,
+                    vectors[offset : offset + len(prepared.texts)],
+                )
+                offset += len(prepared.texts)
+                points.extend(pr_points)
+                pr_vectors.append(pr_vector)
+                if self._replaces_chunks(embedding_type, prepared):
+                    chunked.append(db_id)
+
+            # The Qdrant client is synchronous; keep the pipeline moving
+            if chunked:
+                await asyncio.to_thread(self._delete_chunks, chunked)
+            await asyncio.to_thread(
+                self.qdrant.upsert, collection_name=self.collection_name, points=points
+            )
+            async with db_lock:
+                try:
+                    self.db.add_all(
+                        PRAnalysis(
+                            pr_id=db_id,
+                            embedding=pr_vector,
+                            summary=prepared.summary,
+                            analysis_metadata=prepared.metadata,
+                        )
+                        for (db_id, _, prepared), pr_vector in zip(batch, pr_vectors)
+                    )
+                    await self.db.commit()
+                except Exception:
+                    await self.db.rollback()
+                    raise
+        except Exception as e:
+            logging.error(f"Failed to store analyses for PRs {numbers}: {e}")
+            results["errors"].extend(
+                {"pr_id": number, "detail": str(e)} for number in numbers
+            )
+            return
+        logging.info(f"Stored analyses for PRs {numbers}")
+        results["processed"].extend(numbers)
@@ -0,0 +1,45 @@
+"""Stable content hashes for parsed diffs and hunks.
+
+Hashes are sha256 hex digests. Hunk text is hashed as UTF-8 and whole diffs
+over a canonical JSON encoding, so the same content always hashes the same
+regardless of where it was parsed.
+"""
+
+import hashlib
+import json
+from typing import Dict, List
+
+
+def hunk_content_hash(content: str) -> str:
+    """Key of a hunk's text in ``hunk_contents``.
+
+    Matches ``encode(sha256(convert_to(content, 'UTF8')), 'hex')`` in
+    Postgres, which the migration used to backfill existing hunks.
+    """
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def diff_content_hash(files: List[Dict]) -> str:
+    """Hash a PR's parsed diff (see ``diff_parser``), covering file paths,
+    change types and every hunk."""
+    canonical = [
+        {
+            "file_path": file["file_path"],
+            "old_file_path": file.get("old_file_path"),
+            "change_type": file["change_type"].value,
+            "truncated": file.get("truncated", False),
+            "hunks": [
+                [
+                    hunk["old_start"],
+                    hunk["old_lines"],
+                    hunk["new_start"],
+                    hunk["new_lines"],
+                    hunk["content"],
+                ]
+                for hunk in file["hunks"]
+            ],
+        }
+        for file in files
+    ]
+    encoded = json.dumps(canonical, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
@@ -0,0 +1,262 @@
+"""Single-pass, line-oriented parser for unified git diffs.
+
+The parser is a small state machine fed one line at a time, so it can run
+over a complete diff string or over an async stream of bytes straight from
+the network. A file record is yielded as soon as the next file starts, with
+the same shape ``GitHubService`` stores::
+
+    {
+        "file_path": "src/app.py",
+        "old_file_path": None,  # Set for renames
+        "change_type": ChangeType.MODIFY,
+        "truncated": False,  # Cut off at a size cap
+        "hunks": [
+            {"old_start": 1, "old_lines": 2, "new_start": 1, "new_lines": 3,
+             "content": "..."},
+        ],
+    }
+
+The change type and paths come only from the file's header lines, never from
+the hunk bodies.
+"""
+
+import codecs
+import re
+from typing import (
+    AsyncIterable,
+    AsyncIterator,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+)
+
+from github_analysis.models.models import ChangeType
+
+HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@(.*)$")
+
+
+def _strip_prefix(path: str) -> Optional[str]:
+    """Turn a ``---``/``+++`` header path into a repository path."""
+    path = path.split("\t", 1)[0]
+    if path == "/dev/null":
+        return None
+    if path.startswith(("a/", "b/")):
+        return path[2:]
+    return path
+
+
+def _paths_from_git_header(line: str) -> Optional[str]:
+    """Best-effort new path from ``diff --git a/<old> b/<new>``."""
+    rest = line[len("diff --git ") :]
+    # Unchanged paths may contain " b/", so try the symmetric split first
+    half = (len(rest) - 5) // 2
+    if half > 0 and rest[:2] == "a/" and rest[half + 2 : half + 5] == " b/":
+        if rest[2 : half + 2] == rest[half + 5 :]:
+            return rest[half + 5 :]
+    index = rest.rfind(" b/")
+    return rest[index + 3 :] if index != -1 else None
+
+
+class DiffParser:
+    """Incremental unified diff parser.
+
+    Call ``feed`` with each line (without its newline) and ``close`` at the
+    end; both return the file records completed by that call.
+
+    Hunk text beyond ``max_file_size`` bytes in one file is dropped and the
+    file is marked ``truncated``. Once ``max_size`` bytes of diff have been
+    fed, the parser stops at the last complete line below the cap, marks the
+    file in progress as truncated and sets ``truncated`` on itself; the
+    remaining lines are ignored, so callers can stop reading.
+    """
+
+    def __init__(
+        self, max_file_size: Optional[int] = None, max_size: Optional[int] = None
+    ):
+        self.max_file_size = max_file_size
+        self.max_size = max_size
+        self.truncated = False
+        self._size = 0
+        self._fed = False
+        self._file: Optional[Dict] = None
+        self._file_size = 0
+        self._hunk: Optional[Dict] = None
+        self._hunk_lines: List[str] = []
+        self._in_header = False
+
+    def feed(self, line: str) -> List[Dict]:
+        if self.truncated:
+            return []
+        line_size = len(line.encode("utf-8", "replace"))
+        if self._fed:
+            # The newline ending the previous line; a diff ending in a newline
+            # is split with an empty final line, so every newline is counted
+            # once and a final line without one costs nothing extra
+            line_size += 1
+        self._fed = True
+        self._size += line_size
+        if self.max_size is not None and self._size > self.max_size:
+            self.truncated = True
+            if self._file is not None:
+                self._file["truncated"] = True
+            return []
+
+        if line.startswith("diff --git "):
+            completed = self._finish_file()
+            self._start_file(line)
+            return completed
+
+        if self._file is None:
+            return []  # Preamble before the first file, e.g. a commit message
+
+        if self._file["truncated"]:
+            return []
+
+        if line.startswith("@@"):
+            match = HUNK_HEADER.match(line)
+            if match:
+                self._finish_hunk()
+                self._start_hunk(match)
+                return []
+
+        if self._hunk is not None:
+            self._file_size += line_size
+            if self.max_file_size is not None and self._file_size > self.max_file_size:
+                self._file["truncated"] = True
+                self._finish_hunk()
+            else:
+                self._hunk_lines.append(line)
+        elif self._in_header:
+            self._parse_header_line(line)
+        return []
+
+    def close(self) -> List[Dict]:
+        return self._finish_file()
+
+    def _start_file(self, line: str) -> None:
+        self._file = {
+            "file_path": _paths_from_git_header(line),
+            "old_file_path": None,
+            "change_type": ChangeType.MODIFY,
+            "truncated": False,
+            "hunks": [],
+        }
+        self._file_size = 0
+        self._in_header = True
+
+    def _parse_header_line(self, line: str) -> None:
+        file = self._file
+        if line.startswith("new file mode"):
+            file["change_type"] = ChangeType.ADD
+        elif line.startswith("deleted file mode"):
+            file["change_type"] = ChangeType.DELETE
+        elif line.startswith("rename from "):
+            file["change_type"] = ChangeType.RENAME
+            file["old_file_path"] = line[len("rename from ") :]
+        elif line.startswith("rename to "):
+            file["file_path"] = line[len("rename to ") :]
+        elif line.startswith("copy from "):
+            # There is no copy change type; the copy is a new file
+            file["change_type"] = ChangeType.ADD
+        elif line.startswith("copy to "):
+            file["file_path"] = line[len("copy to ") :]
+        elif line.startswith("--- "):
+            old_path = _strip_prefix(line[4:])
+            if old_path and file["change_type"] == ChangeType.DELETE:
+                file["file_path"] = old_path
+        elif line.startswith("+++ "):
+            new_path = _strip_prefix(line[4:])
+            if new_path:
+                file["file_path"] = new_path
+
+    def _start_hunk(self, match: re.Match) -> None:
+        old_start, old_lines, new_start, new_lines, heading = match.groups()
+        # "@@ -a +b @@" means a single line on each side
+        self._hunk = {
+            "old_start": int(old_start),
+            "old_lines": int(old_lines) if old_lines is not None else 1,
+            "new_start": int(new_start),
+            "new_lines": int(new_lines) if new_lines is not None else 1,
+        }
+        self._hunk_lines = [heading]
+        self._in_header = False
+
+    def _finish_hunk(self) -> None:
+        if self._hunk is None:
+            return
+        self._hunk["content"] = "\n".join(self._hunk_lines).strip()
+        self._file["hunks"].append(self._hunk)
+        self._hunk = None
+        self._hunk_lines = []
+
+    def _finish_file(self) -> List[Dict]:
+        if self._file is None:
+            return []
+        self._finish_hunk()
+        file, self._file = self._file, None
+        return [file]
+
+
+def iter_file_diffs(
+    lines: Iterable[str], parser: Optional[DiffParser] = None
+) -> Iterator[Dict]:
+    """Parse diff lines, yielding each file record as soon as it is complete.
+
+    Pass a configured ``parser`` to apply size caps and inspect it afterwards.
+    """
+    parser = parser or DiffParser()
+    for line in lines:
+        yield from parser.feed(line)
+        if parser.truncated:
+            break
+    yield from parser.close()
+
+
+def parse_diff(diff_content: str, parser: Optional[DiffParser] = None) -> List[Dict]:
+    """Parse a complete diff string into file records."""
+    return list(iter_file_diffs(diff_content.split("\n"), parser))
+
+
+async def aiter_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[str]:
+    """Split a stream of UTF-8 byte chunks into lines, without the newline.
+
+    Multi-byte characters split across chunk boundaries are decoded correctly;
+    invalid bytes are replaced rather than failing the whole diff.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    # Pieces of the line still waiting for its newline; only newly decoded
+    # text is split, so a long line costs linear time however it is chunked
+    pending: List[str] = []
+    async for chunk in chunks:
+        text = decoder.decode(chunk)
+        if "\n" not in text:
+            pending.append(text)
+            continue
+        first, *lines, last = text.split("\n")
+        pending.append(first)
+        yield "".join(pending)
+        for line in lines:
+            yield line
+        pending = [last]
+    pending.append(decoder.decode(b"", final=True))
+    yield "".join(pending)
+
+
+async def aiter_file_diffs(
+    chunks: AsyncIterable[bytes], parser: Optional[DiffParser] = None
+) -> AsyncIterator[Dict]:
+    """Parse a diff arriving as a byte stream, yielding file records as they
+    complete.
+
+    Reading stops as soon as ``parser`` hits its ``max_size`` cap.
+    """
+    parser = parser or DiffParser()
+    async for line in aiter_lines(chunks):
+        for file in parser.feed(line):
+            yield file
+        if parser.truncated:
+            break
+    for file in parser.close():
+        yield file
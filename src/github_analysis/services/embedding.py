@@ -1,7 +1,15 @@
 # services/embedding_service.py
+import asyncio
+import logging
 from enum import Enum
-from typing import List, Dict
-from openai import AsyncOpenAI
+from typing import Dict, List, Optional, Tuple
+
+from github_analysis.services.embedding_cache import EmbeddingCache, text_hash
+from github_analysis.services.embedding_providers import (
+    EmbeddingProvider,
+    OpenAIEmbeddingProvider,
+)
+from github_analysis.services.tokens import estimate_tokens, trim_text
 
 
 class EmbeddingType(Enum):
@@ -9,16 +17,151 @@ class EmbeddingType(Enum):
     RAW_DIFF = "raw_diff"
 
 
+def pack_batches(texts: List[str], max_inputs: int, max_tokens: int) -> List[List[int]]:
+    """Group text indices, in order, into requests of at most ``max_inputs``
+    texts and ``max_tokens`` estimated tokens. A text over the token budget
+    gets a request of its own."""
+    batches: List[List[int]] = []
+    tokens = 0
+    for index, text in enumerate(texts):
+        text_tokens = estimate_tokens(text)
+        if (
+            not batches
+            or len(batches[-1]) >= max_inputs
+            or tokens + text_tokens > max_tokens
+        ):
+            batches.append([])
+            tokens = 0
+        batches[-1].append(index)
+        tokens += text_tokens
+    return batches
+
+
 class EmbeddingService:
-    def __init__(self, api_key: str):
-        self.client = AsyncOpenAI(api_key=api_key)
+    """Creates embeddings with as few API requests as possible.
+
+    ``create_embeddings_batch`` packs many texts into each request, up to
+    ``max_batch_inputs`` texts and ``max_batch_tokens`` estimated tokens.
+    ``create_embedding`` calls made within ``batch_wait`` seconds of each
+    other, e.g. by concurrent analyses, are sent together the same way, so
+    share one service across the app.
+
+    Vectors come from ``provider``, OpenAI's API unless another backend is
+    given (see ``embedding_providers``); ``model`` and ``dimensions`` are
+    the provider's. With a ``cache``, only texts whose embedding for this
+    model and size is not cached reach the provider; ``cache_hits`` and
+    ``cache_misses`` count texts looked up.
+
+    Raw diffs are embedded as chunks of at most ``chunk_tokens`` estimated
+    tokens, at most ``max_chunks`` per PR (see
+    ``prepare_chunks_for_embedding``).
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        max_batch_inputs: int = 2048,
+        max_batch_tokens: int = 250_000,
+        batch_wait: float = 0.01,
+        cache: Optional[EmbeddingCache] = None,
+        model: str = "text-embedding-3-small",
+        dimensions: Optional[int] = None,
+        chunk_tokens: int = 2000,
+        max_chunks: int = 64,
+        provider: Optional[EmbeddingProvider] = None,
+    ):
+        self.provider = provider or OpenAIEmbeddingProvider(api_key, model, dimensions)
+        self.cache = cache
+        self.model = self.provider.model
+        self.dimensions = self.provider.dimensions
+        self.chunk_tokens = chunk_tokens
+        self.max_chunks = max(1, max_chunks)
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.max_batch_inputs = max_batch_inputs
+        self.max_batch_tokens = max_batch_tokens
+        self.batch_wait = batch_wait
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._flush_task: Optional[asyncio.Task] = None
 
     async def create_embedding(self, text: str) -> List[float]:
         """Create embedding from any text content"""
-        response = await self.client.embeddings.create(
-            model="text-embedding-3-small", input=text
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((text, future))
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush())
+        return await future
+
+    async def _flush(self) -> None:
+        try:
+            await asyncio.sleep(self.batch_wait)
+        finally:
+            self._flush_task = None
+        pending, self._pending = self._pending, []
+        try:
+            embeddings = await self.create_embeddings_batch(
+                [text for text, _ in pending]
+            )
+        except Exception as e:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), embedding in zip(pending, embeddings):
+            if not future.done():  # The caller may have been cancelled
+                future.set_result(embedding)
+
+    async def _embed(self, texts: List[str]) -> List[List[float]]:
+        return await self.provider.embed(texts)
+
+    async def close(self) -> None:
+        await self.provider.close()
+
+    async def create_embeddings_batch(self, texts: List[str]) -> List[List[float]]:
+        """Create embeddings for many texts, in order, packing them into as
+        few requests as the batch budgets allow"""
+        hashes = [text_hash(text) for text in texts]
+        found = await self._cache_get(hashes)
+        # Each distinct uncached text is embedded once
+        missing = {
+            hash_: text for hash_, text in zip(hashes, texts) if hash_ not in found
+        }
+        misses = sum(1 for hash_ in hashes if hash_ in missing)
+        self.cache_hits += len(texts) - misses
+        self.cache_misses += misses
+
+        to_embed = list(missing.values())
+        batches = pack_batches(to_embed, self.max_batch_inputs, self.max_batch_tokens)
+        results = await asyncio.gather(
+            *(self._embed([to_embed[index] for index in batch]) for batch in batches)
+        )
+        created = dict(
+            zip(
+                missing,
+                (embedding for embeddings in results for embedding in embeddings),
+            )
         )
-        return response.data[0].embedding
+        await self._cache_set(created)
+        found.update(created)
+        return [found[hash_] for hash_ in hashes]
+
+    async def _cache_get(self, hashes: List[str]) -> Dict[str, List[float]]:
+        if self.cache is None:
+            return {}
+        try:
+            return await self.cache.get_many(self.model, self.dimensions, hashes)
+        except Exception as e:
+            # The cache only saves API calls; never fail an embedding over it
+            logging.warning(f"Embedding cache lookup failed: {e}")
+            return {}
+
+    async def _cache_set(self, vectors: Dict[str, List[float]]) -> None:
+        if self.cache is None or not vectors:
+            return
+        try:
+            await self.cache.set_many(self.model, self.dimensions, vectors)
+        except Exception as e:
+            logging.warning(f"Failed to store embeddings in the cache: {e}")
 
     def prepare_text_for_embedding(
         self, content: Dict, embedding_type: EmbeddingType
@@ -33,3 +176,30 @@ class EmbeddingService:
                 changes.append(f"File: {change['file']} ({change['change_type']})")
                 changes.extend(change["changes"])
             return "\n".join(changes)
+
+    def prepare_chunks_for_embedding(
+        self, changes: List[Dict]
+    ) -> List[Tuple[str, str]]:
+        """Split raw diff changes into ``(file, text)`` chunks, each headed by
+        its file line.
+
+        A file is one chunk, or several split at hunk boundaries when it is
+        over ``chunk_tokens``; a single hunk over that is cut. Only the first
+        ``max_chunks`` chunks are kept.
+        """
+        chunks = []
+        for change in changes:
+            header = f"File: {change['file']} ({change['change_type']})"
+            budget = self.chunk_tokens - estimate_tokens(header)
+            parts: List[str] = []
+            tokens = 0
+            for hunk in change["changes"]:
+                hunk = trim_text(hunk, budget)
+                hunk_tokens = estimate_tokens(hunk)
+                if parts and tokens + hunk_tokens > budget:
+                    chunks.append((change["file"], "\n".join([header, *parts])))
+                    parts, tokens = [], 0
+                parts.append(hunk)
+                tokens += hunk_tokens
+            chunks.append((change["file"], "\n".join([header, *parts])))
+        return chunks[: self.max_chunks]
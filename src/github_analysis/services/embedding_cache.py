@@ -0,0 +1,181 @@
+"""Cache of embeddings keyed by model, dimensions and the sha256 of the text.
+
+Re-analyzing PRs mostly re-embeds text that has not changed, so
+``EmbeddingService`` looks every text up here before calling the API.
+Vectors are kept as packed float32, a quarter of the memory of a list of
+Python floats and the same precision the API works in.
+"""
+
+import hashlib
+from abc import ABC, abstractmethod
+from array import array
+from collections import OrderedDict
+from typing import AsyncContextManager, Callable, Dict, Iterable, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from github_analysis.config import Settings
+from github_analysis.models.models import EmbeddingCacheEntry
+
+# Keeps IN lists well under the driver's bind parameter limit
+LOOKUP_CHUNK_SIZE = 1000
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def pack_vector(vector: List[float]) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def unpack_vector(data: bytes) -> List[float]:
+    vector = array("f")
+    vector.frombytes(data)
+    return vector.tolist()
+
+
+class EmbeddingCache(ABC):
+    """Storage backend for embeddings, keyed by the provider's model name and
+    vector size."""
+
+    @abstractmethod
+    async def get_many(
+        self, model: str, dimensions: int, hashes: Iterable[str]
+    ) -> Dict[str, List[float]]:
+        """Return the cached vectors of the given text hashes; misses are
+        left out."""
+
+    @abstractmethod
+    async def set_many(
+        self, model: str, dimensions: int, vectors: Dict[str, List[float]]
+    ) -> None: ...
+
+
+class InMemoryEmbeddingCache(EmbeddingCache):
+    """Process-local LRU cache; embeddings are lost on restart."""
+
+    def __init__(self, max_entries: int = 10_000):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple, bytes] = OrderedDict()
+
+    async def get_many(
+        self, model: str, dimensions: int, hashes: Iterable[str]
+    ) -> Dict[str, List[float]]:
+        found = {}
+        for hash_ in hashes:
+            key = (model, dimensions, hash_)
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                found[hash_] = unpack_vector(data)
+        return found
+
+    async def set_many(
+        self, model: str, dimensions: int, vectors: Dict[str, List[float]]
+    ) -> None:
+        for hash_, vector in vectors.items():
+            key = (model, dimensions, hash_)
+            self._entries[key] = pack_vector(vector)
+            self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class DatabaseEmbeddingCache(EmbeddingCache):
+    """Postgres-backed cache shared by every worker and kept across restarts."""
+
+    def __init__(
+        self, session_factory: Callable[[], AsyncContextManager[AsyncSession]]
+    ):
+        self.session_factory = session_factory
+
+    async def get_many(
+        self, model: str, dimensions: int, hashes: Iterable[str]
+    ) -> Dict[str, List[float]]:
+        hashes = list(hashes)
+        found = {}
+        async with self.session_factory() as session:
+            for start in range(0, len(hashes), LOOKUP_CHUNK_SIZE):
+                rows = await session.execute(
+                    select(
+                        EmbeddingCacheEntry.text_hash, EmbeddingCacheEntry.vector
+                    ).where(
+                        EmbeddingCacheEntry.model == model,
+                        EmbeddingCacheEntry.dimensions == dimensions,
+                        EmbeddingCacheEntry.text_hash.in_(
+                            hashes[start : start + LOOKUP_CHUNK_SIZE]
+                        ),
+                    )
+                )
+                found.update((hash_, unpack_vector(data)) for hash_, data in rows)
+        return found
+
+    async def set_many(
+        self, model: str, dimensions: int, vectors: Dict[str, List[float]]
+    ) -> None:
+        if not vectors:
+            return
+        async with self.session_factory() as session:
+            # The same text always embeds the same, so a concurrent write wins
+            await session.execute(
+                insert(EmbeddingCacheEntry).on_conflict_do_nothing(),
+                [
+                    {
+                        "model": model,
+                        "dimensions": dimensions,
+                        "text_hash": hash_,
+                        "vector": pack_vector(vector),
+                    }
+                    for hash_, vector in vectors.items()
+                ],
+            )
+            await session.commit()
+
+
+class TieredEmbeddingCache(EmbeddingCache):
+    """An in-memory LRU in front of a persistent cache.
+
+    Persistent hits are copied into memory; writes go to both tiers.
+    """
+
+    def __init__(self, memory: InMemoryEmbeddingCache, persistent: EmbeddingCache):
+        self.memory = memory
+        self.persistent = persistent
+
+    async def get_many(
+        self, model: str, dimensions: int, hashes: Iterable[str]
+    ) -> Dict[str, List[float]]:
+        hashes = list(hashes)
+        found = await self.memory.get_many(model, dimensions, hashes)
+        missing = [hash_ for hash_ in hashes if hash_ not in found]
+        if missing:
+            stored = await self.persistent.get_many(model, dimensions, missing)
+            await self.memory.set_many(model, dimensions, stored)
+            found.update(stored)
+        return found
+
+    async def set_many(
+        self, model: str, dimensions: int, vectors: Dict[str, List[float]]
+    ) -> None:
+        await self.memory.set_many(model, dimensions, vectors)
+        await self.persistent.set_many(model, dimensions, vectors)
+
+
+def create_embedding_cache(
+    settings: Settings,
+    session_factory: Callable[[], AsyncContextManager[AsyncSession]],
+) -> Optional[EmbeddingCache]:
+    """Build the embedding cache selected by ``EMBEDDING_CACHE``."""
+    if settings.EMBEDDING_CACHE == "memory":
+        return InMemoryEmbeddingCache(settings.EMBEDDING_CACHE_SIZE)
+    elif settings.EMBEDDING_CACHE == "database":
+        return TieredEmbeddingCache(
+            InMemoryEmbeddingCache(settings.EMBEDDING_CACHE_SIZE),
+            DatabaseEmbeddingCache(session_factory),
+        )
+    elif settings.EMBEDDING_CACHE == "none":
+        return None
+    raise ValueError(f"Unknown EMBEDDING_CACHE backend: {settings.EMBEDDING_CACHE}")
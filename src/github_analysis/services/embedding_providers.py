@@ -0,0 +1,227 @@
+"""Embedding backends behind ``EmbeddingService``.
+
+A provider turns a batch of texts into vectors and reports the model name
+and vector size, which the embedding cache and the Qdrant collection are
+keyed and sized by. Available providers:
+
+- ``openai``: OpenAI's embeddings API, through the app's shared
+  ``OpenAIRateLimiter`` when one is given
+- ``sentence-transformers``: a local model on the CPU; needs the optional
+  ``sentence-transformers`` package
+- ``hashing``: dependency-free feature hashing of code tokens, spread over
+  a process pool; deterministic, for offline runs and tests
+"""
+
+import asyncio
+import hashlib
+import math
+import os
+import re
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+from openai import AsyncOpenAI
+
+from github_analysis.config import Settings
+from github_analysis.services.openai_rate_limiter import OpenAIRateLimiter
+from github_analysis.services.tokens import estimate_tokens
+
+# Default vector sizes of OpenAI embedding models
+OPENAI_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+
+TOKEN_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+|[^\sA-Za-z0-9_]")
+SUBWORD_PATTERN = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+")
+
+
+class EmbeddingProvider(ABC):
+    """Backend that embeds batches of texts.
+
+    ``model`` and ``dimensions`` identify the vectors: a cached or stored
+    vector is only comparable with ones of the same model and size.
+    """
+
+    model: str
+    dimensions: int
+
+    @abstractmethod
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts, returning vectors in input order."""
+
+    async def close(self) -> None:
+        pass
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """OpenAI's embeddings API. With a ``rate_limiter``, it retries failed
+    calls in place of the SDK."""
+
+    def __init__(
+        self,
+        api_key: str,
+        model: str = "text-embedding-3-small",
+        dimensions: Optional[int] = None,
+        rate_limiter: Optional[OpenAIRateLimiter] = None,
+    ):
+        if dimensions is None and model not in OPENAI_DIMENSIONS:
+            raise ValueError(f"Pass dimensions for OpenAI embedding model {model}")
+        self.client = AsyncOpenAI(
+            api_key=api_key, **({"max_retries": 0} if rate_limiter else {})
+        )
+        self.rate_limiter = rate_limiter
+        self.model = model
+        # Only sent to the API when set, so the model default applies
+        self.requested_dimensions = dimensions
+        self.dimensions = dimensions or OPENAI_DIMENSIONS[model]
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        kwargs = (
+            {"dimensions": self.requested_dimensions}
+            if self.requested_dimensions
+            else {}
+        )
+
+        def request():
+            return self.client.embeddings.create(
+                model=self.model, input=texts, **kwargs
+            )
+
+        if self.rate_limiter is None:
+            response = await request()
+        else:
+            tokens = sum(estimate_tokens(text) for text in texts)
+            response = await self.rate_limiter.call(self.model, tokens, request)
+        # Results carry their input index; don't rely on response order
+        return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+
+
+def _code_features(text: str) -> List[str]:
+    """Tokens of ``text``, the subwords of snake_case and camelCase
+    identifiers, and adjacent token pairs."""
+    tokens = [token.lower() for token in TOKEN_PATTERN.findall(text)]
+    features = list(tokens)
+    features.extend(f"{a} {b}" for a, b in zip(tokens, tokens[1:]))
+    for token in TOKEN_PATTERN.findall(text):
+        subwords = SUBWORD_PATTERN.findall(token)
+        if len(subwords) > 1:
+            features.extend(subword.lower() for subword in subwords)
+    return features
+
+
+def hash_embed(texts: List[str], dimensions: int) -> List[List[float]]:
+    """Signed feature hashing into unit vectors of ``dimensions`` floats."""
+    vectors = []
+    for text in texts:
+        vector = [0.0] * dimensions
+        for feature in _code_features(text):
+            value = int.from_bytes(
+                hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(),
+                "little",
+            )
+            vector[value % dimensions] += 1.0 if value >> 63 else -1.0
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        vectors.append([x / norm for x in vector])
+    return vectors
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """Local, deterministic embeddings by feature hashing.
+
+    Texts with shared identifiers and token pairs get similar vectors, which
+    is enough to find related diffs without a model. Batches of at least
+    ``parallel_threshold`` texts are split across ``workers`` processes.
+    """
+
+    def __init__(
+        self,
+        dimensions: int = 1536,
+        workers: Optional[int] = None,
+        parallel_threshold: int = 256,
+    ):
+        self.model = "feature-hashing-v1"
+        self.dimensions = dimensions
+        self.workers = workers or os.cpu_count() or 1
+        self.parallel_threshold = parallel_threshold
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        if self.workers == 1 or len(texts) < self.parallel_threshold:
+            return await asyncio.to_thread(hash_embed, texts, self.dimensions)
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(self.workers)
+        loop = asyncio.get_running_loop()
+        size = math.ceil(len(texts) / self.workers)
+        parts = await asyncio.gather(
+            *(
+                loop.run_in_executor(
+                    self._pool, hash_embed, texts[start : start + size], self.dimensions
+                )
+                for start in range(0, len(texts), size)
+            )
+        )
+        return [vector for part in parts for vector in part]
+
+    async def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+class SentenceTransformerEmbeddingProvider(EmbeddingProvider):
+    """A local sentence-transformers model, run on the CPU.
+
+    ``encode`` is run in a thread; torch spreads each batch over the
+    available cores.
+    """
+
+    def __init__(self, model: str = "all-MiniLM-L6-v2", batch_size: int = 64):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ImportError(
+                "EMBEDDING_PROVIDER=sentence-transformers needs the "
+                "sentence-transformers package"
+            ) from e
+        self._model = SentenceTransformer(model, device="cpu")
+        self.model = model
+        self.dimensions = self._model.get_sentence_embedding_dimension()
+        self.batch_size = batch_size
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        vectors = await asyncio.to_thread(
+            self._model.encode,
+            texts,
+            batch_size=self.batch_size,
+            normalize_embeddings=True,
+        )
+        return vectors.tolist()
+
+
+def create_embedding_provider(
+    settings: Settings, rate_limiter: Optional[OpenAIRateLimiter] = None
+) -> EmbeddingProvider:
+    """Build the embedding provider selected by ``EMBEDDING_PROVIDER``;
+    ``rate_limiter`` governs calls to OpenAI."""
+    if settings.EMBEDDING_PROVIDER == "openai":
+        return OpenAIEmbeddingProvider(
+            settings.OPENAI_API_KEY,
+            settings.EMBEDDING_MODEL or "text-embedding-3-small",
+            settings.EMBEDDING_DIMENSIONS,
+            rate_limiter,
+        )
+    elif settings.EMBEDDING_PROVIDER == "hashing":
+        return HashingEmbeddingProvider(
+            settings.EMBEDDING_DIMENSIONS or 1536,
+            workers=settings.EMBEDDING_WORKERS or None,
+        )
+    elif settings.EMBEDDING_PROVIDER == "sentence-transformers":
+        return SentenceTransformerEmbeddingProvider(
+            settings.EMBEDDING_MODEL or "all-MiniLM-L6-v2"
+        )
+    raise ValueError(
+        f"Unknown EMBEDDING_PROVIDER backend: {settings.EMBEDDING_PROVIDER}"
+    )
@@ -0,0 +1,108 @@
+"""GraphQL query and result mapping for the bulk PR fetch backend.
+
+One query returns a page of PRs together with their review comments, which
+the REST backend needs a separate comments call per PR to get. Results are
+mapped to the same shapes the REST API returns, so the rest of the ingest
+pipeline does not care which backend produced them.
+"""
+
+from typing import Dict, List, Optional
+
+PULL_REQUESTS_QUERY = """
+query (
+  $owner: String!
+  $name: String!
+  $first: Int!
+  $after: String
+  $orderField: IssueOrderField!
+  $direction: OrderDirection!
+  $threads: Int!
+  $comments: Int!
+) {
+  repository(owner: $owner, name: $name) {
+    pullRequests(
+      first: $first
+      after: $after
+      orderBy: {field: $orderField, direction: $direction}
+    ) {
+      pageInfo {
+        hasNextPage
+        endCursor
+      }
+      nodes {
+        databaseId
+        number
+        title
+        body
+        createdAt
+        updatedAt
+        reviewThreads(first: $threads) {
+          pageInfo {
+            hasNextPage
+          }
+          nodes {
+            comments(first: $comments) {
+              pageInfo {
+                hasNextPage
+              }
+              nodes {
+                databaseId
+                body
+                author {
+                  login
+                }
+              }
+            }
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+
+def _review_comments(node: Dict) -> Optional[List[Dict]]:
+    """Map a PR's review threads to REST-style review comments.
+
+    Returns ``None`` when GitHub truncated the threads or a thread's comments,
+    so the caller falls back to the REST comments endpoint for that PR.
+    """
+    threads = node["reviewThreads"]
+    if threads["pageInfo"]["hasNextPage"]:
+        return None
+
+    comments = []
+    for thread in threads["nodes"]:
+        if thread["comments"]["pageInfo"]["hasNextPage"]:
+            return None
+        for comment in thread["comments"]["nodes"]:
+            author = comment["author"] or {"login": "ghost"}  # Deleted accounts
+            comments.append(
+                {
+                    "id": comment["databaseId"],
+                    "body": comment["body"],
+                    "user": {"login": author["login"]},
+                }
+            )
+    return comments
+
+
+def pull_request_from_node(node: Dict) -> Dict:
+    """Map a GraphQL PullRequest node to the REST pull request shape.
+
+    Review comments that came back in full are attached under
+    ``prefetched_comments``.
+    """
+    pr_data = {
+        "id": node["databaseId"],
+        "number": node["number"],
+        "title": node["title"],
+        "body": node["body"],
+        "created_at": node["createdAt"],
+        "updated_at": node["updatedAt"],
+    }
+    comments = _review_comments(node)
+    if comments is not None:
+        pr_data["prefetched_comments"] = comments
+    return pr_data
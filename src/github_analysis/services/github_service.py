@@ -1,19 +1,53 @@
+import asyncio
+import json
+import logging
 import re
-from datetime import datetime
-from typing import Dict, List
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, List, Mapping, Optional, Tuple
+from urllib.parse import urlencode
 
 import aiohttp
 from fastapi import HTTPException
-from sqlalchemy.exc import IntegrityError
+from multidict import CIMultiDict
+from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from github_analysis.models.models import (
-    ChangeType,
-    DiffHunk,
-    PRComment,
-    PRDiff,
-    PullRequest,
+from github_analysis.models.models import RepositorySyncState
+from github_analysis.services.diff_parser import (
+    DiffParser,
+    aiter_file_diffs,
+    parse_diff,
 )
+from github_analysis.services.github_graphql import (
+    PULL_REQUESTS_QUERY,
+    pull_request_from_node,
+)
+from github_analysis.services.pr_writer import PRWriter
+from github_analysis.services.rate_limiter import (
+    GitHubRateLimiter,
+    GitHubTokenPool,
+    NoTokensAvailable,
+    RateLimitExceeded,
+    budget_key,
+)
+from github_analysis.services.response_cache import CachedResponse, ResponseCache
+
+JSON_ACCEPT = "application/vnd.github.v3+json"
+DIFF_ACCEPT = "application/vnd.github.v3.diff"
+DIFF_CHUNK_SIZE = 64 * 1024
+
+
+@dataclass
+class GitHubResponse:
+    status: int
+    body: str
+    headers: Mapping[str, str]
+    from_cache: bool = False
+
+    def json(self) -> Any:
+        return json.loads(self.body)
 
 
 class GitHubService:
@@ -21,212 +55,765 @@ class GitHubService:
         self,
         db: AsyncSession,
         access_token: str,
+        session: aiohttp.ClientSession,
         base_url: str = "https://api.github.com",
+        fetch_concurrency: int = 8,
+        response_cache: Optional[ResponseCache] = None,
+        response_cache_max_body: int = 1_000_000,
+        rate_limiter: Optional[GitHubRateLimiter] = None,
+        max_retries: int = 5,
+        max_fetch_attempts: int = 3,
+        fetch_retry_delay: float = 1.0,
+        token_pool: Optional[GitHubTokenPool] = None,
+        fetch_mode: str = "rest",
+        graphql_page_size: int = 50,
+        graphql_review_threads: int = 50,
+        graphql_thread_comments: int = 50,
+        max_diff_size: Optional[int] = 10_000_000,
+        max_diff_file_size: Optional[int] = 1_000_000,
+        write_batch_size: int = 50,
     ):
+        if fetch_mode not in ("rest", "graphql"):
+            raise ValueError(f"Unknown fetch mode: {fetch_mode}")
         self.db = db
+        self.session = session
+        self.fetch_concurrency = max(1, fetch_concurrency)
+        self.response_cache = response_cache
+        self.response_cache_max_body = response_cache_max_body
+        self.token_pool = token_pool
+        self.rate_limiter = token_pool.rate_limiter if token_pool else rate_limiter
+        self.max_retries = max_retries
+        self.max_fetch_attempts = max(1, max_fetch_attempts)
+        self.fetch_retry_delay = fetch_retry_delay
+        self.fetch_mode = fetch_mode
+        self.graphql_page_size = graphql_page_size
+        self.graphql_review_threads = graphql_review_threads
+        self.graphql_thread_comments = graphql_thread_comments
+        self.max_diff_size = max_diff_size
+        self.max_diff_file_size = max_diff_file_size
+        self.write_batch_size = max(1, write_batch_size)
         self.base_url = base_url
+        self.access_token = access_token
         self.headers = {
             "Authorization": f"Bearer {access_token}",
-            "Accept": "application/vnd.github.v3+json",
+            "Accept": JSON_ACCEPT,
         }
 
-    async def _get_pull_requests(
+    async def _acquire_token(self, resource: str = "core") -> str:
+        """Pick the token for the next request and wait until it may be used."""
+        if self.token_pool is not None:
+            try:
+                return await self.token_pool.acquire(resource)
+            except NoTokensAvailable as exc:
+                raise HTTPException(status_code=401, detail=str(exc))
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire(budget_key(self.access_token, resource))
+        return self.access_token
+
+    @asynccontextmanager
+    async def _open(
+        self,
+        url: str,
+        headers: Dict[str, str],
+        method: str = "GET",
+        json_body: Optional[dict] = None,
+        resource: str = "core",
+    ) -> AsyncIterator[aiohttp.ClientResponse]:
+        """Open a request through the rate limiter, backing off and retrying
+        while GitHub answers with a primary or secondary rate limit error. With
+        a token pool, tokens answered with 401 are dropped and the request is
+        retried with another one.
+
+        The response is yielded with its body unread, so callers can stream it.
+        """
+        token = self.access_token
+        for attempt in range(self.max_retries + 1):
+            token = await self._acquire_token(resource)
+            request_headers = {**headers, "Authorization": f"Bearer {token}"}
+            async with self.session.request(
+                method, url, headers=request_headers, json=json_body
+            ) as response:
+                if self.token_pool is not None and response.status == 401:
+                    self.token_pool.disable(token)
+                    if attempt < self.max_retries:
+                        continue
+                if self.rate_limiter is None or response.status == 401:
+                    yield response
+                    return
+                key = budget_key(token, resource)
+                self.rate_limiter.record(key, response.headers)
+                # Only error bodies are read here; they are small
+                body = await response.text() if response.status in (403, 429) else ""
+                delay = self.rate_limiter.retry_delay(
+                    key, response.status, response.headers, body, attempt
+                )
+                if delay is None:
+                    yield response
+                    return
+            logging.warning(
+                f"GitHub rate limited {url} ({response.status}), "
+                f"retrying in {delay:.1f}s"
+            )
+
+        raise RateLimitExceeded(
+            f"GitHub rate limit exceeded for {url}",
+            retry_at=self.rate_limiter.budget(
+                budget_key(token, resource)
+            ).blocked_until,
+        )
+
+    async def _send(
+        self,
+        url: str,
+        headers: Dict[str, str],
+        method: str = "GET",
+        json_body: Optional[dict] = None,
+        resource: str = "core",
+    ) -> GitHubResponse:
+        """Send a request through ``_open`` and read the whole body."""
+        async with self._open(url, headers, method, json_body, resource) as response:
+            body = await response.text()
+            return GitHubResponse(response.status, body, response.headers)
+
+    async def _conditional_headers(
+        self,
+        url: str,
+        accept: str,
+        headers: Optional[Dict[str, str]] = None,
+        use_cache: bool = True,
+    ) -> Tuple[Optional[CachedResponse], Dict[str, str]]:
+        """Look ``url`` up in the response cache and build request headers
+        that revalidate the cached copy, if there is one."""
+        cached = None
+        if use_cache and self.response_cache is not None:
+            cached = await self.response_cache.get(url, accept)
+
+        request_headers = {**self.headers, "Accept": accept, **(headers or {})}
+        if cached is not None:
+            if cached.etag:
+                request_headers["If-None-Match"] = cached.etag
+            elif cached.last_modified:
+                request_headers["If-Modified-Since"] = cached.last_modified
+        return cached, request_headers
+
+    def _is_cacheable(self, status: int, headers: Mapping[str, str]) -> bool:
+        return (
+            self.response_cache is not None
+            and status == 200
+            and bool(headers.get("ETag") or headers.get("Last-Modified"))
+        )
+
+    async def _store_cached(
+        self, url: str, accept: str, body: str, headers: Mapping[str, str]
+    ) -> None:
+        await self.response_cache.set(
+            url,
+            accept,
+            CachedResponse(
+                body=body,
+                etag=headers.get("ETag"),
+                last_modified=headers.get("Last-Modified"),
+                link=headers.get("Link"),
+            ),
+        )
+
+    async def _request(
+        self,
+        url: str,
+        accept: str = JSON_ACCEPT,
+        headers: Optional[Dict[str, str]] = None,
+        use_cache: bool = True,
+    ) -> GitHubResponse:
+        """GET a GitHub API URL, revalidating against the response cache.
+
+        Cached responses are sent with ``If-None-Match``/``If-Modified-Since``;
+        on a 304 the cached body is served, which GitHub does not count against
+        the primary rate limit.
+        """
+        cached, request_headers = await self._conditional_headers(
+            url, accept, headers, use_cache
+        )
+        result = await self._send(url, request_headers)
+        if result.status == 304 and cached is not None:
+            cached_headers = CIMultiDict()
+            if cached.link:
+                cached_headers["Link"] = cached.link
+            return GitHubResponse(200, cached.body, cached_headers, True)
+
+        if (
+            use_cache
+            and self._is_cacheable(result.status, result.headers)
+            and len(result.body) <= self.response_cache_max_body
+        ):
+            await self._store_cached(url, accept, result.body, result.headers)
+        return result
+
+    @staticmethod
+    def _parse_next_link(link_header: Optional[str]) -> Optional[str]:
+        """Extract the rel="next" URL from a GitHub ``Link`` header."""
+        if not link_header:
+            return None
+        for part in link_header.split(","):
+            match = re.match(r'\s*<([^>]+)>\s*;\s*rel="next"', part)
+            if match:
+                return match.group(1)
+        return None
+
+    async def _iter_pages(
+        self,
+        url: str,
+        detail: str = "Request failed",
+        not_found_detail: Optional[str] = None,
+    ) -> AsyncIterator[Tuple[List[dict], Optional[str]]]:
+        """Follow ``Link: rel="next"`` headers, yielding each page with its
+        successor's URL (``None`` on the last page)."""
+        next_url: Optional[str] = url
+        while next_url:
+            response = await self._request(next_url)
+            if response.status == 404 and not_found_detail:
+                raise HTTPException(status_code=404, detail=not_found_detail)
+            elif response.status != 200:
+                raise HTTPException(status_code=response.status, detail=detail)
+            next_url = self._parse_next_link(response.headers.get("Link"))
+            yield response.json(), next_url
+
+    def _pull_requests_url(
         self,
         owner: str,
         repo: str,
         state: str = "all",
-        page: int = 1,
-        per_page: int = 30,
-    ) -> List[dict]:
-        """Fetch pull requests from GitHub API."""
-        url = f"{self.base_url}/repos/{owner}/{repo}/pulls"
-        params = {"state": state, "page": page, "per_page": per_page}
-
-        async with aiohttp.ClientSession(headers=self.headers) as session:
-            async with session.get(url, params=params) as response:
-                if response.status == 404:
-                    raise HTTPException(status_code=404, detail="Repository not found")
-                elif response.status != 200:
-                    raise HTTPException(
-                        status_code=response.status,
-                        detail="Failed to fetch pull requests",
-                    )
-                return await response.json()
+        per_page: int = 100,
+        by_update: bool = False,
+    ) -> str:
+        """Build the first-page URL of a PR listing, usable as a cursor.
+
+        PRs are listed oldest-first by creation date, or most-recently-updated
+        first when ``by_update`` is set.
+        """
+        params = {
+            "state": state,
+            "per_page": per_page,
+            "sort": "updated" if by_update else "created",
+            "direction": "desc" if by_update else "asc",
+        }
+        return f"{self.base_url}/repos/{owner}/{repo}/pulls?{urlencode(params)}"
+
+    async def iter_pull_request_pages(
+        self,
+        owner: str,
+        repo: str,
+        state: str = "all",
+        since: Optional[datetime] = None,
+        cursor: Optional[str] = None,
+        per_page: int = 100,
+    ) -> AsyncIterator[Tuple[List[dict], Optional[str]]]:
+        """Stream pages of pull requests as they arrive.
+
+        Each page is yielded with a cursor (the next page URL) that can be
+        stored and passed back in to resume the listing after that page.
+        Without ``since`` PRs are listed oldest-first by creation date, which
+        keeps cursors stable while new PRs are opened. With ``since`` they are
+        listed most-recently-updated first and paging stops at the first PR
+        last updated before ``since``.
+        """
+        if cursor is None:
+            cursor = self._pull_requests_url(
+                owner, repo, state, per_page, by_update=since is not None
+            )
+
+        async for page, next_url in self._iter_pages(
+            cursor,
+            detail="Failed to fetch pull requests",
+            not_found_detail="Repository not found",
+        ):
+            if since is not None:
+                in_window = [pr for pr in page if self._updated_at(pr) >= since]
+                if len(in_window) < len(page):
+                    page, next_url = in_window, None
+            yield page, next_url
+
+    async def _graphql(self, query: str, variables: dict) -> dict:
+        """Run a GraphQL query and return its ``data``."""
+        response = await self._send(
+            f"{self.base_url}/graphql",
+            {**self.headers, "Accept": JSON_ACCEPT},
+            method="POST",
+            json_body={"query": query, "variables": variables},
+            resource="graphql",
+        )
+        if response.status != 200:
+            raise HTTPException(
+                status_code=response.status, detail="GitHub GraphQL request failed"
+            )
+        payload = response.json()
+        errors = payload.get("errors")
+        if errors:
+            if any(error.get("type") == "NOT_FOUND" for error in errors):
+                raise HTTPException(status_code=404, detail="Repository not found")
+            raise HTTPException(
+                status_code=502, detail=f"GitHub GraphQL error: {errors[0]}"
+            )
+        return payload["data"]
+
+    async def iter_pull_request_pages_graphql(
+        self,
+        owner: str,
+        repo: str,
+        since: Optional[datetime] = None,
+        cursor: Optional[str] = None,
+        per_page: int = 50,
+    ) -> AsyncIterator[Tuple[List[dict], Optional[str]]]:
+        """GraphQL counterpart of ``iter_pull_request_pages``.
+
+        Each query returns a page of PRs with their review comments attached
+        as ``prefetched_comments``, so only the diff still needs a request per
+        PR. Cursors are GraphQL ``endCursor`` values, not URLs.
+        """
+        variables = {
+            "owner": owner,
+            "name": repo,
+            "first": per_page,
+            "after": cursor,
+            "orderField": "UPDATED_AT" if since else "CREATED_AT",
+            "direction": "DESC" if since else "ASC",
+            "threads": self.graphql_review_threads,
+            "comments": self.graphql_thread_comments,
+        }
+        while True:
+            data = await self._graphql(PULL_REQUESTS_QUERY, variables)
+            if data["repository"] is None:
+                raise HTTPException(status_code=404, detail="Repository not found")
+            connection = data["repository"]["pullRequests"]
+            page = [pull_request_from_node(node) for node in connection["nodes"]]
+            page_info = connection["pageInfo"]
+            next_cursor = page_info["endCursor"] if page_info["hasNextPage"] else None
+
+            if since is not None:
+                in_window = [pr for pr in page if self._updated_at(pr) >= since]
+                if len(in_window) < len(page):
+                    page, next_cursor = in_window, None
+            yield page, next_cursor
+
+            if next_cursor is None:
+                return
+            variables["after"] = next_cursor
+
+    async def iter_pull_requests(
+        self,
+        owner: str,
+        repo: str,
+        state: str = "all",
+        since: Optional[datetime] = None,
+        cursor: Optional[str] = None,
+    ) -> AsyncIterator[dict]:
+        """Stream every pull request in a repository, one at a time."""
+        async for page, _ in self.iter_pull_request_pages(
+            owner, repo, state=state, since=since, cursor=cursor
+        ):
+            for pr_data in page:
+                yield pr_data
+
+    @staticmethod
+    def _updated_at(pr_data: dict) -> datetime:
+        return datetime.fromisoformat(pr_data["updated_at"].replace("Z", "+00:00"))
 
     async def _get_pr_comments(
         self, owner: str, repo: str, pr_number: int
     ) -> List[dict]:
-        """Fetch comments for a specific PR from GitHub API."""
+        """Fetch all comments for a specific PR from GitHub API."""
         url = f"{self.base_url}/repos/{owner}/{repo}/pulls/{pr_number}/comments"
 
-        async with aiohttp.ClientSession(headers=self.headers) as session:
-            async with session.get(url) as response:
-                if response.status != 200:
-                    raise HTTPException(
-                        status_code=response.status,
-                        detail="Failed to fetch PR comments",
-                    )
-                return await response.json()
+        comments = []
+        async for page, _ in self._iter_pages(
+            f"{url}?per_page=100", detail="Failed to fetch PR comments"
+        ):
+            comments.extend(page)
+        return comments
 
-    async def _get_pr_diff(self, owner: str, repo: str, pr_number: int) -> str:
+    async def _get_pr_diff(
+        self, owner: str, repo: str, pr_number: int
+    ) -> Tuple[List[Dict], bool]:
+        """Stream a PR's diff from the network into the diff parser.
+
+        The body is never held in full: at most ``max_diff_size`` bytes are
+        read, and hunk text beyond ``max_diff_file_size`` per file is dropped.
+        Returns the parsed files and whether the diff was cut off. Diffs small
+        enough for the response cache are kept so they can be revalidated,
+        unless the cache backend does not keep diffs.
+        """
         url = f"{self.base_url}/repos/{owner}/{repo}/pulls/{pr_number}"
-        headers = {**self.headers, "Accept": "application/vnd.github.v3.diff"}
+        use_cache = self.response_cache is not None and self.response_cache.caches_diffs
+        cached, headers = await self._conditional_headers(
+            url, DIFF_ACCEPT, use_cache=use_cache
+        )
 
-        async with aiohttp.ClientSession(headers=headers) as session:
-            async with session.get(url) as response:
-                if response.status != 200:
-                    raise HTTPException(
-                        status_code=response.status, detail="Failed to fetch PR diff"
-                    )
-                return await response.text()
+        parser = DiffParser(self.max_diff_file_size, self.max_diff_size)
+        async with self._open(url, headers) as response:
+            if response.status == 304 and cached is not None:
+                return parse_diff(cached.body, parser), parser.truncated
+            if response.status != 200:
+                raise HTTPException(
+                    status_code=response.status, detail="Failed to fetch PR diff"
+                )
 
-    async def store_pr(self, owner: str, repo: str, pr_data: dict) -> dict:
-        pr_number = pr_data["number"]
+            cache_body = (
+                bytearray()
+                if use_cache and self._is_cacheable(response.status, response.headers)
+                else None
+            )
+
+            async def chunks() -> AsyncIterator[bytes]:
+                nonlocal cache_body
+                received = 0
+                async for chunk in response.content.iter_chunked(DIFF_CHUNK_SIZE):
+                    if cache_body is not None:
+                        if len(cache_body) + len(chunk) > self.response_cache_max_body:
+                            cache_body = None
+                        else:
+                            cache_body += chunk
+                    yield chunk
+                    received += len(chunk)
+                    # A single overlong line would otherwise be buffered whole
+                    if self.max_diff_size and received > self.max_diff_size:
+                        break
+
+            files = [file async for file in aiter_file_diffs(chunks(), parser)]
+
+        if parser.truncated:
+            logging.warning(
+                f"Diff for {owner}/{repo}#{pr_number} exceeds "
+                f"{self.max_diff_size} bytes, keeping {len(files)} file(s)"
+            )
+        elif cache_body is not None:
+            await self._store_cached(
+                url,
+                DIFF_ACCEPT,
+                cache_body.decode("utf-8", "replace"),
+                response.headers,
+            )
+        return files, parser.truncated
+
+    async def _fetch_pr_details(self, owner: str, repo: str, pr_data: dict) -> dict:
+        """Fetch comments and the parsed diff for a PR concurrently.
 
+        Comments already fetched through GraphQL are not requested again.
+        """
+        if "prefetched_comments" in pr_data:
+            comments = pr_data["prefetched_comments"]
+            diffs, diff_truncated = await self._get_pr_diff(
+                owner, repo, pr_data["number"]
+            )
+        else:
+            comments, (diffs, diff_truncated) = await asyncio.gather(
+                self._get_pr_comments(owner, repo, pr_data["number"]),
+                self._get_pr_diff(owner, repo, pr_data["number"]),
+            )
+        return {
+            "owner": owner,
+            "repo": repo,
+            "pr_data": pr_data,
+            "comments": comments,
+            "diffs": diffs,
+            "diff_truncated": diff_truncated,
+        }
+
+    async def _write_prs(self, batch: List[dict]) -> List[dict]:
+        """Upsert fetched PRs with their comments, diffs and hunks.
+
+        PRs and comments are always brought up to date; diffs are rewritten
+        only when their content changed. PRs with no change since they were
+        stored are reported as duplicates.
+        """
+        return await PRWriter(self.db).write(batch)
+
+    async def store_pr(self, owner: str, repo: str, pr_data: dict) -> dict:
         try:
-            comments = await self._get_pr_comments(owner, repo, pr_number)
-            diff_content = await self._get_pr_diff(owner, repo, pr_number)
-            parsed_diffs = self._parse_diff_content(diff_content)
+            details = await self._fetch_pr_details(owner, repo, pr_data)
         except Exception as fetch_exc:
             return {
                 "status": "error",
-                "pr_number": pr_number,
+                "pr_number": pr_data["number"],
                 "detail": f"External fetch error: {fetch_exc}",
             }
+        return (await self._write_prs([details]))[0]
 
-        try:
-            async with self.db.begin():
-                pr = PullRequest(
-                    github_id=pr_data["id"],
-                    number=pr_number,
-                    title=pr_data["title"],
-                    body=pr_data.get("body", ""),
-                    created_at=datetime.fromisoformat(
-                        pr_data["created_at"].replace("Z", "+00:00")
-                    ),
-                )
-                self.db.add(pr)
-                await self.db.flush()
+    async def fetch_and_store_prs(
+        self,
+        owner: str,
+        repo: str,
+        limit: Optional[int] = 30,
+        since: Optional[datetime] = None,
+        cursor: Optional[str] = None,
+    ) -> dict:
+        """Fetch PRs from GitHub and store them in the database.
 
-                for comment_data in comments:
-                    comment = PRComment(
-                        github_id=comment_data["id"],
-                        body=comment_data["body"],
-                        user_login=comment_data["user"]["login"],
-                        pr_id=pr.id,
-                    )
-                    self.db.add(comment)
-
-                for diff_data in parsed_diffs:
-                    diff = PRDiff(
-                        file_path=diff_data["file_path"],
-                        change_type=diff_data["change_type"],
-                        pr_id=pr.id,
-                    )
-                    self.db.add(diff)
-                    await self.db.flush()
-
-                    for hunk_data in diff_data["hunks"]:
-                        hunk = DiffHunk(
-                            old_start=hunk_data["old_start"],
-                            old_lines=hunk_data["old_lines"],
-                            new_start=hunk_data["new_start"],
-                            new_lines=hunk_data["new_lines"],
-                            content=hunk_data["content"],
-                            diff_id=diff.id,
-                        )
-                        self.db.add(hunk)
+        PRs are streamed page by page (see ``iter_pull_request_pages``) into a
+        bounded queue, so paging overlaps with processing and memory stays flat
+        however large the repository. Comments and diffs are fetched for up to
+        ``fetch_concurrency`` PRs at a time, while a single writer stage
+        persists them in batches of up to ``write_batch_size``, since the DB
+        session must not be shared between concurrent tasks. ``limit=None``
+        ingests every PR. PRs whose fetch was rate limited or hit a transient
+        error are requeued, up to ``max_fetch_attempts`` times, before being
+        reported as errors; after a transient error the worker first backs off
+        for ``fetch_retry_delay`` seconds, doubling with each attempt.
 
-            return {"status": "success", "pr_number": pr_number}
+        With ``fetch_mode="graphql"`` PRs and their review comments are listed
+        through GraphQL in pages of ``graphql_page_size``, and only diffs are
+        fetched per PR.
 
-        except IntegrityError:
-            return {"status": "duplicate", "pr_number": pr_number}
-        except Exception as db_exc:
-            return {
-                "status": "error",
-                "pr_number": pr_number,
-                "detail": f"Database error: {db_exc}",
-            }
-
-    async def fetch_and_store_prs(self, owner: str, repo: str, limit: int = 30) -> dict:
-        """Fetch PRs from GitHub and store them in the database."""
-        prs_data = await self._get_pull_requests(owner, repo, per_page=limit)
+        The returned ``next_cursor`` resumes the listing after the last page
+        that was fully processed, or is ``None`` once the listing is exhausted.
+        Cursors are specific to the fetch mode that produced them.
+        """
         results = {
             "stored": [],
+            "updated": [],
             "duplicates": [],
             "errors": [],
-            "total_processed": len(prs_data),
+            "total_processed": 0,
+            "next_cursor": None,
         }
+        graphql = self.fetch_mode == "graphql"
+        max_page = self.graphql_page_size if graphql else 100
+        # Never ask for more than the limit, so the first page is not cut short
+        per_page = min(limit, max_page) if limit else max_page
+
+        # Bounds the PRs held in memory between the listing and the writer
+        in_flight = asyncio.Semaphore(self.fetch_concurrency * 2)
+        pending: asyncio.Queue = asyncio.Queue()
+        fetched: asyncio.Queue = asyncio.Queue()
 
-        for pr_data in prs_data:
-            result = await self.store_pr(owner, repo, pr_data)
-            if result["status"] == "success":
-                results["stored"].append(result["pr_number"])
-            elif result["status"] == "duplicate":
-                results["duplicates"].append(result["pr_number"])
+        async def producer() -> None:
+            if graphql:
+                page_cursor = cursor
+                pages = self.iter_pull_request_pages_graphql(
+                    owner, repo, since=since, cursor=cursor, per_page=per_page
+                )
             else:
-                results["errors"].append(
-                    {"pr_number": result["pr_number"], "detail": result.get("detail")}
+                page_cursor = cursor or self._pull_requests_url(
+                    owner, repo, per_page=per_page, by_update=since is not None
+                )
+                pages = self.iter_pull_request_pages(
+                    owner, repo, since=since, cursor=page_cursor, per_page=per_page
                 )
+            async for page, next_url in pages:
+                if limit is not None:
+                    remaining = limit - results["total_processed"]
+                    if len(page) >= remaining:
+                        # Resume from this page next time if it is cut short
+                        if len(page) > remaining:
+                            next_url = page_cursor
+                        page = page[:remaining]
+                for pr_data in page:
+                    await in_flight.acquire()
+                    pending.put_nowait((pr_data, 1))
+                    results["total_processed"] += 1
+                page_cursor = next_url
+                results["next_cursor"] = next_url
+                if limit is not None and results["total_processed"] >= limit:
+                    break
 
-        return results
+        async def fetch_worker() -> None:
+            while True:
+                pr_data, attempt = await pending.get()
+                try:
+                    details = await self._fetch_pr_details(owner, repo, pr_data)
+                except Exception as fetch_exc:
+                    if self._is_retryable(fetch_exc) and (
+                        attempt < self.max_fetch_attempts
+                    ):
+                        # Requeue rather than drop. The rate limiter already
+                        # holds rate limited retries back until the token may
+                        # be used again; server errors and timeouts get an
+                        # exponential backoff here instead
+                        delay = 0.0
+                        if not isinstance(fetch_exc, RateLimitExceeded):
+                            delay = self.fetch_retry_delay * 2 ** (attempt - 1)
+                        logging.warning(
+                            f"Requeueing PR {pr_data['number']} in {delay:.1f}s "
+                            f"(attempt {attempt}): {fetch_exc}"
+                        )
+                        await asyncio.sleep(delay)
+                        pending.put_nowait((pr_data, attempt + 1))
+                        pending.task_done()
+                        continue
+                    details = {
+                        "status": "error",
+                        "pr_number": pr_data["number"],
+                        "detail": f"External fetch error: {fetch_exc}",
+                    }
+                fetched.put_nowait(details)
+                pending.task_done()
 
-    @staticmethod
-    def _parse_diff_content(diff_content: str) -> List[Dict]:
-        """Parse the raw diff content into structured data."""
-        file_diffs = []
-        current_file = None
-        current_lines = []
-
-        for line in diff_content.split("\n"):
-            if line.startswith("diff --git"):
-                if current_file:
-                    file_diffs.append((current_file, "\n".join(current_lines)))
-                current_file = line
-                current_lines = [line]
-            else:
-                current_lines.append(line)
+        async def writer() -> None:
+            done = False
+            while not done:
+                # Write whatever has queued up since the last write in one go
+                batch = [await fetched.get()]
+                while len(batch) < self.write_batch_size and not fetched.empty():
+                    batch.append(fetched.get_nowait())
+                if batch[-1] is None:
+                    batch.pop()
+                    done = True
 
-        if current_file:
-            file_diffs.append((current_file, "\n".join(current_lines)))
+                failed = [details for details in batch if "status" in details]
+                to_write = [details for details in batch if "status" not in details]
+                written = await self._write_prs(to_write) if to_write else []
+                for result in failed + written:
+                    self._record_result(results, result)
+                    in_flight.release()
 
-        parsed_diffs = []
-        for file_header, file_content in file_diffs:
-            file_path = re.search(r"b/(.+)$", file_header.split(" ")[-1]).group(1)
+        workers = [
+            asyncio.create_task(fetch_worker()) for _ in range(self.fetch_concurrency)
+        ]
+        writer_task = asyncio.create_task(writer())
+        try:
+            await producer()
+            await pending.join()
+            fetched.put_nowait(None)
+            await writer_task
+        finally:
+            for task in (*workers, writer_task):
+                task.cancel()
 
-            if "new file" in file_content:
-                change_type = ChangeType.ADD
-            elif "deleted file" in file_content:
-                change_type = ChangeType.DELETE
-            elif "rename" in file_content:
-                change_type = ChangeType.RENAME
-            else:
-                change_type = ChangeType.MODIFY
+        return results
+
+    async def _probe_latest_update(
+        self, owner: str, repo: str, etag: Optional[str] = None
+    ) -> Tuple[bool, Optional[str], Optional[datetime]]:
+        """Cheaply check whether any PR changed since the listing had ``etag``.
 
-            hunks = []
-            hunk_pattern = re.compile(
-                r"@@ -(\d+),(\d+) \+(\d+),(\d+) @@(.*?)(?=\n@@|\Z)", re.DOTALL
+        Returns ``(not_modified, etag, latest_updated_at)``. GitHub does not
+        count 304 responses against the rate limit, so an idle repository
+        costs nothing to poll.
+        """
+        url = self._pull_requests_url(owner, repo, per_page=1, by_update=True)
+
+        # The stored ETag is the validator here, so bypass the response cache
+        response = await self._request(
+            url, headers={"If-None-Match": etag} if etag else None, use_cache=False
+        )
+        if response.status == 304:
+            return True, etag, None
+        elif response.status == 404:
+            raise HTTPException(status_code=404, detail="Repository not found")
+        elif response.status != 200:
+            raise HTTPException(
+                status_code=response.status, detail="Failed to fetch pull requests"
             )
+        page = response.json()
+        latest = self._updated_at(page[0]) if page else None
+        return False, response.headers.get("ETag"), latest
 
-            for match in hunk_pattern.finditer(file_content):
-                old_start = int(match.group(1))
-                old_lines = int(match.group(2))
-                new_start = int(match.group(3))
-                new_lines = int(match.group(4))
-                content = match.group(5).strip()
-
-                hunks.append(
-                    {
-                        "old_start": old_start,
-                        "old_lines": old_lines,
-                        "new_start": new_start,
-                        "new_lines": new_lines,
-                        "content": content,
-                    }
+    async def _load_sync_state(self, owner: str, repo: str) -> dict:
+        async with self.db.begin():
+            result = await self.db.execute(
+                select(RepositorySyncState).where(
+                    RepositorySyncState.owner == owner,
+                    RepositorySyncState.name == repo,
                 )
+            )
+            state = result.scalar_one_or_none()
+            if state is None:
+                state = RepositorySyncState(owner=owner, name=repo)
+                self.db.add(state)
+                await self.db.flush()
+            return {
+                "id": state.id,
+                "last_updated_at": state.last_updated_at,
+                "etag": state.etag,
+                "cursor": state.cursor,
+                "backfill_updated_at": state.backfill_updated_at,
+            }
 
-            parsed_diffs.append(
-                {"file_path": file_path, "change_type": change_type, "hunks": hunks}
+    async def _save_sync_state(self, state_id: int, **values) -> None:
+        async with self.db.begin():
+            await self.db.execute(
+                update(RepositorySyncState)
+                .where(RepositorySyncState.id == state_id)
+                .values(last_synced_at=datetime.now(timezone.utc), **values)
             )
 
-        return parsed_diffs
+    async def sync_repository(
+        self, owner: str, repo: str, limit: Optional[int] = None
+    ) -> dict:
+        """Bring the stored PRs of a repository up to date with GitHub.
+
+        The first sync backfills every PR, optionally ``limit`` PRs per call,
+        resuming from the stored cursor. Once the backfill is complete, later
+        syncs only list and fetch PRs updated since the stored high-water mark,
+        and skip the listing entirely when its ETag is unchanged. The mark only
+        advances when every PR in the run was stored, so failures are retried
+        on the next sync.
+        """
+        state = await self._load_sync_state(owner, repo)
+        incremental = state["last_updated_at"] is not None
+
+        not_modified, etag, latest_updated_at = await self._probe_latest_update(
+            owner, repo, state["etag"] if incremental else None
+        )
+        if incremental and not_modified:
+            await self._save_sync_state(state["id"])
+            return {
+                "stored": [],
+                "updated": [],
+                "duplicates": [],
+                "errors": [],
+                "total_processed": 0,
+                "next_cursor": None,
+                "mode": "unchanged",
+            }
+
+        if incremental:
+            results = await self.fetch_and_store_prs(
+                owner, repo, limit=None, since=state["last_updated_at"]
+            )
+            if not results["errors"]:
+                await self._save_sync_state(
+                    state["id"],
+                    last_updated_at=latest_updated_at or state["last_updated_at"],
+                    etag=etag,
+                )
+            results["mode"] = "incremental"
+            return results
+
+        # Anything updated after the backfill starts is picked up incrementally
+        backfill_updated_at = state["backfill_updated_at"] or latest_updated_at
+        results = await self.fetch_and_store_prs(
+            owner, repo, limit=limit, cursor=state["cursor"]
+        )
+        values = {"backfill_updated_at": backfill_updated_at}
+        if not results["errors"]:
+            values["cursor"] = results["next_cursor"]
+            if results["next_cursor"] is None:
+                values.update(
+                    last_updated_at=backfill_updated_at or datetime.now(timezone.utc),
+                    etag=etag,
+                    backfill_updated_at=None,
+                )
+        await self._save_sync_state(state["id"], **values)
+        results["mode"] = "backfill"
+        return results
+
+    @staticmethod
+    def _is_retryable(exc: Exception) -> bool:
+        """Whether a failed fetch is worth another attempt later."""
+        if isinstance(exc, HTTPException):
+            return exc.status_code >= 500
+        return isinstance(
+            exc, (RateLimitExceeded, aiohttp.ClientError, asyncio.TimeoutError)
+        )
+
+    @staticmethod
+    def _record_result(results: dict, result: dict) -> None:
+        if result["status"] == "success":
+            results["stored"].append(result["pr_number"])
+        elif result["status"] == "updated":
+            results["updated"].append(result["pr_number"])
+        elif result["status"] == "duplicate":
+            results["duplicates"].append(result["pr_number"])
+        else:
+            results["errors"].append(
+                {"pr_number": result["pr_number"], "detail": result.get("detail")}
+            )
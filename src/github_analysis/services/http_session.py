@@ -0,0 +1,24 @@
+import aiohttp
+
+from github_analysis.config import Settings
+
+
+def create_github_session(settings: Settings) -> aiohttp.ClientSession:
+    """Create the app-scoped, pooled HTTP session used for GitHub API calls.
+
+    A single session keeps TCP/TLS connections alive between requests, so
+    fetching comments and diffs for many PRs reuses a bounded set of sockets
+    instead of paying a new handshake per call.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=settings.GITHUB_HTTP_POOL_SIZE,
+        limit_per_host=settings.GITHUB_HTTP_POOL_PER_HOST,
+        keepalive_timeout=settings.GITHUB_HTTP_KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=300,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=None,
+        sock_connect=settings.GITHUB_HTTP_CONNECT_TIMEOUT,
+        sock_read=settings.GITHUB_HTTP_READ_TIMEOUT,
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
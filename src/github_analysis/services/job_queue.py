@@ -0,0 +1,377 @@
+"""Background jobs for work too slow to run inside a request.
+
+An endpoint enqueues a job and returns its id straight away; a
+``JobWorkerPool`` started with the app claims queued jobs and runs them, and
+clients poll ``GET /jobs/{id}`` for the status and result. Failed jobs are
+retried with exponential backoff until ``max_attempts`` is used up.
+
+Two queue backends are available, like the GitHub response cache: an
+in-process queue, and a Postgres table that workers claim from with
+``FOR UPDATE SKIP LOCKED``, which survives restarts and is shared by every
+app process. A claimed job holds a lease of ``lease`` seconds; a job whose
+worker died is claimed again once its lease runs out.
+"""
+
+import asyncio
+import enum
+import heapq
+import itertools
+import logging
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import (
+    AsyncContextManager,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from github_analysis.config import Settings
+from github_analysis.models.models import AnalysisJob
+
+
+class JobStatus(str, enum.Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+class PermanentJobError(Exception):
+    """A job failure that retrying cannot fix, such as a PR that does not
+    exist; every other error is retried."""
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+@dataclass
+class Job:
+    kind: str
+    params: Dict
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: JobStatus = JobStatus.QUEUED
+    attempts: int = 0
+    max_attempts: int = 3
+    result: Optional[Dict] = None
+    error: Optional[str] = None
+    # Earliest time the job may be claimed; the lease end while it runs
+    available_at: datetime = field(default_factory=_now)
+    created_at: datetime = field(default_factory=_now)
+    updated_at: datetime = field(default_factory=_now)
+
+
+class JobQueue(ABC):
+    """Storage backend for background jobs."""
+
+    @abstractmethod
+    async def enqueue(self, job: Job) -> Job: ...
+
+    @abstractmethod
+    async def get(self, job_id: str) -> Optional[Job]: ...
+
+    @abstractmethod
+    async def claim(self, lease: float) -> Optional[Job]:
+        """Mark the next due job running and return it, or None if no job is
+        due. Counts an attempt."""
+
+    @abstractmethod
+    async def complete(self, job: Job, result: Dict) -> None: ...
+
+    @abstractmethod
+    async def fail(self, job: Job, error: str, retry_at: Optional[datetime]) -> None:
+        """Record a failed attempt; the job is queued again for ``retry_at``,
+        or failed for good when it is None."""
+
+
+class InMemoryJobQueue(JobQueue):
+    """Process-local queue; jobs are lost on restart.
+
+    Only the latest ``max_jobs`` jobs are kept for status polling.
+    """
+
+    def __init__(self, max_jobs: int = 10_000):
+        self.max_jobs = max_jobs
+        self._jobs: OrderedDict[str, Job] = OrderedDict()
+        self._due: List[Tuple[datetime, int, str]] = []
+        self._order = itertools.count()
+
+    def _schedule(self, job: Job) -> None:
+        heapq.heappush(self._due, (job.available_at, next(self._order), job.id))
+
+    async def enqueue(self, job: Job) -> Job:
+        self._jobs[job.id] = job
+        self._schedule(job)
+        for job_id in list(self._jobs):
+            if len(self._jobs) <= self.max_jobs:
+                break
+            if self._jobs[job_id].status in (JobStatus.SUCCEEDED, JobStatus.FAILED):
+                del self._jobs[job_id]
+        return job
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    async def claim(self, lease: float) -> Optional[Job]:
+        now = _now()
+        while self._due and self._due[0][0] <= now:
+            _, _, job_id = heapq.heappop(self._due)
+            job = self._jobs.get(job_id)
+            if job is None or job.status != JobStatus.QUEUED:
+                continue
+            job.status = JobStatus.RUNNING
+            job.attempts += 1
+            job.available_at = now + timedelta(seconds=lease)
+            job.updated_at = now
+            return job
+        return None
+
+    async def complete(self, job: Job, result: Dict) -> None:
+        job.status = JobStatus.SUCCEEDED
+        job.result = result
+        job.error = None
+        job.updated_at = _now()
+
+    async def fail(self, job: Job, error: str, retry_at: Optional[datetime]) -> None:
+        job.error = error
+        job.updated_at = _now()
+        if retry_at is None:
+            job.status = JobStatus.FAILED
+        else:
+            job.status = JobStatus.QUEUED
+            job.available_at = retry_at
+            self._schedule(job)
+
+
+class DatabaseJobQueue(JobQueue):
+    """Postgres-backed queue shared by every app process."""
+
+    def __init__(
+        self, session_factory: Callable[[], AsyncContextManager[AsyncSession]]
+    ):
+        self.session_factory = session_factory
+
+    @staticmethod
+    def _to_job(row: AnalysisJob) -> Job:
+        return Job(
+            id=row.id,
+            kind=row.kind,
+            params=row.params,
+            status=JobStatus(row.status),
+            attempts=row.attempts,
+            max_attempts=row.max_attempts,
+            result=row.result,
+            error=row.error,
+            available_at=row.available_at,
+            created_at=row.created_at,
+            updated_at=row.updated_at,
+        )
+
+    async def enqueue(self, job: Job) -> Job:
+        async with self.session_factory() as session:
+            session.add(
+                AnalysisJob(
+                    id=job.id,
+                    kind=job.kind,
+                    params=job.params,
+                    status=job.status.value,
+                    attempts=job.attempts,
+                    max_attempts=job.max_attempts,
+                    available_at=job.available_at,
+                    created_at=job.created_at,
+                    updated_at=job.updated_at,
+                )
+            )
+            await session.commit()
+        return job
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        async with self.session_factory() as session:
+            row = await session.get(AnalysisJob, job_id)
+            return self._to_job(row) if row is not None else None
+
+    async def claim(self, lease: float) -> Optional[Job]:
+        now = _now()
+        # Running jobs whose lease ran out belong to a worker that died
+        next_due = (
+            select(AnalysisJob.id)
+            .where(
+                AnalysisJob.status.in_(
+                    [JobStatus.QUEUED.value, JobStatus.RUNNING.value]
+                ),
+                AnalysisJob.available_at <= now,
+            )
+            .order_by(AnalysisJob.available_at)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        async with self.session_factory() as session:
+            row = (
+                await session.execute(
+                    update(AnalysisJob)
+                    .where(AnalysisJob.id == next_due)
+                    .values(
+                        status=JobStatus.RUNNING.value,
+                        attempts=AnalysisJob.attempts + 1,
+                        available_at=now + timedelta(seconds=lease),
+                        updated_at=now,
+                    )
+                    .returning(AnalysisJob)
+                )
+            ).scalar_one_or_none()
+            # Read the row before the commit expires it
+            job = self._to_job(row) if row is not None else None
+            await session.commit()
+            return job
+
+    async def _finish(self, job: Job, **values) -> None:
+        async with self.session_factory() as session:
+            # A worker whose lease expired must not overwrite the next attempt
+            await session.execute(
+                update(AnalysisJob)
+                .where(
+                    AnalysisJob.id == job.id,
+                    AnalysisJob.attempts == job.attempts,
+                    AnalysisJob.status == JobStatus.RUNNING.value,
+                )
+                .values(updated_at=_now(), **values)
+            )
+            await session.commit()
+
+    async def complete(self, job: Job, result: Dict) -> None:
+        await self._finish(
+            job, status=JobStatus.SUCCEEDED.value, result=result, error=None
+        )
+
+    async def fail(self, job: Job, error: str, retry_at: Optional[datetime]) -> None:
+        if retry_at is None:
+            await self._finish(job, status=JobStatus.FAILED.value, error=error)
+        else:
+            await self._finish(
+                job,
+                status=JobStatus.QUEUED.value,
+                error=error,
+                available_at=retry_at,
+            )
+
+
+JobHandler = Callable[[Job], Awaitable[Dict]]
+
+
+class JobWorkerPool:
+    """Runs queued jobs on ``workers`` asyncio tasks.
+
+    Workers poll the queue every ``poll_interval`` seconds, and are woken
+    straight away for jobs submitted through the pool. A job that raises is
+    retried after ``retry_delay * 2 ** (attempts - 1)`` seconds, unless it
+    raised ``PermanentJobError`` or used up its attempts. A job is cancelled
+    after ``job_timeout`` seconds.
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        handler: JobHandler,
+        workers: int = 2,
+        max_attempts: int = 3,
+        job_timeout: float = 600.0,
+        retry_delay: float = 5.0,
+        poll_interval: float = 1.0,
+    ):
+        self.queue = queue
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.max_attempts = max(1, max_attempts)
+        self.job_timeout = job_timeout
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self._wake = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    async def submit(self, kind: str, params: Dict) -> Job:
+        job = await self.queue.enqueue(
+            Job(kind=kind, params=params, max_attempts=self.max_attempts)
+        )
+        self._wake.set()
+        return job
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _work(self) -> None:
+        while True:
+            try:
+                # Outlive the timeout so a live job is never claimed twice
+                job = await self.queue.claim(lease=self.job_timeout + 60)
+            except Exception as e:
+                logging.error(f"Failed to claim a job: {e}")
+                job = None
+            if job is None:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self.run(job)
+            except Exception as e:
+                # The job is claimed again once its lease runs out
+                logging.error(f"Failed to record the outcome of job {job.id}: {e}")
+
+    async def run(self, job: Job) -> None:
+        """Run one claimed job and record its outcome."""
+        if job.attempts > job.max_attempts:
+            # Reclaimed after its lease ran out on the last attempt
+            await self.queue.fail(job, job.error or "Worker stopped", None)
+            return
+        try:
+            result = await asyncio.wait_for(self.handler(job), self.job_timeout)
+        except Exception as e:
+            if isinstance(e, asyncio.TimeoutError):
+                error = f"Timed out after {self.job_timeout}s"
+            else:
+                error = str(e) or type(e).__name__
+            permanent = isinstance(e, PermanentJobError)
+            retry_at = None
+            if not permanent and job.attempts < job.max_attempts:
+                delay = self.retry_delay * 2 ** (job.attempts - 1)
+                retry_at = _now() + timedelta(seconds=delay)
+            logging.warning(
+                f"Job {job.id} ({job.kind}) attempt {job.attempts} failed: {error}"
+                + (f"; retrying at {retry_at.isoformat()}" if retry_at else "")
+            )
+            await self.queue.fail(job, error, retry_at)
+            return
+        await self.queue.complete(job, result)
+
+
+def create_job_queue(
+    settings: Settings,
+    session_factory: Callable[[], AsyncContextManager[AsyncSession]],
+) -> JobQueue:
+    """Build the job queue selected by ``ANALYSIS_JOB_QUEUE``."""
+    if settings.ANALYSIS_JOB_QUEUE == "memory":
+        return InMemoryJobQueue()
+    elif settings.ANALYSIS_JOB_QUEUE == "database":
+        return DatabaseJobQueue(session_factory)
+    raise ValueError(
+        f"Unknown ANALYSIS_JOB_QUEUE backend: {settings.ANALYSIS_JOB_QUEUE}"
+    )
@@ -0,0 +1,179 @@
+"""Chat completion backends behind ``AIService``.
+
+A provider answers a list of chat messages with the text of a JSON object.
+Every provider caps the completions it runs at once at ``concurrency`` and
+cancels one after ``timeout`` seconds; time spent waiting for a slot does
+not count towards the timeout. Available providers:
+
+- ``openai``: OpenAI's chat completions API, through the app's shared
+  ``OpenAIRateLimiter`` when one is given
+- ``local``: any OpenAI-compatible server (vLLM, Ollama, llama.cpp, ...)
+  reached at a base URL
+- ``fake``: deterministic answers built from the prompt after an optional
+  simulated latency, for load tests and offline runs
+"""
+
+import asyncio
+import hashlib
+import json
+import re
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+from openai import AsyncOpenAI
+
+from github_analysis.config import Settings
+from github_analysis.services.openai_rate_limiter import OpenAIRateLimiter
+from github_analysis.services.tokens import estimate_tokens
+
+# Tokens an analysis answer is assumed to take, for rate limiting
+OUTPUT_TOKEN_ALLOWANCE = 1000
+FILE_LINE = re.compile(r"^File: (\S+) \(", re.MULTILINE)
+IMPACT_LEVELS = ("low", "medium", "high")
+
+
+class LLMProvider(ABC):
+    """Backend that runs JSON-mode chat completions.
+
+    ``model`` names the answers' source: cached analyses are only reused for
+    the same model.
+    """
+
+    model: str
+
+    def __init__(self, concurrency: int = 8, timeout: Optional[float] = 120.0):
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self._slots = asyncio.Semaphore(self.concurrency)
+
+    async def complete_json(self, messages: List[Dict], temperature: float) -> str:
+        """Return the content of a completion asked for a JSON object."""
+        async with self._slots:
+            return await asyncio.wait_for(
+                self._complete_json(messages, temperature), self.timeout
+            )
+
+    @abstractmethod
+    async def _complete_json(self, messages: List[Dict], temperature: float) -> str: ...
+
+    async def close(self) -> None:
+        pass
+
+
+class OpenAIChatProvider(LLMProvider):
+    """OpenAI's API, or an OpenAI-compatible server at ``base_url``.
+
+    With a ``rate_limiter``, it retries failed calls in place of the SDK and
+    applies ``timeout`` to each attempt.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        model: str = "gpt-4-turbo-preview",
+        base_url: Optional[str] = None,
+        concurrency: int = 8,
+        timeout: float = 120.0,
+        rate_limiter: Optional[OpenAIRateLimiter] = None,
+    ):
+        super().__init__(concurrency, None if rate_limiter else timeout)
+        self.client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            **({"max_retries": 0} if rate_limiter else {}),
+        )
+        self.model = model
+        self.rate_limiter = rate_limiter
+        self.request_timeout = timeout
+
+    async def _complete_json(self, messages: List[Dict], temperature: float) -> str:
+        def request():
+            return self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=temperature,
+                response_format={"type": "json_object"},
+            )
+
+        if self.rate_limiter is None:
+            response = await request()
+        else:
+            tokens = OUTPUT_TOKEN_ALLOWANCE + sum(
+                estimate_tokens(message["content"]) for message in messages
+            )
+            response = await self.rate_limiter.call(
+                self.model, tokens, request, self.request_timeout
+            )
+        if response.choices[0].message.content is None:
+            raise ValueError("No content in response")
+        return response.choices[0].message.content
+
+    async def close(self) -> None:
+        await self.client.close()
+
+
+class FakeLLMProvider(LLMProvider):
+    """Deterministic stand-in for a real model.
+
+    Answers per-file summary prompts with a summary of every ``File:`` line,
+    and analysis prompts with every analysis key, derived from the prompt's
+    hash. Each completion takes ``latency`` seconds.
+    """
+
+    def __init__(
+        self, latency: float = 0.0, concurrency: int = 8, timeout: float = 120.0
+    ):
+        super().__init__(concurrency, timeout)
+        self.model = "fake-llm"
+        self.latency = latency
+        self.calls = 0
+
+    async def _complete_json(self, messages: List[Dict], temperature: float) -> str:
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        prompt = messages[-1]["content"]
+        files = FILE_LINE.findall(prompt)
+        if prompt.startswith("Summarize"):
+            return json.dumps({path: f"Changes to {path}." for path in files})
+        digest = hashlib.sha256(prompt.encode("utf-8")).digest()
+        title = re.search(r"^Title: (.*)$", prompt, re.MULTILINE)
+        title = title.group(1) if title else "this pull request"
+        return json.dumps(
+            {
+                "summary": f"{title}, changing {len(files)} files.",
+                "change_type": ["feature" if digest[0] % 2 else "bug-fix"],
+                "impact_level": IMPACT_LEVELS[digest[1] % len(IMPACT_LEVELS)],
+                "impact_details": f"Touches {', '.join(files) or 'no files'}.",
+                "key_points": [f"Changes {path}" for path in files[:5]],
+                "technical_details": f"Prompt digest {digest.hex()[:16]}.",
+            }
+        )
+
+
+def create_llm_provider(
+    settings: Settings, rate_limiter: Optional[OpenAIRateLimiter] = None
+) -> LLMProvider:
+    """Build the LLM provider selected by ``LLM_PROVIDER``; ``rate_limiter``
+    governs calls to OpenAI."""
+    limits = {"concurrency": settings.LLM_CONCURRENCY, "timeout": settings.LLM_TIMEOUT}
+    if settings.LLM_PROVIDER == "openai":
+        return OpenAIChatProvider(
+            settings.OPENAI_API_KEY,
+            settings.LLM_MODEL,
+            rate_limiter=rate_limiter,
+            **limits,
+        )
+    elif settings.LLM_PROVIDER == "local":
+        if not settings.LLM_BASE_URL:
+            raise ValueError("LLM_PROVIDER=local needs LLM_BASE_URL")
+        return OpenAIChatProvider(
+            # Local servers mostly ignore the key, but the client needs one
+            settings.LLM_API_KEY or "local",
+            settings.LLM_MODEL,
+            base_url=settings.LLM_BASE_URL,
+            **limits,
+        )
+    elif settings.LLM_PROVIDER == "fake":
+        return FakeLLMProvider(settings.LLM_FAKE_LATENCY, **limits)
+    raise ValueError(f"Unknown LLM_PROVIDER backend: {settings.LLM_PROVIDER}")
@@ -0,0 +1,266 @@
+"""Client-side rate limiting of OpenAI API calls.
+
+One ``OpenAIRateLimiter`` is shared by everything that calls OpenAI with
+the same key, so concurrent analyses and embedding batches stay within the
+organization's limits together instead of each finding them with 429s.
+"""
+
+import asyncio
+import logging
+import math
+import random
+import statistics
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+import openai
+
+from github_analysis.config import Settings
+
+T = TypeVar("T")
+
+# Errors worth another attempt; other API errors (bad requests, auth) are not
+TRANSIENT_ERRORS = (
+    asyncio.TimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+@dataclass
+class ModelLane:
+    """Buckets and concurrency of one model; OpenAI limits each separately."""
+
+    requests: float
+    tokens: float
+    concurrency_limit: float
+    in_flight: int = 0
+    last_refill: float = 0.0
+    blocked_until: float = 0.0
+    last_decrease: float = -math.inf
+    waiters: Deque[asyncio.Future] = field(default_factory=deque)
+
+
+class OpenAIRateLimiter:
+    """Schedules OpenAI calls per model.
+
+    Each model gets a request bucket and a token bucket refilled at
+    ``requests_per_minute`` and ``tokens_per_minute``, sized for a minute's
+    worth, and an adaptive cap on calls in flight: the cap halves on a 429
+    (at most once per ``backoff_base`` seconds) and grows back by one per
+    cap's worth of successes, between 1 and ``max_concurrency``.
+
+    Each attempt is cancelled after ``timeout`` seconds. Timeouts, connection
+    errors, 5xx responses and 429s are retried up to ``max_retries`` times
+    with exponential backoff and jitter; a 429 also blocks the model for its
+    ``Retry-After``. Running out of quota is not retried.
+
+    ``stats`` reports call counts and how long calls waited for a slot.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: int = 500,
+        tokens_per_minute: int = 300_000,
+        max_concurrency: int = 16,
+        timeout: float = 60.0,
+        max_retries: int = 4,
+        backoff_base: float = 1.0,
+        max_backoff: float = 60.0,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], Awaitable[None]] = asyncio.sleep,
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrency = max(1, max_concurrency)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.max_backoff = max_backoff
+        self._clock = clock
+        self._sleep = sleep
+        self._lanes: Dict[str, ModelLane] = {}
+        self.calls = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.timeouts = 0
+        self.failures = 0
+        self._queue_waits: Deque[float] = deque(maxlen=1000)
+
+    def lane(self, model: str) -> ModelLane:
+        if model not in self._lanes:
+            self._lanes[model] = ModelLane(
+                requests=self.requests_per_minute,
+                tokens=self.tokens_per_minute,
+                concurrency_limit=self.max_concurrency,
+                last_refill=self._clock(),
+            )
+        return self._lanes[model]
+
+    async def call(
+        self,
+        model: str,
+        tokens: int,
+        request: Callable[[], Awaitable[T]],
+        timeout: Optional[float] = None,
+    ) -> T:
+        """Run ``request``, a call to ``model`` costing about ``tokens``
+        tokens, once it fits the limits; retries it on transient errors."""
+        lane = self.lane(model)
+        timeout = timeout or self.timeout
+        attempt = 0
+        while True:
+            queued_at = self._clock()
+            await self._acquire(lane, tokens)
+            self._queue_waits.append(self._clock() - queued_at)
+            self.calls += 1
+            try:
+                result = await asyncio.wait_for(request(), timeout)
+            except openai.RateLimitError as e:
+                self.rate_limited += 1
+                if e.code == "insufficient_quota" or attempt >= self.max_retries:
+                    self.failures += 1
+                    raise
+                delay = self._backoff(attempt, e.response.headers.get("retry-after"))
+                self._decrease(lane)
+                lane.blocked_until = max(lane.blocked_until, self._clock() + delay)
+                error: Exception = e
+            except TRANSIENT_ERRORS as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    self.timeouts += 1
+                if attempt >= self.max_retries:
+                    self.failures += 1
+                    raise
+                delay = self._backoff(attempt)
+                error = e
+            else:
+                # Additive increase: one more slot per cap's worth of successes
+                lane.concurrency_limit = min(
+                    self.max_concurrency,
+                    lane.concurrency_limit + 1 / lane.concurrency_limit,
+                )
+                return result
+            finally:
+                self._release(lane)
+
+            attempt += 1
+            self.retries += 1
+            logging.warning(
+                f"OpenAI call to {model} failed ({type(error).__name__}: {error}); "
+                f"retry {attempt}/{self.max_retries} in {delay:.1f}s"
+            )
+            await self._sleep(delay)
+
+    async def _acquire(self, lane: ModelLane, tokens: int) -> None:
+        # Calls queue in arrival order for an in-flight slot, then the buckets
+        while lane.in_flight >= int(lane.concurrency_limit) or lane.waiters:
+            waiter = asyncio.get_running_loop().create_future()
+            lane.waiters.append(waiter)
+            try:
+                await waiter
+            except BaseException:
+                if waiter in lane.waiters:
+                    lane.waiters.remove(waiter)
+                elif not waiter.cancelled():
+                    # Woken but cancelled before taking the slot: pass it on
+                    self._wake(lane)
+                raise
+            if lane.in_flight < int(lane.concurrency_limit):
+                break
+        lane.in_flight += 1
+        try:
+            while (delay := self._reserve(lane, tokens)) > 0:
+                await self._sleep(delay)
+        except BaseException:
+            self._release(lane)
+            raise
+
+    def _release(self, lane: ModelLane) -> None:
+        lane.in_flight -= 1
+        self._wake(lane)
+
+    def _wake(self, lane: ModelLane) -> None:
+        if lane.waiters and lane.in_flight < int(lane.concurrency_limit):
+            waiter = lane.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def _reserve(self, lane: ModelLane, tokens: int) -> float:
+        """Take a request and ``tokens`` from the buckets, or return how long
+        to wait until they are refilled enough."""
+        now = self._clock()
+        if lane.blocked_until > now:
+            return lane.blocked_until - now
+        elapsed = now - lane.last_refill
+        lane.last_refill = now
+        lane.requests = min(
+            self.requests_per_minute,
+            lane.requests + elapsed * self.requests_per_minute / 60,
+        )
+        lane.tokens = min(
+            self.tokens_per_minute,
+            lane.tokens + elapsed * self.tokens_per_minute / 60,
+        )
+        # A call larger than a whole bucket waits for a full one
+        tokens = min(tokens, self.tokens_per_minute)
+        if lane.requests >= 1 and lane.tokens >= tokens:
+            lane.requests -= 1
+            lane.tokens -= tokens
+            return 0.0
+        return max(
+            (1 - lane.requests) * 60 / self.requests_per_minute,
+            (tokens - lane.tokens) * 60 / self.tokens_per_minute,
+        )
+
+    def _decrease(self, lane: ModelLane) -> None:
+        """Multiplicative decrease, once for a burst of concurrent 429s."""
+        now = self._clock()
+        if now - lane.last_decrease < self.backoff_base:
+            return
+        lane.last_decrease = now
+        lane.concurrency_limit = max(1.0, lane.concurrency_limit / 2)
+
+    def _backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        try:
+            delay = float(retry_after) if retry_after else None
+        except ValueError:
+            delay = None
+        if delay is None:
+            delay = min(self.max_backoff, self.backoff_base * 2**attempt)
+        # Jitter keeps concurrent callers from retrying in lockstep
+        return delay + random.uniform(0, self.backoff_base + delay * 0.1)
+
+    def stats(self) -> Dict:
+        waits = sorted(self._queue_waits)
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "timeouts": self.timeouts,
+            "failures": self.failures,
+            "queue_wait_seconds": {
+                "mean": statistics.fmean(waits) if waits else 0.0,
+                "p95": waits[int(len(waits) * 0.95)] if waits else 0.0,
+                "max": waits[-1] if waits else 0.0,
+            },
+            "models": {
+                model: {
+                    "concurrency_limit": int(lane.concurrency_limit),
+                    "in_flight": lane.in_flight,
+                    "queued": len(lane.waiters),
+                }
+                for model, lane in self._lanes.items()
+            },
+        }
+
+
+def create_openai_rate_limiter(settings: Settings) -> OpenAIRateLimiter:
+    return OpenAIRateLimiter(
+        requests_per_minute=settings.OPENAI_REQUESTS_PER_MINUTE,
+        tokens_per_minute=settings.OPENAI_TOKENS_PER_MINUTE,
+        max_concurrency=settings.OPENAI_MAX_CONCURRENCY,
+        timeout=settings.OPENAI_TIMEOUT,
+        max_retries=settings.OPENAI_MAX_RETRIES,
+    )
@@ -0,0 +1,141 @@
+"""Column-only loader for the PR context sent to analysis.
+
+Eager-loading diffs, hunks and comments with chained ``joinedload`` makes the
+database return diffs x hunks x comments rows for a single PR. These loaders
+run one narrow query per table instead, so the rows returned are the sum of
+those counts, and build the context dicts straight from tuples without
+hydrating ORM objects. Contexts for many PRs are loaded with the same four
+queries.
+"""
+
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from github_analysis.models.models import (
+    DiffHunk,
+    HunkContent,
+    PRComment,
+    PRDiff,
+    PullRequest,
+)
+from github_analysis.services.job_queue import PermanentJobError
+
+
+class PRLookupError(PermanentJobError, ValueError):
+    """A PR number that is not stored, or is stored for several repositories
+    and was looked up without one."""
+
+
+async def find_pr_id(
+    db: AsyncSession,
+    pr_id: int,
+    owner: Optional[str] = None,
+    repo: Optional[str] = None,
+) -> int:
+    """Database id of a PR number, within ``owner``/``repo`` when given.
+
+    Raises ``PRLookupError`` when the number is missing or, without a
+    repository, stored for several repositories.
+    """
+    query = select(PullRequest.id).where(PullRequest.number == pr_id)
+    if owner is not None and repo is not None:
+        query = query.where(
+            PullRequest.repo_owner == owner, PullRequest.repo_name == repo
+        )
+    db_ids = (await db.execute(query.limit(2))).scalars().all()
+
+    if not db_ids:
+        raise PRLookupError(f"PR number {pr_id} not found")
+    if len(db_ids) > 1:
+        raise PRLookupError(
+            f"PR number {pr_id} exists in several repositories; pass owner and repo"
+        )
+    return db_ids[0]
+
+
+async def load_pr_context(
+    db: AsyncSession,
+    pr_id: int,
+    owner: Optional[str] = None,
+    repo: Optional[str] = None,
+) -> Tuple[Dict, int]:
+    """Load a PR's context by PR number, returning it with the PR's database
+    id. See ``AnalysisService.get_pr_context``."""
+    db_id = await find_pr_id(db, pr_id, owner, repo)
+    contexts = await load_pr_contexts(db, [db_id])
+    return contexts[db_id], db_id
+
+
+async def load_pr_contexts(db: AsyncSession, db_ids: List[int]) -> Dict[int, Dict]:
+    """Load the contexts of several PRs at once, keyed by database id.
+
+    Takes four queries however many PRs are asked for; ids that do not exist
+    are left out.
+    """
+    prs = (
+        await db.execute(
+            select(
+                PullRequest.id,
+                PullRequest.number,
+                PullRequest.repo_owner,
+                PullRequest.repo_name,
+                PullRequest.title,
+                PullRequest.body,
+            ).where(PullRequest.id.in_(db_ids))
+        )
+    ).all()
+    diffs = (
+        await db.execute(
+            select(PRDiff.id, PRDiff.pr_id, PRDiff.file_path, PRDiff.change_type)
+            .where(PRDiff.pr_id.in_(db_ids))
+            .order_by(PRDiff.id)
+        )
+    ).all()
+    hunks = await db.execute(
+        select(DiffHunk.diff_id, HunkContent.content)
+        .join(HunkContent, HunkContent.hash == DiffHunk.content_hash)
+        .join(PRDiff, PRDiff.id == DiffHunk.diff_id)
+        .where(PRDiff.pr_id.in_(db_ids))
+        .order_by(DiffHunk.diff_id, DiffHunk.id)
+    )
+    comments = await db.execute(
+        select(PRComment.pr_id, PRComment.user_login, PRComment.body)
+        .where(PRComment.pr_id.in_(db_ids))
+        .order_by(PRComment.id)
+    )
+
+    hunk_contents = defaultdict(list)
+    for diff_id, content in hunks:
+        hunk_contents[diff_id].append(content)
+    changes = defaultdict(list)
+    for diff in diffs:
+        changes[diff.pr_id].append(
+            {
+                "file": diff.file_path,
+                "change_type": diff.change_type.value,
+                "changes": hunk_contents[diff.id],
+            }
+        )
+    discussion = defaultdict(list)
+    for pr_id, author, body in comments:
+        discussion[pr_id].append({"author": author, "comment": body})
+
+    return {
+        pr.id: {
+            "id": pr.number,
+            # Rows stored before repositories were recorded have neither part
+            "repo": (
+                f"{pr.repo_owner}/{pr.repo_name}"
+                if pr.repo_owner and pr.repo_name
+                else None
+            ),
+            "title": pr.title,
+            "description": pr.body,
+            "changes": changes[pr.id],
+            "discussion": discussion[pr.id],
+        }
+        for pr in prs
+    }
@@ -0,0 +1,283 @@
+"""Bulk persistence of fetched PRs.
+
+A batch of PRs is written with their comments, diffs and hunks in a handful of
+multi-row statements. PRs and comments are upserted with
+``INSERT ... ON CONFLICT (github_id) DO UPDATE``, so re-ingested PRs pick up
+edits. Diffs and hunks are rewritten only when the PR's diff content hash
+changed, and hunk text goes to the content-addressed ``hunk_contents`` table,
+so each distinct hunk body is stored once.
+"""
+
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from github_analysis.models.models import (
+    DiffHunk,
+    HunkContent,
+    PRComment,
+    PRDiff,
+    PullRequest,
+)
+from github_analysis.services.content_hash import diff_content_hash, hunk_content_hash
+
+# Keeps IN lists well under the driver's bind parameter limit
+LOOKUP_CHUNK_SIZE = 1000
+
+
+def _timestamp(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value.replace("Z", "+00:00")) if value else None
+
+
+class PRWriter:
+    """Writes batches of fetched PR details (see
+    ``GitHubService._fetch_pr_details``) to the database."""
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def write(self, batch: List[dict]) -> List[dict]:
+        """Upsert a batch of PRs in one transaction, returning one result per
+        PR, in order.
+
+        If the batch fails as a whole, each PR is retried in its own
+        transaction so one bad PR does not cost the others.
+        """
+        if len(batch) > 1:
+            try:
+                async with self.db.begin():
+                    return await self._write_batch(batch)
+            except Exception as exc:
+                logging.warning(
+                    f"Bulk write of {len(batch)} PRs failed, "
+                    f"retrying one at a time: {exc}"
+                )
+        return [await self._write_one(details) for details in batch]
+
+    async def _write_one(self, details: dict) -> dict:
+        try:
+            async with self.db.begin():
+                return (await self._write_batch([details]))[0]
+        except Exception as db_exc:
+            return {
+                "status": "error",
+                "pr_number": details["pr_data"]["number"],
+                "detail": f"Database error: {db_exc}",
+            }
+
+    async def _write_batch(self, batch: List[dict]) -> List[dict]:
+        """Upsert PRs and their comments, replacing diffs and hunks only for
+        PRs whose diff content hash changed.
+
+        A PR is reported as updated when its ``updated_at`` or diff changed
+        since it was stored, and as a duplicate otherwise.
+        """
+        github_ids = [details["pr_data"]["id"] for details in batch]
+        stored = {
+            row.github_id: row
+            for row in await self.db.execute(
+                select(
+                    PullRequest.id,
+                    PullRequest.github_id,
+                    PullRequest.updated_at,
+                    PullRequest.diff_hash,
+                ).where(PullRequest.github_id.in_(github_ids))
+            )
+        }
+
+        results: List[dict] = []
+        pr_rows: List[Dict] = []
+        to_write: List[dict] = []
+        rediff: Set[int] = set()  # github_ids whose diffs are (re)written
+        seen: Set[int] = set()
+        for details in batch:
+            pr_data = details["pr_data"]
+            result = {"status": "success", "pr_number": pr_data["number"]}
+            results.append(result)
+            if pr_data["id"] in seen:
+                # One statement cannot upsert the same row twice
+                result["status"] = "duplicate"
+                continue
+            seen.add(pr_data["id"])
+
+            row = {
+                "github_id": pr_data["id"],
+                "repo_owner": details["owner"],
+                "repo_name": details["repo"],
+                "number": pr_data["number"],
+                "title": pr_data["title"],
+                "body": pr_data.get("body", ""),
+                "created_at": _timestamp(pr_data["created_at"]),
+                "updated_at": _timestamp(pr_data.get("updated_at")),
+                "diff_truncated": details.get("diff_truncated", False),
+                "diff_hash": diff_content_hash(details["diffs"]),
+            }
+            pr_rows.append(row)
+            to_write.append(details)
+
+            existing = stored.get(pr_data["id"])
+            if existing is None or existing.diff_hash != row["diff_hash"]:
+                rediff.add(pr_data["id"])
+            if existing is not None:
+                changed = (
+                    existing.updated_at != row["updated_at"] or pr_data["id"] in rediff
+                )
+                result["status"] = "updated" if changed else "duplicate"
+
+        if not pr_rows:
+            return results
+
+        statement = insert(PullRequest)
+        upserted = await self.db.execute(
+            statement.on_conflict_do_update(
+                index_elements=[PullRequest.github_id],
+                set_={
+                    column: statement.excluded[column]
+                    for column in pr_rows[0]
+                    if column != "github_id"
+                },
+            ).returning(PullRequest.id, PullRequest.github_id),
+            pr_rows,
+        )
+        pr_ids = {row.github_id: row.id for row in upserted}
+
+        await self._write_comments(to_write, pr_ids, stored)
+        await self._write_diffs(
+            [details for details in to_write if details["pr_data"]["id"] in rediff],
+            pr_ids,
+            stored,
+        )
+        return results
+
+    async def _write_comments(
+        self, batch: List[dict], pr_ids: Dict[int, int], stored: Dict
+    ) -> None:
+        """Upsert comments and drop ones that disappeared from stored PRs."""
+        comment_rows = {}
+        for details in batch:
+            pr_id = pr_ids[details["pr_data"]["id"]]
+            for comment in details["comments"]:
+                comment_rows[comment["id"]] = {
+                    "github_id": comment["id"],
+                    "body": comment["body"],
+                    "user_login": comment["user"]["login"],
+                    "pr_id": pr_id,
+                }
+
+        stored_ids = [
+            pr_ids[details["pr_data"]["id"]]
+            for details in batch
+            if details["pr_data"]["id"] in stored
+        ]
+        if stored_ids:
+            await self.db.execute(
+                delete(PRComment).where(
+                    PRComment.pr_id.in_(stored_ids),
+                    PRComment.github_id.not_in(list(comment_rows)),
+                )
+            )
+        if comment_rows:
+            statement = insert(PRComment)
+            await self.db.execute(
+                statement.on_conflict_do_update(
+                    index_elements=[PRComment.github_id],
+                    set_={
+                        "body": statement.excluded.body,
+                        "user_login": statement.excluded.user_login,
+                        "pr_id": statement.excluded.pr_id,
+                    },
+                ),
+                list(comment_rows.values()),
+            )
+
+    async def _write_diffs(
+        self, batch: List[dict], pr_ids: Dict[int, int], stored: Dict
+    ) -> None:
+        """Replace the diffs and hunks of PRs whose diff changed."""
+        stored_ids = [
+            pr_ids[details["pr_data"]["id"]]
+            for details in batch
+            if details["pr_data"]["id"] in stored
+        ]
+        if stored_ids:
+            # Hunks go with their diffs through the FK cascade
+            await self.db.execute(delete(PRDiff).where(PRDiff.pr_id.in_(stored_ids)))
+
+        diff_rows = []
+        diff_hunks = []
+        for details in batch:
+            pr_id = pr_ids[details["pr_data"]["id"]]
+            for diff in details["diffs"]:
+                diff_rows.append(
+                    {
+                        "file_path": diff["file_path"],
+                        "old_file_path": diff.get("old_file_path"),
+                        "change_type": diff["change_type"],
+                        "truncated": diff.get("truncated", False),
+                        "pr_id": pr_id,
+                    }
+                )
+                diff_hunks.append(diff["hunks"])
+        if not diff_rows:
+            return
+
+        diff_ids = (
+            await self.db.execute(
+                insert(PRDiff).returning(PRDiff.id, sort_by_parameter_order=True),
+                diff_rows,
+            )
+        ).scalars()
+        contents = {}
+        hunk_rows = []
+        for diff_id, hunks in zip(diff_ids, diff_hunks):
+            for hunk in hunks:
+                content_hash = hunk_content_hash(hunk["content"])
+                contents[content_hash] = hunk["content"]
+                hunk_rows.append(
+                    {
+                        "old_start": hunk["old_start"],
+                        "old_lines": hunk["old_lines"],
+                        "new_start": hunk["new_start"],
+                        "new_lines": hunk["new_lines"],
+                        "content_hash": content_hash,
+                        "diff_id": diff_id,
+                    }
+                )
+        if hunk_rows:
+            await self._write_hunk_contents(contents)
+            await self.db.execute(insert(DiffHunk), hunk_rows)
+
+    async def _write_hunk_contents(self, contents: Dict[str, str]) -> None:
+        """Store hunk texts by content hash, sending only ones not stored yet."""
+        hashes = list(contents)
+        known = set()
+        for start in range(0, len(hashes), LOOKUP_CHUNK_SIZE):
+            known.update(
+                (
+                    await self.db.execute(
+                        select(HunkContent.hash).where(
+                            HunkContent.hash.in_(
+                                hashes[start : start + LOOKUP_CHUNK_SIZE]
+                            )
+                        )
+                    )
+                ).scalars()
+            )
+
+        new_rows = [
+            {"hash": content_hash, "content": content}
+            for content_hash, content in contents.items()
+            if content_hash not in known
+        ]
+        if new_rows:
+            # Another writer may store the same text in the meantime
+            await self.db.execute(
+                insert(HunkContent).on_conflict_do_nothing(
+                    index_elements=[HunkContent.hash]
+                ),
+                new_rows,
+            )
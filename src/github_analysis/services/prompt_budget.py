@@ -0,0 +1,176 @@
+"""Fitting PR contexts into an LLM prompt budget.
+
+Token counts are estimated with ``tokens.estimate_tokens``, which errs on
+the high side, so a prompt built to a budget stays within it. Noise is dropped
+before anything is ranked: lockfiles and generated files keep only their
+header line, and hunks that change nothing but whitespace are left out.
+"""
+
+from typing import Dict, List
+
+from github_analysis.services.tokens import estimate_tokens
+
+LOCKFILES = frozenset(
+    {
+        "package-lock.json",
+        "npm-shrinkwrap.json",
+        "yarn.lock",
+        "pnpm-lock.yaml",
+        "poetry.lock",
+        "Pipfile.lock",
+        "uv.lock",
+        "Cargo.lock",
+        "Gemfile.lock",
+        "composer.lock",
+        "go.sum",
+        "mix.lock",
+        "pubspec.lock",
+        "Podfile.lock",
+    }
+)
+GENERATED_SUFFIXES = (
+    ".min.js",
+    ".min.css",
+    ".map",
+    ".snap",
+    "_pb2.py",
+    "_pb2_grpc.py",
+    ".pb.go",
+    ".generated.ts",
+    ".g.dart",
+)
+GENERATED_DIRS = ("dist/", "build/", "vendor/", "node_modules/", "__generated__/")
+
+
+def is_generated_file(path: str) -> bool:
+    name = path.rsplit("/", 1)[-1]
+    if name in LOCKFILES or name.endswith(GENERATED_SUFFIXES):
+        return True
+    return any(path.startswith(d) or f"/{d}" in path for d in GENERATED_DIRS)
+
+
+def is_whitespace_only(hunk: str) -> bool:
+    """True if the hunk's removed and added lines match once whitespace is
+    ignored."""
+    removed, added = [], []
+    for line in hunk.split("\n"):
+        if line.startswith("-"):
+            removed.append("".join(line[1:].split()))
+        elif line.startswith("+"):
+            added.append("".join(line[1:].split()))
+    return [line for line in removed if line] == [line for line in added if line]
+
+
+def _file_header(change: Dict) -> str:
+    return f"File: {change['file']} ({change['change_type']})"
+
+
+def change_tokens(changes: List[Dict]) -> int:
+    """Estimated tokens of changes as ``AIService`` formats them."""
+    return sum(
+        estimate_tokens(_file_header(change))
+        + sum(estimate_tokens(hunk) for hunk in change["changes"])
+        for change in changes
+    )
+
+
+def filter_changes(changes: List[Dict]) -> List[Dict]:
+    """Drop hunks of lockfiles and generated files, and whitespace-only
+    hunks."""
+    filtered = []
+    for change in changes:
+        if is_generated_file(change["file"]):
+            hunks = ["[generated file, diff omitted]"] if change["changes"] else []
+        else:
+            hunks = [hunk for hunk in change["changes"] if not is_whitespace_only(hunk)]
+        filtered.append({**change, "changes": hunks})
+    return filtered
+
+
+def budget_changes(changes: List[Dict], max_tokens: int) -> List[Dict]:
+    """Fit changes into ``max_tokens`` estimated tokens.
+
+    Every file keeps its header line while those fit; hunks are then added by
+    rank, each file's first hunk before any file's second and smaller hunks
+    first within a rank, until the budget is spent. Files that lost hunks say
+    how many, so the model knows the picture is partial.
+    """
+    remaining = max_tokens
+    files = []
+    for change in changes:
+        header_tokens = estimate_tokens(_file_header(change))
+        if header_tokens > remaining:
+            break
+        remaining -= header_tokens
+        files.append(change)
+
+    candidates = sorted(
+        (rank, estimate_tokens(hunk), file_index)
+        for file_index, change in enumerate(files)
+        for rank, hunk in enumerate(change["changes"])
+    )
+    chosen = set()
+    for rank, tokens, file_index in candidates:
+        if tokens <= remaining:
+            chosen.add((file_index, rank))
+            remaining -= tokens
+
+    budgeted = []
+    for file_index, change in enumerate(files):
+        hunks = [
+            hunk
+            for rank, hunk in enumerate(change["changes"])
+            if (file_index, rank) in chosen
+        ]
+        omitted = len(change["changes"]) - len(hunks)
+        if omitted:
+            hunks.append(f"[{omitted} more hunks omitted]")
+        budgeted.append({**change, "changes": hunks})
+    if len(files) < len(changes):
+        budgeted.append(
+            {
+                "file": f"[{len(changes) - len(files)} more files omitted]",
+                "change_type": "omitted",
+                "changes": [],
+            }
+        )
+    return budgeted
+
+
+def budget_discussion(comments: List[Dict], max_tokens: int) -> List[Dict]:
+    """Keep comments in order while they fit in ``max_tokens``."""
+    remaining = max_tokens
+    kept = []
+    for comment in comments:
+        tokens = estimate_tokens(f"{comment['author']}: {comment['comment']}")
+        if tokens > remaining:
+            break
+        remaining -= tokens
+        kept.append(comment)
+    if len(kept) < len(comments):
+        kept.append(
+            {
+                "author": "[note]",
+                "comment": f"{len(comments) - len(kept)} more comments omitted",
+            }
+        )
+    return kept
+
+
+def group_changes(changes: List[Dict], max_tokens: int) -> List[List[Dict]]:
+    """Split changes into groups of whole files of at most ``max_tokens``
+    estimated tokens each; a file larger than that is budgeted down to fit
+    a group of its own."""
+    groups: List[List[Dict]] = []
+    tokens = 0
+    for change in changes:
+        change_size = change_tokens([change])
+        if change_size > max_tokens:
+            change = budget_changes([change], max_tokens)[0]
+            change_size = change_tokens([change])
+        if not groups or tokens + change_size > max_tokens:
+            groups.append([])
+            tokens = 0
+        groups[-1].append(change)
+        tokens += change_size
+    return groups
@@ -0,0 +1,216 @@
+import asyncio
+import logging
+import math
+import random
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Mapping, Optional
+
+
+class RateLimitExceeded(Exception):
+    """GitHub kept rate limiting a request after every retry was used up."""
+
+    def __init__(self, detail: str, retry_at: float):
+        super().__init__(detail)
+        self.retry_at = retry_at
+
+
+def budget_key(token: str, resource: str = "core") -> str:
+    """Key for one token's budget on one GitHub rate limit resource.
+
+    REST ("core") and GraphQL calls are metered against separate budgets, so
+    they are tracked separately.
+    """
+    return token if resource == "core" else f"{token}:{resource}"
+
+
+class NoTokensAvailable(Exception):
+    """Every token in the pool was rejected by GitHub."""
+
+
+@dataclass
+class TokenBudget:
+    """What we know about one token's rate limit window."""
+
+    limit: Optional[int] = None
+    remaining: Optional[int] = None
+    reset_at: float = 0.0  # Epoch seconds, from X-RateLimit-Reset
+    blocked_until: float = 0.0  # Set by Retry-After and secondary limits
+    allowance: float = 0.0  # Requests that may be sent right away
+    last_refill: float = 0.0
+
+
+class GitHubRateLimiter:
+    """Schedules GitHub requests per token from the rate limit headers.
+
+    Each token gets a token bucket whose refill rate spreads the remaining
+    budget (minus ``reserve``) evenly over the rest of the rate limit window,
+    allowing bursts of up to ``burst`` requests. Responses that hit a primary
+    or secondary limit block the token until ``Retry-After``/reset, or for an
+    exponential backoff with jitter when GitHub gives no hint.
+    """
+
+    def __init__(
+        self,
+        reserve: int = 50,
+        burst: int = 100,
+        backoff_base: float = 1.0,
+        max_backoff: float = 600.0,
+        clock: Callable[[], float] = time.time,
+        sleep: Callable[[float], Awaitable[None]] = asyncio.sleep,
+    ):
+        self.reserve = reserve
+        self.burst = burst
+        self.backoff_base = backoff_base
+        self.max_backoff = max_backoff
+        self._clock = clock
+        self._sleep = sleep
+        self._budgets: Dict[str, TokenBudget] = {}
+
+    def budget(self, token: str) -> TokenBudget:
+        if token not in self._budgets:
+            self._budgets[token] = TokenBudget(
+                allowance=self.burst, last_refill=self._clock()
+            )
+        return self._budgets[token]
+
+    async def acquire(self, token: str) -> None:
+        """Wait until ``token`` may send another request."""
+        while (delay := self.try_acquire(token)) > 0:
+            await self._sleep(delay)
+
+    async def sleep(self, seconds: float) -> None:
+        await self._sleep(seconds)
+
+    def try_acquire(self, token: str) -> float:
+        """Take a request slot for ``token`` without waiting.
+
+        Returns 0 when the slot was taken, otherwise the number of seconds
+        until one frees up.
+        """
+        return self._reserve(self.budget(token))
+
+    def _reserve(self, budget: TokenBudget) -> float:
+        """Take a request slot, or return how long to wait for one."""
+        now = self._clock()
+        if budget.blocked_until > now:
+            return budget.blocked_until - now
+        if budget.remaining is None:
+            # Nothing known yet; the first response tells us the budget
+            return 0.0
+        if budget.reset_at <= now:
+            # The window rolled over; the next response reports the new budget
+            budget.remaining = None
+            budget.allowance = self.burst
+            return 0.0
+
+        usable = budget.remaining - self.reserve
+        if usable <= 0:
+            return budget.reset_at - now
+        rate = usable / (budget.reset_at - now)
+        budget.allowance = min(
+            self.burst, budget.allowance + (now - budget.last_refill) * rate
+        )
+        budget.last_refill = now
+        if budget.allowance < 1:
+            return (1 - budget.allowance) / rate
+        budget.allowance -= 1
+        budget.remaining -= 1
+        return 0.0
+
+    def record(self, token: str, headers: Mapping[str, str]) -> None:
+        """Update a token's budget from a response's rate limit headers."""
+        if "X-RateLimit-Remaining" not in headers:
+            return
+        budget = self.budget(token)
+        budget.remaining = int(headers["X-RateLimit-Remaining"])
+        if "X-RateLimit-Limit" in headers:
+            budget.limit = int(headers["X-RateLimit-Limit"])
+        if "X-RateLimit-Reset" in headers:
+            budget.reset_at = float(headers["X-RateLimit-Reset"])
+
+    def retry_delay(
+        self,
+        token: str,
+        status: int,
+        headers: Mapping[str, str],
+        body: str = "",
+        attempt: int = 0,
+    ) -> Optional[float]:
+        """Return how long to back off if the response was rate limited.
+
+        Returns ``None`` when the response is not a rate limit error (e.g. a
+        403 for missing permissions), otherwise blocks the token for the
+        returned number of seconds.
+        """
+        if status not in (403, 429):
+            return None
+
+        now = self._clock()
+        if headers.get("Retry-After"):
+            delay = float(headers["Retry-After"])
+        elif headers.get("X-RateLimit-Remaining") == "0":
+            delay = max(0.0, float(headers.get("X-RateLimit-Reset", now)) - now)
+        elif status == 429 or "rate limit" in body.lower():
+            delay = min(self.max_backoff, self.backoff_base * 2**attempt)
+        else:
+            return None
+
+        # Jitter keeps concurrent workers from retrying in lockstep
+        delay += random.uniform(0, self.backoff_base + delay * 0.1)
+        budget = self.budget(token)
+        budget.blocked_until = max(budget.blocked_until, now + delay)
+        return delay
+
+
+class GitHubTokenPool:
+    """Spreads requests across several GitHub tokens.
+
+    Each request goes to the token with the most remaining budget that the
+    rate limiter will let through right away; if none can, the pool waits for
+    whichever token frees up first. Tokens that GitHub rejects with a 401 are
+    taken out of rotation.
+    """
+
+    def __init__(self, tokens: List[str], rate_limiter: GitHubRateLimiter):
+        # dict.fromkeys drops duplicates but keeps the configured order
+        self._active = list(dict.fromkeys(token for token in tokens if token))
+        if not self._active:
+            raise ValueError("GitHubTokenPool needs at least one token")
+        self.rate_limiter = rate_limiter
+
+    @property
+    def active_tokens(self) -> List[str]:
+        return list(self._active)
+
+    def _headroom(self, token: str, resource: str = "core") -> float:
+        remaining = self.rate_limiter.budget(budget_key(token, resource)).remaining
+        # Tokens we have not used yet are assumed to have a full budget
+        return math.inf if remaining is None else remaining
+
+    async def acquire(self, resource: str = "core") -> str:
+        """Wait for a request slot on ``resource`` and return the token it
+        belongs to."""
+        while True:
+            if not self._active:
+                raise NoTokensAvailable("No usable GitHub tokens left in the pool")
+            wait = math.inf
+            for token in sorted(
+                self._active,
+                key=lambda token: self._headroom(token, resource),
+                reverse=True,
+            ):
+                delay = self.rate_limiter.try_acquire(budget_key(token, resource))
+                if delay <= 0:
+                    return token
+                wait = min(wait, delay)
+            await self.rate_limiter.sleep(wait)
+
+    def disable(self, token: str) -> None:
+        """Take a token GitHub rejected out of rotation."""
+        if token in self._active:
+            self._active.remove(token)
+            logging.warning(
+                f"Removed GitHub token ending in {token[-4:]} from the pool "
+                f"after a 401; {len(self._active)} token(s) left"
+            )
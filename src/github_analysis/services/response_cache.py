@@ -0,0 +1,143 @@
+import hashlib
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import AsyncContextManager, Callable, Optional
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from github_analysis.config import Settings
+from github_analysis.models.models import GitHubResponseCacheEntry
+
+
+@dataclass
+class CachedResponse:
+    """Validators and body of a GitHub response that can be revalidated."""
+
+    body: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    link: Optional[str] = None  # Kept so pagination still works on a 304
+
+
+def response_cache_key(url: str, accept: str) -> str:
+    return hashlib.sha256(f"{accept}\n{url}".encode()).hexdigest()
+
+
+class ResponseCache(ABC):
+    """Storage backend for conditional-request validators, keyed by URL and
+    Accept header.
+
+    ``caches_diffs`` says whether raw PR diffs should be kept; they are the
+    largest responses and rarely fetched twice by one process.
+    """
+
+    caches_diffs = True
+
+    @abstractmethod
+    async def get(self, url: str, accept: str) -> Optional[CachedResponse]: ...
+
+    @abstractmethod
+    async def set(self, url: str, accept: str, response: CachedResponse) -> None: ...
+
+
+class InMemoryResponseCache(ResponseCache):
+    """Process-local LRU cache; validators are lost on restart.
+
+    Bounded by ``max_entries`` and by ``max_bytes`` of cached bodies, so a
+    backfill cannot grow the process without limit. Diffs are not kept.
+    """
+
+    caches_diffs = False
+
+    def __init__(self, max_entries: int = 1000, max_bytes: int = 32_000_000):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: OrderedDict[str, CachedResponse] = OrderedDict()
+
+    async def get(self, url: str, accept: str) -> Optional[CachedResponse]:
+        key = response_cache_key(url, accept)
+        response = self._entries.get(key)
+        if response is not None:
+            self._entries.move_to_end(key)
+        return response
+
+    async def set(self, url: str, accept: str, response: CachedResponse) -> None:
+        key = response_cache_key(url, accept)
+        if key in self._entries:
+            self.size -= len(self._entries.pop(key).body)
+        if len(response.body) > self.max_bytes:
+            return
+        self._entries[key] = response
+        self.size += len(response.body)
+        while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted.body)
+
+
+class DatabaseResponseCache(ResponseCache):
+    """Postgres-backed cache shared by every worker and kept across restarts."""
+
+    def __init__(
+        self, session_factory: Callable[[], AsyncContextManager[AsyncSession]]
+    ):
+        self.session_factory = session_factory
+
+    async def get(self, url: str, accept: str) -> Optional[CachedResponse]:
+        async with self.session_factory() as session:
+            result = await session.execute(
+                select(GitHubResponseCacheEntry).where(
+                    GitHubResponseCacheEntry.key == response_cache_key(url, accept)
+                )
+            )
+            entry = result.scalar_one_or_none()
+            if entry is None:
+                return None
+            return CachedResponse(
+                body=entry.body,
+                etag=entry.etag,
+                last_modified=entry.last_modified,
+                link=entry.link,
+            )
+
+    async def set(self, url: str, accept: str, response: CachedResponse) -> None:
+        values = {
+            "etag": response.etag,
+            "last_modified": response.last_modified,
+            "link": response.link,
+            "body": response.body,
+            "updated_at": datetime.now(timezone.utc),
+        }
+        statement = insert(GitHubResponseCacheEntry).values(
+            key=response_cache_key(url, accept), url=url, **values
+        )
+        async with self.session_factory() as session:
+            await session.execute(
+                statement.on_conflict_do_update(
+                    index_elements=[GitHubResponseCacheEntry.key], set_=values
+                )
+            )
+            await session.commit()
+
+
+def create_response_cache(
+    settings: Settings,
+    session_factory: Callable[[], AsyncContextManager[AsyncSession]],
+) -> Optional[ResponseCache]:
+    """Build the response cache selected by ``GITHUB_RESPONSE_CACHE``."""
+    if settings.GITHUB_RESPONSE_CACHE == "memory":
+        return InMemoryResponseCache(
+            settings.GITHUB_RESPONSE_CACHE_SIZE,
+            settings.GITHUB_RESPONSE_CACHE_MAX_BYTES,
+        )
+    elif settings.GITHUB_RESPONSE_CACHE == "database":
+        return DatabaseResponseCache(session_factory)
+    elif settings.GITHUB_RESPONSE_CACHE == "none":
+        return None
+    raise ValueError(
+        f"Unknown GITHUB_RESPONSE_CACHE backend: {settings.GITHUB_RESPONSE_CACHE}"
+    )
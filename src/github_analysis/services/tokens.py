@@ -0,0 +1,18 @@
+"""Token estimates for sizing LLM and embedding requests.
+
+Estimates err on the high side (code averages well over 3 bytes per token),
+so anything sized with them stays within the real limits without a
+tokenizer dependency.
+"""
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text.encode("utf-8")) // 3 + 1
+
+
+def trim_text(text: str, max_tokens: int) -> str:
+    """Cut ``text`` to about ``max_tokens`` estimated tokens, marking the cut."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    cut = text.encode("utf-8")[: max(0, max_tokens - 8) * 3]
+    return cut.decode("utf-8", "ignore") + "\n[... truncated]"
@@ -0,0 +1,154 @@
+"""Benchmark loading a PR's analysis context.
+
+This script:
+1. Stores a synthetic PR with many hunks and comments through the bulk writer
+2. Loads its context with the old chained joinedload query and with
+   load_pr_context
+3. Prints the rows each approach's queries return, counted as they are
+   fetched, and the median latency
+4. Deletes the synthetic PR again
+
+Usage: python test_data/benchmark_pr_context.py [--files 30 --hunks 10 ...]
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import joinedload, sessionmaker
+
+from github_analysis.config import settings
+from github_analysis.models.models import ChangeType, PRDiff, PullRequest
+from github_analysis.services.pr_context import load_pr_context
+from github_analysis.services.pr_writer import PRWriter
+
+OWNER, REPO, NUMBER, GITHUB_ID = "benchmark", "synthetic", 1, -1
+
+
+def synthetic_pr(files: int, hunks: int, comments: int) -> dict:
+    return {
+        "owner": OWNER,
+        "repo": REPO,
+        "pr_data": {
+            "id": GITHUB_ID,
+            "number": NUMBER,
+            "title": "Synthetic PR",
+            "body": "",
+            "created_at": "2024-01-01T00:00:00Z",
+            "updated_at": "2024-01-01T00:00:00Z",
+        },
+        "comments": [
+            {"id": -(n + 1), "body": f"Comment {n}", "user": {"login": "bench"}}
+            for n in range(comments)
+        ],
+        "diffs": [
+            {
+                "file_path": f"src/module_{f}.py",
+                "change_type": ChangeType.MODIFY,
+                "hunks": [
+                    {
+                        "old_start": h * 10 + 1,
+                        "old_lines": 3,
+                        "new_start": h * 10 + 1,
+                        "new_lines": 4,
+                        "content": f" context\n-old line {f}.{h}\n+new line {f}.{h}",
+                    }
+                    for h in range(hunks)
+                ],
+            }
+            for f in range(files)
+        ],
+    }
+
+
+async def load_with_joinedload(session: AsyncSession) -> dict:
+    """The previous get_pr_context query."""
+    result = await session.execute(
+        select(PullRequest)
+        .where(PullRequest.number == NUMBER, PullRequest.repo_owner == OWNER)
+        .options(
+            joinedload(PullRequest.diffs).joinedload(PRDiff.hunks),
+            joinedload(PullRequest.comments),
+        )
+    )
+    pr = result.unique().scalar_one()
+    return {
+        "changes": [[hunk.content for hunk in diff.hunks] for diff in pr.diffs],
+        "discussion": [comment.body for comment in pr.comments],
+    }
+
+
+async def load_with_load_pr_context(session: AsyncSession) -> dict:
+    return await load_pr_context(session, NUMBER, OWNER, REPO)
+
+
+class RowCountingSession:
+    """Passes queries on to a session, counting the rows they return before
+    any de-duplication."""
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+        self.rows = 0
+
+    async def execute(self, statement, *args, **kwargs):
+        frozen = (await self.session.execute(statement, *args, **kwargs)).freeze()
+        self.rows += len(frozen.data)
+        return frozen()
+
+
+async def count_rows(session_factory, load) -> int:
+    async with session_factory() as session:
+        counter = RowCountingSession(session)
+        await load(counter)
+        return counter.rows
+
+
+async def median_ms(session_factory, load, runs: int) -> float:
+    timings = []
+    for _ in range(runs):
+        # A fresh session each run, so nothing comes from the identity map
+        async with session_factory() as session:
+            start = time.perf_counter()
+            await load(session)
+            timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+async def benchmark(files: int, hunks: int, comments: int, runs: int):
+    engine = create_async_engine(settings.database_url)
+    session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+    async with session_factory() as session:
+        result = await PRWriter(session).write([synthetic_pr(files, hunks, comments)])
+        print(f"Stored synthetic PR: {result[0]['status']}")
+
+    try:
+        before_rows = await count_rows(session_factory, load_with_joinedload)
+        after_rows = await count_rows(session_factory, load_with_load_pr_context)
+        before_ms = await median_ms(session_factory, load_with_joinedload, runs)
+        after_ms = await median_ms(session_factory, load_with_load_pr_context, runs)
+    finally:
+        async with session_factory() as session:
+            await session.execute(
+                delete(PullRequest).where(PullRequest.github_id == GITHUB_ID)
+            )
+            await session.commit()
+        await engine.dispose()
+
+    print(f"\nPR with {files} files x {hunks} hunks and {comments} comments")
+    print(f"{'loader':<16}{'rows':>10}{'median ms':>12}")
+    print(f"{'joinedload':<16}{before_rows:>10}{before_ms:>12.1f}")
+    print(f"{'load_pr_context':<16}{after_rows:>10}{after_ms:>12.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=30)
+    parser.add_argument("--hunks", type=int, default=10, help="Hunks per file")
+    parser.add_argument("--comments", type=int, default=80)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(benchmark(args.files, args.hunks, args.comments, args.runs))
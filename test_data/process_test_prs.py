@@ -15,6 +15,7 @@ from datetime import datetime
 from typing import Dict
 
 from sqlalchemy import select, text
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from qdrant_client import QdrantClient
@@ -26,12 +27,12 @@ from github_analysis.models.models import (
     PRComment,
     PRDiff,
     DiffHunk,
+    HunkContent,
     ChangeType,
 )
+from github_analysis.services.content_hash import hunk_content_hash
 from github_analysis.services.embedding import EmbeddingType
-
-# Vector size for text-embedding-3-small model
-VECTOR_SIZE = 1536
+from github_analysis.services.embedding_providers import create_embedding_provider
 
 
 async def load_test_pr(file_path: str) -> Dict:
@@ -81,14 +82,20 @@ async def store_test_pr(session: AsyncSession, pr_data: Dict) -> PullRequest:
         session.add(pr_diff)
         await session.flush()
 
-        # Store hunks
+        # Store hunks, with their text stored once per distinct content
         for hunk in diff["hunks"]:
+            content_hash = hunk_content_hash(hunk["content"])
+            await session.execute(
+                insert(HunkContent)
+                .values(hash=content_hash, content=hunk["content"])
+                .on_conflict_do_nothing()
+            )
             diff_hunk = DiffHunk(
                 old_start=hunk["old_start"],
                 old_lines=hunk["old_lines"],
                 new_start=hunk["new_start"],
                 new_lines=hunk["new_lines"],
-                content=hunk["content"],
+                content_hash=content_hash,
                 diff_id=pr_diff.id,
             )
             session.add(diff_hunk)
@@ -97,7 +104,9 @@ async def store_test_pr(session: AsyncSession, pr_data: Dict) -> PullRequest:
     return pr
 
 
-async def clear_data(session: AsyncSession, qdrant_client: QdrantClient):
+async def clear_data(
+    session: AsyncSession, qdrant_client: QdrantClient, vector_size: int
+):
     """Clear existing data from database and Qdrant."""
     print("\nClearing existing data...")
 
@@ -115,7 +124,7 @@ async def clear_data(session: AsyncSession, qdrant_client: QdrantClient):
     qdrant_client.create_collection(
         collection_name=settings.QDRANT_COLLECTION_NAME,
         vectors_config=models.VectorParams(
-            size=VECTOR_SIZE,
+            size=vector_size,
             distance=models.Distance.COSINE,
         ),
     )
@@ -134,10 +143,13 @@ async def process_test_prs(fresh: bool = False):
     async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
     qdrant_client = QdrantClient(settings.QDRANT_HOST, port=settings.QDRANT_PORT)
 
+    # EMBEDDING_PROVIDER=hashing and LLM_PROVIDER=fake run the script offline
+    embedding_provider = create_embedding_provider(settings)
+
     async with async_session() as session:
         # Clear existing data if requested
         if fresh:
-            await clear_data(session, qdrant_client)
+            await clear_data(session, qdrant_client, embedding_provider.dimensions)
 
         # Process each test PR
         print("\nProcessing test PRs...")
@@ -154,12 +166,28 @@ async def process_test_prs(fresh: bool = False):
         print("\nStoring embeddings for both approaches...")
         from github_analysis.services.analysis_service import AnalysisService
         from github_analysis.services.ai_service import AIService
+        from github_analysis.services.analysis_cache import create_analysis_cache
         from github_analysis.services.embedding import EmbeddingService
+        from github_analysis.services.embedding_cache import create_embedding_cache
+        from github_analysis.services.llm_providers import create_llm_provider
 
-        ai_service = AIService(api_key=settings.OPENAI_API_KEY)
-        embedding_service = EmbeddingService(api_key=settings.OPENAI_API_KEY)
+        ai_service = AIService(
+            api_key=settings.OPENAI_API_KEY,
+            cache=create_analysis_cache(settings, async_session),
+            provider=create_llm_provider(settings),
+        )
+        # Reruns only pay for embeddings of text that changed
+        embedding_service = EmbeddingService(
+            api_key=settings.OPENAI_API_KEY,
+            cache=create_embedding_cache(settings, async_session),
+            provider=embedding_provider,
+        )
         analysis_service = AnalysisService(
-            session, qdrant_client, ai_service, embedding_service
+            session,
+            qdrant_client,
+            ai_service,
+            embedding_service,
+            collection_name=settings.QDRANT_COLLECTION_NAME,
         )
 
         for pr_file in test_pr_files:
@@ -179,6 +207,15 @@ async def process_test_prs(fresh: bool = False):
                     )
                     continue
 
+        print(
+            f"\nEmbedding cache: {embedding_service.cache_hits} hits, "
+            f"{embedding_service.cache_misses} misses"
+        )
+        print(
+            f"Analysis cache: {ai_service.cache_hits} hits, "
+            f"{ai_service.cache_misses} misses"
+        )
+
         # Now compare similarities with both approaches
         print("\nComparing similarities...")
         for embedding_type in [EmbeddingType.AI_SUMMARY, EmbeddingType.RAW_DIFF]:
@@ -193,8 +230,9 @@ async def process_test_prs(fresh: bool = False):
                 # Get PR's embedding from Qdrant
                 try:
                     print(f"\nTrying to get embedding for PR #{pr_number}")
-                    # Use even numbers for AI_SUMMARY, odd for RAW_DIFF
-                    point_id = pr_number * 2 + (
+                    # Points are keyed by database ID: even numbers for
+                    # AI_SUMMARY, odd for RAW_DIFF
+                    point_id = pr_id * 2 + (
                         0 if embedding_type == EmbeddingType.AI_SUMMARY else 1
                     )
                     points = qdrant_client.retrieve(
@@ -249,8 +287,8 @@ async def process_test_prs(fresh: bool = False):
                             ],
                             must_not=[
                                 models.FieldCondition(
-                                    key="context.id",
-                                    match=models.MatchValue(value=pr_number),
+                                    key="pr_db_id",
+                                    match=models.MatchValue(value=pr_id),
                                 ),
                             ],
                         ),
@@ -0,0 +1,41 @@
+import os
+
+import pytest
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from github_analysis.db.config import DatabaseSessionManager
+from github_analysis.models.base import Base
+
+
+@pytest.fixture
+async def session_factory():
+    """Sessions on a fresh schema in the Postgres database at
+    ``TEST_DATABASE_URL`` (a ``postgresql+asyncpg://`` URL); every table in
+    it is dropped. Tests using it are skipped when the variable is unset."""
+    url = os.environ.get("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    engine = create_async_engine(url, poolclass=NullPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    yield async_sessionmaker(engine, expire_on_commit=False)
+    await engine.dispose()
+
+
+@pytest.fixture
+async def db(session_factory):
+    async with session_factory() as session:
+        yield session
+
+
+@pytest.fixture
+async def session_manager(session_factory):
+    """Sessions on the test database, configured like the app's own
+    ``sessionmanager``."""
+    manager = DatabaseSessionManager(
+        os.environ["TEST_DATABASE_URL"], {"poolclass": NullPool}
+    )
+    yield manager
+    await manager.close()
@@ -0,0 +1,116 @@
+import json
+import re
+from types import SimpleNamespace
+
+from github_analysis.services.ai_service import AIService
+from github_analysis.services.analysis_cache import InMemoryAnalysisCache
+
+PR_CONTEXT = {
+    "id": 1,
+    "title": "Add retries",
+    "description": "Retry failed requests",
+    "changes": [
+        {"file": "client.py", "change_type": "modify", "changes": ["+retry()"]}
+    ],
+    "discussion": [{"author": "alice", "comment": "Looks good"}],
+}
+
+
+class FakeCompletions:
+    def __init__(self):
+        self.requests = []
+
+    async def create(self, **request):
+        self.requests.append(request)
+        prompt = request["messages"][-1]["content"]
+        if prompt.startswith("Summarize"):
+            files = re.findall(r"^File: (\S+) ", prompt, re.MULTILINE)
+            content = json.dumps({path: f"Summary of {path}" for path in files})
+        else:
+            content = json.dumps({"summary": f"Analysis {len(self.requests)}"})
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))]
+        )
+
+
+def make_service(**kwargs):
+    service = AIService("test-key", cache=InMemoryAnalysisCache(), **kwargs)
+    service.provider.client = SimpleNamespace(
+        chat=SimpleNamespace(completions=FakeCompletions())
+    )
+    return service
+
+
+async def test_unchanged_pr_reuses_cached_analysis():
+    service = make_service()
+
+    first = await service.analyze_pr(PR_CONTEXT)
+    second = await service.analyze_pr(dict(PR_CONTEXT))
+
+    assert first == second == {"summary": "Analysis 1"}
+    assert len(service.provider.client.chat.completions.requests) == 1
+    assert (service.cache_hits, service.cache_misses) == (1, 1)
+
+
+async def test_changed_inputs_miss_the_cache():
+    service = make_service()
+    await service.analyze_pr(PR_CONTEXT)
+
+    await service.analyze_pr({**PR_CONTEXT, "discussion": []})
+    await service.analyze_pr(
+        {
+            **PR_CONTEXT,
+            "changes": [
+                {"file": "client.py", "change_type": "modify", "changes": ["+x"]}
+            ],
+        }
+    )
+    service.temperature = 0.5
+    await service.analyze_pr(PR_CONTEXT)
+
+    assert len(service.provider.client.chat.completions.requests) == 4
+    assert service.cache_hits == 0
+
+
+def large_pr(files, hunk_size):
+    return {
+        **PR_CONTEXT,
+        "changes": [
+            {
+                "file": f"src/module_{n}.py",
+                "change_type": "modify",
+                "changes": [f"-old {n}\n+" + "x" * hunk_size] * 5,
+            }
+            for n in range(files)
+        ],
+    }
+
+
+async def test_large_pr_is_trimmed_to_budget():
+    service = make_service(prompt_token_budget=2000, map_reduce_threshold=10_000)
+
+    await service.analyze_pr(large_pr(files=10, hunk_size=300))
+
+    (request,) = service.provider.client.chat.completions.requests
+    prompt = request["messages"][-1]["content"]
+    assert len(prompt.encode()) // 3 <= 2000
+    assert "src/module_9.py" in prompt
+    assert "more hunks omitted" in prompt
+
+
+async def test_very_large_pr_is_summarized_per_file_first():
+    service = make_service(
+        prompt_token_budget=2000,
+        map_reduce_threshold=5000,
+        map_concurrency=2,
+        max_map_chunks=4,
+    )
+
+    await service.analyze_pr(large_pr(files=40, hunk_size=300))
+
+    *map_requests, final = service.provider.client.chat.completions.requests
+    assert 1 < len(map_requests) <= 4
+    prompt = final["messages"][-1]["content"]
+    assert "Changes (summarized per file):" in prompt
+    assert "Summary of src/module_0.py" in prompt
+    assert len(prompt.encode()) // 3 <= 2000
@@ -0,0 +1,402 @@
+import asyncio
+import zlib
+from types import SimpleNamespace
+
+import pytest
+from qdrant_client import QdrantClient
+
+from github_analysis.services import analysis_service
+from github_analysis.services.analysis_service import (
+    AnalysisService,
+    aggregate_chunk_scores,
+)
+from github_analysis.services.embedding import EmbeddingService, EmbeddingType
+from github_analysis.services.embedding_providers import HashingEmbeddingProvider
+
+
+class FakeQdrant:
+    def __init__(self):
+        self.upserts = []
+
+    def get_collection(self, name):
+        vectors = SimpleNamespace(size=1536)
+        return SimpleNamespace(
+            config=SimpleNamespace(params=SimpleNamespace(vectors=vectors))
+        )
+
+    def upsert(self, collection_name, points):
+        self.upserts.append(points)
+
+    def delete(self, collection_name, points_selector):
+        pass
+
+
+class FakeAI:
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def analyze_pr(self, pr_context):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+            if pr_context["id"] in self.fail:
+                raise RuntimeError("LLM unavailable")
+            return {
+                "summary": f"Summary {pr_context['id']}",
+                "impact_details": "",
+                "key_points": [],
+            }
+        finally:
+            self.in_flight -= 1
+
+
+class FakeEmbeddings(EmbeddingService):
+    def __init__(self, **kwargs):
+        super().__init__("test-key", **kwargs)
+        self.calls = []
+
+    async def create_embeddings_batch(self, texts):
+        self.calls.append(len(texts))
+        return [[float(len(text))] for text in texts]
+
+
+class FakeSession:
+    def __init__(self):
+        self.added = []
+        self.commits = 0
+
+    def add(self, row):
+        self.added.append(row)
+
+    def add_all(self, rows):
+        self.added.extend(rows)
+
+    async def commit(self):
+        self.commits += 1
+
+    async def rollback(self):
+        pass
+
+
+class BatchAnalysisService(AnalysisService):
+    async def _select_prs(self, pr_ids, owner, repo, results):
+        # PR number n is stored with database id 100 + n
+        return [100 + number for number in pr_ids]
+
+
+def make_service(monkeypatch, ai, **kwargs):
+    async def load_pr_contexts(db, db_ids):
+        return {
+            db_id: {
+                "id": db_id - 100,
+                "repo": "octo/app",
+                "title": f"PR {db_id - 100}",
+                "description": "",
+                "changes": [{"file": "app.py", "change_type": "modify", "changes": []}],
+                "discussion": [],
+            }
+            for db_id in db_ids
+        }
+
+    monkeypatch.setattr(analysis_service, "load_pr_contexts", load_pr_contexts)
+    return BatchAnalysisService(
+        FakeSession(), FakeQdrant(), ai, FakeEmbeddings(), **kwargs
+    )
+
+
+async def test_process_prs_stores_in_batches(monkeypatch):
+    ai = FakeAI(fail={3})
+    service = make_service(monkeypatch, ai, llm_concurrency=3, batch_size=4)
+
+    results = await service.process_prs(list(range(1, 11)))
+
+    assert sorted(results["processed"]) == list(range(1, 11))
+    assert results["errors"] == []
+    assert ai.max_in_flight == 3
+    assert sum(service.embedding_service.calls) == 10
+    assert all(calls <= 4 for calls in service.embedding_service.calls)
+    assert len(service.qdrant.upserts) == service.db.commits
+    assert len(service.embedding_service.calls) == service.db.commits
+
+    by_pr = {analysis.pr_id: analysis for analysis in service.db.added}
+    assert sorted(by_pr) == list(range(101, 111))
+    assert by_pr[101].summary == "Summary 1"
+    # A failed LLM call falls back to embedding the raw diff
+    assert by_pr[103].summary is None
+    assert by_pr[103].analysis_metadata["raw_diff"]
+
+    points = [point for points in service.qdrant.upserts for point in points]
+    assert {point.id for point in points if isinstance(point.id, int)} == {
+        service._point_id(100 + n, EmbeddingType.AI_SUMMARY) for n in range(1, 11)
+    }
+    # The raw diff fallback also stores its chunk
+    (chunk,) = [point for point in points if isinstance(point.id, str)]
+    assert chunk.payload["pr_number"] == 3
+    assert chunk.payload["pr_db_id"] == 103
+
+
+async def test_process_prs_reports_failed_batches(monkeypatch):
+    service = make_service(monkeypatch, FakeAI(), batch_size=2)
+
+    async def failing_commit():
+        raise RuntimeError("database down")
+
+    service.db.commit = failing_commit
+    results = await service.process_prs([1, 2])
+
+    assert results["processed"] == []
+    assert sorted(error["pr_id"] for error in results["errors"]) == [1, 2]
+    assert "database down" in results["errors"][0]["detail"]
+
+
+async def test_process_prs_analysis_waits_for_the_writer(monkeypatch):
+    service = make_service(monkeypatch, FakeAI(), llm_concurrency=2, batch_size=2)
+    analyzed = 0
+    stored = 0
+    max_ahead = 0
+    prepare = service._prepare_analysis
+    store = service._store_analyses
+
+    async def counting_prepare(*args):
+        nonlocal analyzed, max_ahead
+        prepared = await prepare(*args)
+        analyzed += 1
+        max_ahead = max(max_ahead, analyzed - stored)
+        return prepared
+
+    async def slow_store(batch, *args):
+        nonlocal stored
+        await asyncio.sleep(0.05)
+        await store(batch, *args)
+        stored += len(batch)
+
+    service._prepare_analysis = counting_prepare
+    service._store_analyses = slow_store
+    results = await service.process_prs(list(range(1, 31)))
+
+    assert len(results["processed"]) == 30
+    # Queued, being written, and waiting to be queued: 4 + 2 + 2
+    assert max_ahead <= 8
+
+
+async def test_process_prs_cancels_analyses_when_loading_fails(monkeypatch):
+    ai = FakeAI()
+    service = make_service(monkeypatch, ai, llm_concurrency=2, batch_size=2)
+    load = analysis_service.load_pr_contexts
+    loads = 0
+
+    async def failing_load(db, db_ids):
+        nonlocal loads
+        loads += 1
+        if loads == 2:
+            raise RuntimeError("database down")
+        return await load(db, db_ids)
+
+    monkeypatch.setattr(analysis_service, "load_pr_contexts", failing_load)
+    with pytest.raises(RuntimeError, match="database down"):
+        await service.process_prs([1, 2, 3, 4])
+
+    # The first batch's analyses were cancelled, not left running
+    assert ai.max_in_flight == 2
+    assert ai.in_flight == 0
+    await asyncio.sleep(0.02)
+    assert service.qdrant.upserts == []
+
+
+class BagOfWordsEmbeddings(EmbeddingService):
+    """Deterministic stand-in: one dimension per (hashed) word."""
+
+    def __init__(self, **kwargs):
+        super().__init__("test-key", **kwargs)
+
+    async def create_embeddings_batch(self, texts):
+        vectors = []
+        for text in texts:
+            vector = [0.0] * 1536
+            for word in text.split():
+                vector[zlib.crc32(word.encode()) % 1536] += 1.0
+            vectors.append(vector)
+        return vectors
+
+
+class ContextAnalysisService(AnalysisService):
+    def __init__(self, contexts, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.contexts = contexts  # Keyed by database id
+
+    async def get_pr_db_id(self, pr_id, owner=None, repo=None):
+        (db_id,) = [
+            db_id
+            for db_id, context in self.contexts.items()
+            if context["id"] == pr_id
+            and (owner is None or context["repo"] == f"{owner}/{repo}")
+        ]
+        return db_id
+
+    async def get_pr_context(self, pr_id, owner=None, repo=None):
+        db_id = await self.get_pr_db_id(pr_id, owner, repo)
+        return self.contexts[db_id], db_id
+
+
+def words(*names):
+    return ["\n".join(f"+{name}_{n} = {name}()" for n in range(20)) for name in names]
+
+
+def pr(number, *files, repo="octo/app"):
+    return {
+        "id": number,
+        "repo": repo,
+        "title": f"PR {number}",
+        "description": "",
+        "changes": [
+            {"file": f"{name}.py", "change_type": "modify", "changes": words(name)}
+            for name in files
+        ],
+        "discussion": [],
+    }
+
+
+async def test_raw_diff_is_stored_and_searched_in_chunks():
+    contexts = {
+        101: pr(1, "alpha", "beta"),
+        102: pr(2, "alpha"),
+        103: pr(3, "gamma"),
+    }
+    qdrant = QdrantClient(":memory:")
+    service = ContextAnalysisService(
+        contexts, FakeSession(), qdrant, FakeAI(), BagOfWordsEmbeddings()
+    )
+    for context in contexts.values():
+        await service.process_pr(context["id"], EmbeddingType.RAW_DIFF)
+
+    # One point per PR plus one per changed file
+    assert qdrant.count("github_changes").count == 3 + 4
+
+    similar = await service.find_similar_prs(1, EmbeddingType.RAW_DIFF)
+    assert [match["pr_id"] for match in similar][0] == 2
+    assert similar[0]["matched_chunks"] >= 1
+    assert similar[0]["score"] > similar[-1]["score"]
+
+    # Re-analysis replaces the chunks of a PR whose diff shrank
+    contexts[101] = pr(1, "beta")
+    await service.process_pr(1, EmbeddingType.RAW_DIFF)
+    assert qdrant.count("github_changes").count == 3 + 3
+
+
+async def test_reanalysis_without_chunks_drops_the_old_chunks():
+    contexts = {101: pr(1, "alpha", "beta"), 102: pr(2, "alpha")}
+    qdrant = QdrantClient(":memory:")
+    service = ContextAnalysisService(
+        contexts, FakeSession(), qdrant, FakeAI(), BagOfWordsEmbeddings()
+    )
+    for context in contexts.values():
+        await service.process_pr(context["id"], EmbeddingType.RAW_DIFF)
+    assert qdrant.count("github_changes").count == 2 + 3
+
+    # The diff is gone; the PR falls back to a single title vector
+    contexts[101] = pr(1)
+    await service.process_pr(1, EmbeddingType.RAW_DIFF)
+    assert qdrant.count("github_changes").count == 2 + 1
+
+    # The batch path drops them too
+    contexts[102] = pr(2)
+    results = {"processed": [], "errors": []}
+    prepared = await service._prepare_analysis(contexts[102], EmbeddingType.RAW_DIFF)
+    await service._store_analyses(
+        [(102, contexts[102], prepared)],
+        EmbeddingType.RAW_DIFF,
+        results,
+        asyncio.Lock(),
+    )
+    assert results["processed"] == [2]
+    assert qdrant.count("github_changes").count == 2
+
+
+async def test_prs_with_the_same_number_in_two_repositories_are_kept_apart():
+    contexts = {
+        101: pr(1, "alpha", "beta", repo="octo/app"),
+        201: pr(1, "alpha", repo="octo/lib"),
+        202: pr(2, "gamma", repo="octo/lib"),
+    }
+    qdrant = QdrantClient(":memory:")
+    service = ContextAnalysisService(
+        contexts, FakeSession(), qdrant, FakeAI(), BagOfWordsEmbeddings()
+    )
+    for context in contexts.values():
+        owner, repo = context["repo"].split("/")
+        await service.process_pr(context["id"], EmbeddingType.RAW_DIFF, owner, repo)
+
+    assert qdrant.count("github_changes").count == 3 + 4
+
+    similar = await service.find_similar_prs(
+        1, EmbeddingType.RAW_DIFF, owner="octo", repo="app"
+    )
+    assert (similar[0]["pr_id"], similar[0]["repo"]) == (1, "octo/lib")
+
+    # Re-analyzing one repository's PR 1 leaves the other's chunks alone
+    contexts[101] = pr(1, "beta", repo="octo/app")
+    await service.process_pr(1, EmbeddingType.RAW_DIFF, "octo", "app")
+    assert qdrant.count("github_changes").count == 3 + 3
+    similar = await service.find_similar_prs(
+        1, EmbeddingType.RAW_DIFF, owner="octo", repo="lib"
+    )
+    assert {match["repo"] for match in similar} == {"octo/app", "octo/lib"}
+
+
+async def test_collection_is_sized_by_the_embedding_provider():
+    qdrant = QdrantClient(":memory:")
+    contexts = {101: pr(1, "alpha"), 102: pr(2, "alpha", "beta")}
+    embeddings = EmbeddingService(
+        "test-key", provider=HashingEmbeddingProvider(dimensions=64)
+    )
+    service = ContextAnalysisService(
+        contexts, FakeSession(), qdrant, FakeAI(), embeddings, collection_name="local"
+    )
+    for context in contexts.values():
+        await service.process_pr(context["id"], EmbeddingType.RAW_DIFF)
+
+    assert qdrant.get_collection("local").config.params.vectors.size == 64
+    similar = await service.find_similar_prs(1, EmbeddingType.RAW_DIFF)
+    assert [match["pr_id"] for match in similar] == [2]
+
+    # Vectors of another size must not be mixed into the collection
+    other = EmbeddingService(
+        "test-key", provider=HashingEmbeddingProvider(dimensions=128)
+    )
+    with pytest.raises(ValueError, match="64-dimensional"):
+        AnalysisService(FakeSession(), qdrant, FakeAI(), other, collection_name="local")
+
+
+def test_large_files_are_split_into_bounded_chunks():
+    service = BagOfWordsEmbeddings(chunk_tokens=200, max_chunks=5)
+    changes = [
+        {"file": "big.py", "change_type": "modify", "changes": ["+" + "x" * 1000]},
+        {"file": "small.py", "change_type": "add", "changes": ["+a", "+b"]},
+        {
+            "file": "many.py",
+            "change_type": "modify",
+            "changes": ["+" + "y" * 300] * 6,
+        },
+    ]
+
+    chunks = service.prepare_chunks_for_embedding(changes)
+
+    assert len(chunks) == 5
+    assert [file for file, _ in chunks[:3]] == ["big.py", "small.py", "many.py"]
+    assert all(len(text.encode()) // 3 <= 210 for _, text in chunks)
+    assert all(text.startswith("File: ") for _, text in chunks)
+
+
+def test_aggregate_chunk_scores_rewards_broad_matches():
+    ranked = aggregate_chunk_scores(
+        [
+            [(2, 0.9), (3, 0.95), (2, 0.5)],
+            [(2, 0.8)],
+        ]
+    )
+    assert ranked[0][0] == 2
+    assert ranked[0] == (2, (0.9 + 0.8) / 2, 2)
+    assert ranked[1] == (3, 0.95 / 2, 1)
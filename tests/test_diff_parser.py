@@ -0,0 +1,145 @@
+from github_analysis.models.models import ChangeType
+from github_analysis.services.content_hash import diff_content_hash, hunk_content_hash
+from github_analysis.services.diff_parser import (
+    DiffParser,
+    aiter_file_diffs,
+    aiter_lines,
+    parse_diff,
+)
+
+DIFF = """\
+diff --git a/src/app.py b/src/app.py
+index 83db48f..bf269f4 100644
+--- a/src/app.py
++++ b/src/app.py
+@@ -1,3 +1,4 @@ def main():
+ import os
++import sys
+
+ print("rename this and add a new file")
+@@ -10 +11 @@
+-old
++new
+diff --git a/docs/new file.md b/docs/new file.md
+new file mode 100644
+index 0000000..e69de29
+--- /dev/null
++++ b/docs/new file.md
+@@ -0,0 +1,2 @@
++# Title
++deleted file mode is just text here
+diff --git a/legacy.py b/legacy.py
+deleted file mode 100644
+index e69de29..0000000
+--- a/legacy.py
++++ /dev/null
+@@ -1 +0,0 @@
+-x = 1
+diff --git a/old/name.py b/new/name.py
+similarity index 100%
+rename from old/name.py
+rename to new/name.py
+"""
+
+
+def test_parses_files_and_hunks():
+    modified, added, deleted, renamed = parse_diff(DIFF)
+
+    assert modified["file_path"] == "src/app.py"
+    assert modified["change_type"] == ChangeType.MODIFY
+    assert [
+        (h["old_start"], h["old_lines"], h["new_start"], h["new_lines"])
+        for h in modified["hunks"]
+    ] == [(1, 3, 1, 4), (10, 1, 11, 1)]
+    assert modified["hunks"][0]["content"].startswith("def main():\n import os")
+    assert modified["hunks"][1]["content"] == "-old\n+new"
+
+    assert added["file_path"] == "docs/new file.md"
+    assert added["change_type"] == ChangeType.ADD
+
+    assert deleted["file_path"] == "legacy.py"
+    assert deleted["change_type"] == ChangeType.DELETE
+    assert deleted["hunks"][0]["old_lines"] == 1
+
+    assert renamed["file_path"] == "new/name.py"
+    assert renamed["old_file_path"] == "old/name.py"
+    assert renamed["change_type"] == ChangeType.RENAME
+    assert renamed["hunks"] == []
+
+
+def test_change_type_ignores_hunk_bodies():
+    diff = (
+        "diff --git a/notes.txt b/notes.txt\n"
+        "--- a/notes.txt\n"
+        "+++ b/notes.txt\n"
+        "@@ -1 +1 @@\n"
+        "-rename from nowhere\n"
+        "+new file mode\n"
+    )
+    (file,) = parse_diff(diff)
+    assert file["change_type"] == ChangeType.MODIFY
+    assert file["old_file_path"] is None
+
+
+def test_truncates_files_over_size_cap():
+    modified, added, *_ = parse_diff(DIFF, DiffParser(max_file_size=50))
+
+    assert modified["truncated"]
+    assert len(modified["hunks"]) == 1
+    assert len(modified["hunks"][0]["content"]) < 60
+    assert not added["truncated"]
+
+
+def test_diff_content_hash_tracks_content():
+    assert diff_content_hash(parse_diff(DIFF)) == diff_content_hash(parse_diff(DIFF))
+    assert diff_content_hash(parse_diff(DIFF)) != diff_content_hash(
+        parse_diff(DIFF.replace("+new", "+newer"))
+    )
+
+
+def test_hunk_content_hash_is_sha256_of_text():
+    # Must match the SQL the hunk_contents migration backfilled with
+    assert hunk_content_hash("-old\n+new") == (
+        "e1d0f2ef7e130baf968753732d1f6c474c873141cecc155265878ef62e5d647b"
+    )
+
+
+async def test_parses_byte_stream_split_mid_character():
+    async def chunks(data: bytes, size: int):
+        for start in range(0, len(data), size):
+            yield data[start : start + size]
+
+    diff = DIFF.replace("print(", "print('café', ")
+    streamed = [file async for file in aiter_file_diffs(chunks(diff.encode(), 7))]
+
+    assert streamed == parse_diff(diff)
+    assert "café" in streamed[0]["hunks"][0]["content"]
+
+
+async def test_splits_byte_stream_into_lines():
+    async def chunks(*parts):
+        for part in parts:
+            yield part
+
+    lines = [
+        line async for line in aiter_lines(chunks(b"a", b"b", b"c\nd", b"\n\ne", b"f"))
+    ]
+
+    assert lines == ["abc", "d", "", "ef"]
+
+
+async def test_diff_of_exactly_max_size_is_not_truncated():
+    async def chunks(data: bytes):
+        yield data
+
+    for diff in (DIFF, DIFF.rstrip("\n")):
+        size = len(diff.encode())
+        for max_size, truncated in ((size, False), (size - 1, True)):
+            parser = DiffParser(max_size=max_size)
+            parse_diff(diff, parser)
+            assert parser.truncated is truncated
+
+            parser = DiffParser(max_size=max_size)
+            async for _ in aiter_file_diffs(chunks(diff.encode()), parser):
+                pass
+            assert parser.truncated is truncated
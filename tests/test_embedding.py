@@ -0,0 +1,124 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from github_analysis.services.embedding import EmbeddingService, pack_batches
+from github_analysis.services.embedding_cache import (
+    InMemoryEmbeddingCache,
+    TieredEmbeddingCache,
+)
+
+
+class FakeEmbeddingsAPI:
+    def __init__(self):
+        self.requests = []
+        self.error = None
+
+    async def create(self, model, input):
+        self.requests.append(list(input))
+        if self.error:
+            raise self.error
+        await asyncio.sleep(0)
+        data = [
+            SimpleNamespace(index=index, embedding=[float(len(text))])
+            for index, text in enumerate(input)
+        ]
+        # The API does not promise to answer in input order
+        return SimpleNamespace(data=data[::-1])
+
+
+def make_service(**kwargs):
+    service = EmbeddingService("test-key", **kwargs)
+    service.provider.client = SimpleNamespace(embeddings=FakeEmbeddingsAPI())
+    return service
+
+
+def test_pack_batches_respects_both_budgets():
+    texts = ["a" * 30, "b" * 30, "c" * 300, "d", "e", "f"]
+    # 11 estimated tokens for the short texts, 101 for the long one
+    assert pack_batches(texts, max_inputs=2, max_tokens=50) == [
+        [0, 1],
+        [2],
+        [3, 4],
+        [5],
+    ]
+
+
+async def test_batch_keeps_input_order():
+    service = make_service(max_batch_inputs=3)
+    texts = ["x" * n for n in range(1, 8)]
+
+    embeddings = await service.create_embeddings_batch(texts)
+
+    assert embeddings == [[float(n)] for n in range(1, 8)]
+    assert [
+        len(request) for request in service.provider.client.embeddings.requests
+    ] == [
+        3,
+        3,
+        1,
+    ]
+
+
+async def test_concurrent_calls_share_a_request():
+    service = make_service()
+
+    embeddings = await asyncio.gather(
+        *(service.create_embedding("y" * n) for n in range(1, 21))
+    )
+
+    assert embeddings == [[float(n)] for n in range(1, 21)]
+    assert len(service.provider.client.embeddings.requests) == 1
+
+
+async def test_shared_request_failure_reaches_every_caller():
+    service = make_service()
+    service.provider.client.embeddings.error = RuntimeError("rate limited")
+
+    results = await asyncio.gather(
+        service.create_embedding("a"),
+        service.create_embedding("b"),
+        return_exceptions=True,
+    )
+
+    assert [str(result) for result in results] == ["rate limited"] * 2
+    with pytest.raises(RuntimeError):
+        await service.create_embedding("c")
+
+
+async def test_cached_texts_skip_the_api():
+    cache = InMemoryEmbeddingCache()
+    service = make_service(cache=cache)
+
+    first = await service.create_embeddings_batch(["alpha", "beta", "alpha"])
+    assert service.provider.client.embeddings.requests == [["alpha", "beta"]]
+    assert (service.cache_hits, service.cache_misses) == (0, 3)
+
+    second = await service.create_embeddings_batch(["beta", "gamma", "alpha"])
+    assert service.provider.client.embeddings.requests[-1] == ["gamma"]
+    assert second == [first[1], [5.0], first[0]]
+    assert (service.cache_hits, service.cache_misses) == (2, 4)
+
+    # Another model must not reuse these vectors
+    other = make_service(cache=cache, model="text-embedding-3-large")
+    await other.create_embeddings_batch(["alpha"])
+    assert other.provider.client.embeddings.requests == [["alpha"]]
+
+
+async def test_memory_cache_evicts_least_recently_used():
+    cache = InMemoryEmbeddingCache(max_entries=2)
+    await cache.set_many("m", 0, {"a": [1.0], "b": [2.0]})
+    await cache.get_many("m", 0, ["a"])
+    await cache.set_many("m", 0, {"c": [3.0]})
+
+    assert await cache.get_many("m", 0, ["a", "b", "c"]) == {"a": [1.0], "c": [3.0]}
+
+
+async def test_tiered_cache_fills_memory_from_persistent_tier():
+    persistent = InMemoryEmbeddingCache()
+    await persistent.set_many("m", 0, {"a": [0.5, -1.25]})
+    cache = TieredEmbeddingCache(InMemoryEmbeddingCache(), persistent)
+
+    assert await cache.get_many("m", 0, ["a", "b"]) == {"a": [0.5, -1.25]}
+    assert await cache.memory.get_many("m", 0, ["a"]) == {"a": [0.5, -1.25]}
@@ -0,0 +1,71 @@
+import math
+from types import SimpleNamespace
+
+import pytest
+
+from github_analysis.services.embedding_providers import (
+    HashingEmbeddingProvider,
+    OpenAIEmbeddingProvider,
+    create_embedding_provider,
+)
+
+
+def cosine(a, b):
+    return sum(x * y for x, y in zip(a, b))
+
+
+async def test_hashing_is_deterministic_and_normalized():
+    provider = HashingEmbeddingProvider(dimensions=256, workers=1)
+
+    first, second = await provider.embed(["def parse_diff(text):", ""])
+
+    assert first == (await provider.embed(["def parse_diff(text):"]))[0]
+    assert len(first) == 256
+    assert math.isclose(math.sqrt(sum(x * x for x in first)), 1.0)
+    assert second == [0.0] * 256
+
+
+async def test_hashing_ranks_shared_identifiers_closer():
+    provider = HashingEmbeddingProvider(dimensions=512, workers=1)
+
+    query, related, unrelated = await provider.embed(
+        [
+            "+    retry_delay = self.retryDelay * 2",
+            "-    retry_delay = self.retryDelay",
+            "+<div class='header'>Welcome</div>",
+        ]
+    )
+
+    assert cosine(query, related) > cosine(query, unrelated)
+
+
+async def test_large_batches_are_split_across_processes():
+    texts = [f"+ value_{n} = compute(value_{n - 1})" for n in range(40)]
+    serial = await HashingEmbeddingProvider(dimensions=64, workers=1).embed(texts)
+    provider = HashingEmbeddingProvider(dimensions=64, workers=2, parallel_threshold=8)
+    try:
+        assert await provider.embed(texts) == serial
+        assert provider._pool is not None
+    finally:
+        await provider.close()
+
+
+def test_provider_is_selected_from_settings():
+    settings = SimpleNamespace(
+        EMBEDDING_PROVIDER="hashing",
+        EMBEDDING_MODEL=None,
+        EMBEDDING_DIMENSIONS=384,
+        EMBEDDING_WORKERS=0,
+        OPENAI_API_KEY="test-key",
+    )
+    assert create_embedding_provider(settings).dimensions == 384
+
+    settings.EMBEDDING_PROVIDER = "openai"
+    settings.EMBEDDING_MODEL = "text-embedding-3-large"
+    settings.EMBEDDING_DIMENSIONS = None
+    assert create_embedding_provider(settings).dimensions == 3072
+    assert isinstance(create_embedding_provider(settings), OpenAIEmbeddingProvider)
+
+    settings.EMBEDDING_PROVIDER = "word2vec"
+    with pytest.raises(ValueError, match="Unknown EMBEDDING_PROVIDER"):
+        create_embedding_provider(settings)
@@ -0,0 +1,595 @@
+import asyncio
+import hashlib
+import json
+import time
+from datetime import datetime, timezone
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from sqlalchemy import select
+
+from github_analysis.config import settings
+from github_analysis.models.models import RepositorySyncState
+from github_analysis.services.github_service import GitHubService
+from github_analysis.services.http_session import create_github_session
+from github_analysis.services.rate_limiter import GitHubRateLimiter, GitHubTokenPool
+from github_analysis.services.response_cache import (
+    CachedResponse,
+    InMemoryResponseCache,
+)
+
+SAMPLE_DIFF = """diff --git a/app.py b/app.py
+index 1111111..2222222 100644
+--- a/app.py
++++ b/app.py
+@@ -1,2 +1,3 @@
+ import os
++import sys
+ print(os.name)
+"""
+
+
+class FakeGitHub:
+    """In-process stand-in for the parts of the GitHub REST API we call."""
+
+    def __init__(self, pr_count: int):
+        self.prs = [
+            {
+                "id": 1000 + n,
+                "number": n,
+                "title": f"PR {n}",
+                "body": "",
+                "created_at": "2024-01-01T00:00:00Z",
+                "updated_at": f"2024-02-{n:02d}T00:00:00Z",
+            }
+            for n in range(1, pr_count + 1)
+        ]
+        self.client_ports: set = set()
+        self.page_requests = 0
+        self.not_modified = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        # PR numbers whose comments endpoint answers 429 once
+        self.rate_limit_once: set = set()
+        # PR numbers whose comments endpoint fails with a 500
+        self.fail_comments: set = set()
+        # PR numbers whose comments endpoint fails with a 500 this many times,
+        # and when each of their comment requests arrived
+        self.flaky_comments: dict = {}
+        self.comment_times: dict = {}
+        self.revoked_tokens: set = set()
+        self.token_requests: dict = {}
+        self.comment_requests = 0
+        self.graphql_requests = 0
+        # PR numbers whose review threads GraphQL reports as truncated
+        self.truncated_threads: set = set()
+        self.diff = SAMPLE_DIFF
+        self.diff_requests = 0
+
+    def _track(self, request: web.Request) -> None:
+        self.client_ports.add(request.transport.get_extra_info("peername")[1])
+
+    async def pulls(self, request: web.Request) -> web.Response:
+        self._track(request)
+        self.page_requests += 1
+        per_page = int(request.query.get("per_page", 30))
+        page = int(request.query.get("page", 1))
+        prs = sorted(
+            self.prs,
+            key=lambda pr: pr[request.query.get("sort", "created") + "_at"],
+            reverse=request.query.get("direction") == "desc",
+        )
+        body = prs[(page - 1) * per_page : page * per_page]
+        etag = '"%s"' % hashlib.sha1(json.dumps(body).encode()).hexdigest()
+        if request.headers.get("If-None-Match") == etag:
+            self.not_modified += 1
+            return web.Response(status=304, headers={"ETag": etag})
+        headers = {"ETag": etag}
+        if page * per_page < len(prs):
+            next_url = request.url.update_query(page=page + 1)
+            headers["Link"] = f'<{next_url}>; rel="next", <{next_url}>; rel="last"'
+        return web.json_response(body, headers=headers)
+
+    async def comments(self, request: web.Request) -> web.Response:
+        self._track(request)
+        self.comment_requests += 1
+        number = int(request.match_info["number"])
+        self.comment_times.setdefault(number, []).append(time.monotonic())
+        if number in self.fail_comments:
+            return web.json_response({"message": "Server Error"}, status=500)
+        if self.flaky_comments.get(number):
+            self.flaky_comments[number] -= 1
+            return web.json_response({"message": "Server Error"}, status=500)
+        if number in self.rate_limit_once:
+            self.rate_limit_once.discard(number)
+            return web.json_response(
+                {"message": "API rate limit exceeded"},
+                status=429,
+                headers={"Retry-After": "0"},
+            )
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.02)
+        self.in_flight -= 1
+        return web.json_response(
+            [{"id": 20, "body": "LGTM", "user": {"login": "reviewer"}}]
+        )
+
+    async def pull(self, request: web.Request) -> web.Response:
+        self._track(request)
+        self.diff_requests += 1
+        etag = '"%s"' % hashlib.sha1(self.diff.encode()).hexdigest()
+        if request.headers.get("If-None-Match") == etag:
+            self.not_modified += 1
+            return web.Response(status=304, headers={"ETag": etag})
+        return web.Response(text=self.diff, headers={"ETag": etag})
+
+    async def graphql(self, request: web.Request) -> web.Response:
+        self.graphql_requests += 1
+        variables = (await request.json())["variables"]
+        start = int(variables["after"] or 0)
+        end = start + variables["first"]
+        nodes = [
+            {
+                "databaseId": pr["id"],
+                "number": pr["number"],
+                "title": pr["title"],
+                "body": pr["body"],
+                "createdAt": pr["created_at"],
+                "updatedAt": pr["updated_at"],
+                "reviewThreads": {
+                    "pageInfo": {"hasNextPage": pr["number"] in self.truncated_threads},
+                    "nodes": [
+                        {
+                            "comments": {
+                                "pageInfo": {"hasNextPage": False},
+                                "nodes": [
+                                    {
+                                        "databaseId": 20,
+                                        "body": "LGTM",
+                                        "author": None,
+                                    }
+                                ],
+                            }
+                        }
+                    ],
+                },
+            }
+            for pr in self.prs[start:end]
+        ]
+        connection = {
+            "pageInfo": {
+                "hasNextPage": end < len(self.prs),
+                "endCursor": str(end),
+            },
+            "nodes": nodes,
+        }
+        return web.json_response({"data": {"repository": {"pullRequests": connection}}})
+
+    @web.middleware
+    async def check_token(self, request: web.Request, handler) -> web.Response:
+        token = request.headers["Authorization"].removeprefix("Bearer ")
+        self.token_requests[token] = self.token_requests.get(token, 0) + 1
+        if token in self.revoked_tokens:
+            return web.json_response({"message": "Bad credentials"}, status=401)
+        return await handler(request)
+
+    def build_app(self) -> web.Application:
+        app = web.Application(middlewares=[self.check_token])
+        app.router.add_get("/repos/{owner}/{repo}/pulls", self.pulls)
+        app.router.add_get(
+            "/repos/{owner}/{repo}/pulls/{number}/comments", self.comments
+        )
+        app.router.add_get("/repos/{owner}/{repo}/pulls/{number}", self.pull)
+        app.router.add_post("/graphql", self.graphql)
+        return app
+
+
+class RecordingGitHubService(GitHubService):
+    """GitHubService that records writes instead of hitting the database."""
+
+    def __init__(self, *args, write_delay: float = 0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.write_delay = write_delay
+        self.written = []
+        self.batch_sizes = []
+
+    async def _write_prs(self, batch: list) -> list:
+        await asyncio.sleep(self.write_delay)  # Stands in for DB latency
+        self.written.extend(batch)
+        self.batch_sizes.append(len(batch))
+        return [
+            {"status": "success", "pr_number": details["pr_data"]["number"]}
+            for details in batch
+        ]
+
+
+@pytest.fixture
+async def fake_github():
+    fake = FakeGitHub(pr_count=12)
+    server = TestServer(fake.build_app())
+    await server.start_server()
+    fake.base_url = str(server.make_url("")).rstrip("/")
+    yield fake
+    await server.close()
+
+
+@pytest.fixture
+async def github_session():
+    session = create_github_session(settings)
+    yield session
+    await session.close()
+
+
+async def test_requests_share_pooled_connection(fake_github, github_session):
+    service = GitHubService(
+        None, "token", github_session, base_url=fake_github.base_url
+    )
+    prs = [pr async for pr in service.iter_pull_requests("octo", "repo")]
+    comments = await service._get_pr_comments("octo", "repo", 1)
+    files, truncated = await service._get_pr_diff("octo", "repo", 1)
+
+    assert prs[0]["number"] == 1
+    assert comments[0]["user"]["login"] == "reviewer"
+    assert files[0]["file_path"] == "app.py" and not truncated
+    # Keep-alive: all calls went over the same TCP connection
+    assert len(fake_github.client_ports) == 1
+
+
+async def test_fetch_and_store_prs_bounds_fan_out(fake_github, github_session):
+    service = RecordingGitHubService(
+        None,
+        "token",
+        github_session,
+        base_url=fake_github.base_url,
+        fetch_concurrency=4,
+    )
+    results = await service.fetch_and_store_prs("octo", "repo", limit=12)
+
+    assert sorted(results["stored"]) == list(range(1, 13))
+    assert results["duplicates"] == []
+    assert results["errors"] == []
+    assert results["total_processed"] == 12
+    assert len(service.written[0]["diffs"]) == 1
+    assert 1 < fake_github.max_in_flight <= 4
+
+
+async def test_fetch_and_store_prs_writes_in_batches(fake_github, github_session):
+    service = RecordingGitHubService(
+        None,
+        "token",
+        github_session,
+        base_url=fake_github.base_url,
+        fetch_concurrency=8,
+        write_batch_size=5,
+        write_delay=0.05,
+    )
+    results = await service.fetch_and_store_prs("octo", "repo", limit=12)
+
+    assert sorted(results["stored"]) == list(range(1, 13))
+    assert sum(service.batch_sizes) == 12
+    # PRs fetched while a write is in progress go out together
+    assert len(service.batch_sizes) < 12
+    assert max(service.batch_sizes) <= 5
+
+
+async def test_iter_pull_requests_follows_link_headers(fake_github, github_session):
+    service = GitHubService(
+        None, "token", github_session, base_url=fake_github.base_url
+    )
+    pages = [
+        page
+        async for page, _ in service.iter_pull_request_pages("octo", "repo", per_page=5)
+    ]
+
+    assert [len(page) for page in pages] == [5, 5, 2]
+    assert [pr["number"] for page in pages for pr in page] == list(range(1, 13))
+
+
+async def test_fetch_and_store_prs_resumes_from_cursor(fake_github, github_session):
+    service = RecordingGitHubService(
+        None, "token", github_session, base_url=fake_github.base_url
+    )
+    first = await service.fetch_and_store_prs("octo", "repo", limit=7)
+    assert first["total_processed"] == 7
+    assert first["next_cursor"] is not None
+
+    second = await service.fetch_and_store_prs(
+        "octo", "repo", limit=None, cursor=first["next_cursor"]
+    )
+    assert second["next_cursor"] is None
+    # The partially consumed page is replayed; nothing is skipped
+    assert set(first["stored"]) | set(second["stored"]) == set(range(1, 13))
+
+
+async def test_iter_pull_requests_stops_at_since(fake_github, github_session):
+    service = GitHubService(
+        None, "token", github_session, base_url=fake_github.base_url
+    )
+    since = datetime(2024, 2, 9, tzinfo=timezone.utc)
+    prs = [pr async for pr in service.iter_pull_requests("octo", "repo", since=since)]
+
+    assert [pr["number"] for pr in prs] == [12, 11, 10, 9]
+
+
+async def test_probe_latest_update_uses_etag(fake_github, github_session):
+    service = GitHubService(
+        None, "token", github_session, base_url=fake_github.base_url
+    )
+    not_modified, etag, latest = await service._probe_latest_update("octo", "repo")
+    assert not not_modified
+    assert latest == datetime(2024, 2, 12, tzinfo=timezone.utc)
+
+    not_modified, _, _ = await service._probe_latest_update("octo", "repo", etag)
+    assert not_modified
+
+    fake_github.prs[0]["updated_at"] = "2024-03-01T00:00:00Z"
+    not_modified, _, latest = await service._probe_latest_update("octo", "repo", etag)
+    assert not not_modified
+    assert latest == datetime(2024, 3, 1, tzinfo=timezone.utc)
+
+
+async def test_response_cache_serves_304s(fake_github, github_session):
+    service = GitHubService(
+        None,
+        "token",
+        github_session,
+        base_url=fake_github.base_url,
+        response_cache=InMemoryResponseCache(),
+    )
+    first = [
+        pr["number"]
+        async for pr in service.iter_pull_requests("octo", "repo", state="open")
+    ]
+    assert fake_github.not_modified == 0
+
+    second = [
+        pr["number"]
+        async for pr in service.iter_pull_requests("octo", "repo", state="open")
+    ]
+    # Every page was revalidated, and Link headers survived the 304s
+    assert second == first == list(range(1, 13))
+    assert fake_github.not_modified == fake_github.page_requests // 2
+
+
+async def test_large_diffs_are_streamed_and_truncated(fake_github, github_session):
+    file_diffs = [SAMPLE_DIFF.replace("app.py", f"file{n}.py") for n in range(1000)]
+    fake_github.diff = "".join(file_diffs)
+    service = GitHubService(
+        None,
+        "token",
+        github_session,
+        base_url=fake_github.base_url,
+        # Cuts the 11th file off after its "diff --git" line
+        max_diff_size=len("".join(file_diffs[:10])) + 40,
+    )
+    files, truncated = await service._get_pr_diff("octo", "repo", 1)
+
+    assert truncated
+    assert [file["file_path"] for file in files] == [f"file{n}.py" for n in range(11)]
+    assert not files[9]["truncated"] and files[10]["truncated"]
+
+
+async def test_in_memory_response_cache_evicts_least_recently_used():
+    cache = InMemoryResponseCache(max_entries=2)
+    await cache.set("/a", "json", CachedResponse(body="a", etag="1"))
+    await cache.set("/b", "json", CachedResponse(body="b", etag="2"))
+    assert await cache.get("/a", "json") is not None
+    await cache.set("/c", "json", CachedResponse(body="c", etag="3"))
+
+    assert await cache.get("/b", "json") is None
+    assert (await cache.get("/a", "json")).body == "a"
+    assert await cache.get("/a", "diff") is None
+
+
+async def test_in_memory_response_cache_is_bounded_by_bytes():
+    cache = InMemoryResponseCache(max_entries=100, max_bytes=10)
+    await cache.set("/a", "json", CachedResponse(body="aaaa", etag="1"))
+    await cache.set("/b", "json", CachedResponse(body="bbbb", etag="2"))
+    await cache.set("/c", "json", CachedResponse(body="cccc", etag="3"))
+    # Larger than the whole cache: not stored, nothing else evicted
+    await cache.set("/d", "json", CachedResponse(body="d" * 11, etag="4"))
+
+    assert await cache.get("/a", "json") is None
+    assert await cache.get("/d", "json") is None
+    assert (await cache.get("/c", "json")).body == "cccc"
+    assert cache.size == 8
+
+    await cache.set("/c", "json", CachedResponse(body="c", etag="5"))
+    assert cache.size == 5
+
+
+async def test_diffs_are_revalidated_only_by_persistent_caches(
+    fake_github, github_session
+):
+    memory = InMemoryResponseCache()
+    persistent = InMemoryResponseCache()
+    # Stands in for the database backend, which keeps diffs
+    persistent.caches_diffs = True
+
+    for cache in (memory, persistent):
+        service = GitHubService(
+            None,
+            "token",
+            github_session,
+            base_url=fake_github.base_url,
+            response_cache=cache,
+        )
+        for _ in range(2):
+            files, _ = await service._get_pr_diff("octo", "repo", 1)
+            assert [file["file_path"] for file in files] == ["app.py"]
+
+    assert memory.size == 0
+    assert fake_github.diff_requests == 4
+    assert fake_github.not_modified == 1
+
+
+async def test_rate_limited_prs_are_requeued(fake_github, github_session):
+    fake_github.rate_limit_once = {3, 7}
+    service = RecordingGitHubService(
+        None,
+        "token",
+        github_session,
+        base_url=fake_github.base_url,
+        rate_limiter=GitHubRateLimiter(backoff_base=0.01),
+        max_retries=0,
+    )
+    results = await service.fetch_and_store_prs("octo", "repo", limit=12)
+
+    assert results["errors"] == []
+    assert sorted(results["stored"]) == list(range(1, 13))
+    assert fake_github.rate_limit_once == set()
+
+
+async def test_prs_failing_with_server_errors_are_retried_after_a_backoff(
+    fake_github, github_session
+):
+    fake_github.flaky_comments = {5: 2}
+    service = RecordingGitHubService(
+        None,
+        "token",
+        github_session,
+        base_url=fake_github.base_url,
+        fetch_retry_delay=0.1,
+    )
+    results = await service.fetch_and_store_prs("octo", "repo", limit=12)
+
+    assert results["errors"] == []
+    assert sorted(results["stored"]) == list(range(1, 13))
+    first, second, third = fake_github.comment_times[5]
+    assert second - first >= 0.1
+    assert third - second >= 0.2
+
+
+async def test_token_pool_skips_revoked_tokens(fake_github, github_session):
+    fake_github.revoked_tokens = {"revoked"}
+    pool = GitHubTokenPool(["revoked", "good"], GitHubRateLimiter())
+    service = RecordingGitHubService(
+        None,
+        "revoked",
+        github_session,
+        base_url=fake_github.base_url,
+        token_pool=pool,
+    )
+    results = await service.fetch_and_store_prs("octo", "repo", limit=12)
+
+    assert results["errors"] == []
+    assert len(results["stored"]) == 12
+    assert pool.active_tokens == ["good"]
+    assert fake_github.token_requests["revoked"] == 1
+
+
+async def test_graphql_mode_fetches_comments_in_bulk(fake_github, github_session):
+    fake_github.truncated_threads = {4}
+    service = RecordingGitHubService(
+        None,
+        "token",
+        github_session,
+        base_url=fake_github.base_url,
+        fetch_mode="graphql",
+        graphql_page_size=5,
+    )
+    results = await service.fetch_and_store_prs("octo", "repo", limit=None)
+
+    assert sorted(results["stored"]) == list(range(1, 13))
+    assert fake_github.graphql_requests == 3
+    # Only the PR with truncated review threads needed the REST endpoint
+    assert fake_github.comment_requests == 1
+    written = {details["pr_data"]["number"]: details for details in service.written}
+    assert written[1]["comments"] == [
+        {"id": 20, "body": "LGTM", "user": {"login": "ghost"}}
+    ]
+    assert written[4]["comments"][0]["user"]["login"] == "reviewer"
+
+
+def touch(fake: FakeGitHub, number: int, updated_at: str) -> None:
+    pr = fake.prs[number - 1]
+    pr["updated_at"] = updated_at
+    pr["title"] = f"PR {number}, edited"
+
+
+async def sync_state(db) -> RepositorySyncState:
+    state = (await db.execute(select(RepositorySyncState))).scalar_one()
+    await db.commit()
+    return state
+
+
+async def test_sync_repository_backfills_then_fetches_only_updated_prs(
+    fake_github, github_session, db
+):
+    service = GitHubService(db, "token", github_session, base_url=fake_github.base_url)
+
+    first = await service.sync_repository("octo", "repo", limit=5)
+    assert first["mode"] == "backfill"
+    assert first["stored"] == [1, 2, 3, 4, 5]
+    state = await sync_state(db)
+    assert state.cursor is not None and state.last_updated_at is None
+
+    second = await service.sync_repository("octo", "repo")
+    assert second["mode"] == "backfill"
+    assert sorted(second["stored"]) == list(range(6, 13))
+    state = await sync_state(db)
+    assert state.cursor is None
+    assert state.last_updated_at == datetime(2024, 2, 12, tzinfo=timezone.utc)
+
+    touch(fake_github, 3, "2024-03-01T00:00:00Z")
+    comment_requests = fake_github.comment_requests
+    third = await service.sync_repository("octo", "repo")
+
+    assert third["mode"] == "incremental"
+    assert third["updated"] == [3]
+    # PR 12 sits on the old high-water mark and is fetched again
+    assert third["duplicates"] == [12]
+    assert fake_github.comment_requests - comment_requests == 2
+    state = await sync_state(db)
+    assert state.last_updated_at == datetime(2024, 3, 1, tzinfo=timezone.utc)
+
+
+async def test_sync_repository_skips_unchanged_listing(fake_github, github_session, db):
+    service = GitHubService(db, "token", github_session, base_url=fake_github.base_url)
+    await service.sync_repository("octo", "repo")
+    page_requests = fake_github.page_requests
+    comment_requests = fake_github.comment_requests
+
+    results = await service.sync_repository("octo", "repo")
+
+    assert results["mode"] == "unchanged"
+    assert results["total_processed"] == 0
+    # Only the probe was sent, and answered with a 304
+    assert fake_github.page_requests - page_requests == 1
+    assert fake_github.not_modified == 1
+    assert fake_github.comment_requests == comment_requests
+
+
+async def test_sync_repository_holds_the_high_water_mark_when_a_pr_fails(
+    fake_github, github_session, db
+):
+    service = GitHubService(
+        db,
+        "token",
+        github_session,
+        base_url=fake_github.base_url,
+        max_fetch_attempts=1,
+    )
+    await service.sync_repository("octo", "repo")
+    mark = (await sync_state(db)).last_updated_at
+
+    touch(fake_github, 3, "2024-03-01T00:00:00Z")
+    touch(fake_github, 5, "2024-03-02T00:00:00Z")
+    fake_github.fail_comments.add(5)
+    failed = await service.sync_repository("octo", "repo")
+
+    assert failed["mode"] == "incremental"
+    assert failed["updated"] == [3]
+    assert [error["pr_number"] for error in failed["errors"]] == [5]
+    assert (await sync_state(db)).last_updated_at == mark
+
+    # The next sync retries from the same mark and then moves it on
+    fake_github.fail_comments.clear()
+    retried = await service.sync_repository("octo", "repo")
+
+    assert retried["mode"] == "incremental"
+    assert retried["updated"] == [5]
+    state = await sync_state(db)
+    assert state.last_updated_at == datetime(2024, 3, 2, tzinfo=timezone.utc)
@@ -0,0 +1,198 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+from github_analysis.dependencies import get_job_pool
+from github_analysis.main import app
+from github_analysis.services.job_queue import (
+    DatabaseJobQueue,
+    InMemoryJobQueue,
+    Job,
+    JobStatus,
+    JobWorkerPool,
+    PermanentJobError,
+)
+
+
+async def wait_for_status(queue, job_id, *statuses):
+    for _ in range(200):
+        job = await queue.get(job_id)
+        if job.status in statuses:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"Job {job_id} stuck in {job.status}")
+
+
+async def test_jobs_run_in_the_background():
+    queue = InMemoryJobQueue()
+    in_flight = 0
+    max_in_flight = 0
+
+    async def handler(job):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.02)
+        in_flight -= 1
+        return {"pr_id": job.params["pr_id"]}
+
+    pool = JobWorkerPool(queue, handler, workers=3, poll_interval=0.01)
+    pool.start()
+    try:
+        jobs = [await pool.submit("analyze_pr", {"pr_id": n}) for n in range(6)]
+        assert jobs[0].status == JobStatus.QUEUED
+        for n, job in enumerate(jobs):
+            done = await wait_for_status(queue, job.id, JobStatus.SUCCEEDED)
+            assert done.result == {"pr_id": n}
+            assert done.attempts == 1
+    finally:
+        await pool.stop()
+    assert max_in_flight == 3
+
+
+async def test_failed_jobs_are_retried():
+    queue = InMemoryJobQueue()
+    calls = []
+
+    async def handler(job):
+        calls.append(job.params["name"])
+        if job.params["name"] == "not found":
+            raise PermanentJobError("PR number 1 not found")
+        if job.params["name"] == "flaky" and job.attempts < 2:
+            raise ConnectionError("Qdrant unavailable")
+        if job.params["name"] == "bad answer" and job.attempts < 2:
+            raise ValueError("Failed to parse AI response")
+        if job.params["name"] == "down":
+            raise ConnectionError("OpenAI unavailable")
+        return {"ok": True}
+
+    pool = JobWorkerPool(
+        queue, handler, max_attempts=3, retry_delay=0.01, poll_interval=0.01
+    )
+    pool.start()
+    try:
+        flaky = await pool.submit("analyze_pr", {"name": "flaky"})
+        bad_answer = await pool.submit("analyze_pr", {"name": "bad answer"})
+        missing = await pool.submit("analyze_pr", {"name": "not found"})
+        down = await pool.submit("analyze_pr", {"name": "down"})
+
+        flaky = await wait_for_status(queue, flaky.id, JobStatus.SUCCEEDED)
+        assert flaky.attempts == 2
+        assert flaky.error is None
+        # A malformed LLM answer may well parse next time
+        bad_answer = await wait_for_status(queue, bad_answer.id, JobStatus.SUCCEEDED)
+        assert bad_answer.attempts == 2
+
+        # Bad input is not worth retrying
+        missing = await wait_for_status(queue, missing.id, JobStatus.FAILED)
+        assert missing.attempts == 1
+        assert missing.error == "PR number 1 not found"
+
+        down = await wait_for_status(queue, down.id, JobStatus.FAILED)
+        assert down.attempts == 3
+        assert down.error == "OpenAI unavailable"
+    finally:
+        await pool.stop()
+    assert calls.count("down") == 3
+
+
+async def test_workers_survive_failing_to_record_a_job():
+    class FlakyQueue(InMemoryJobQueue):
+        failures = 1
+
+        async def complete(self, job, result):
+            if self.failures:
+                self.failures -= 1
+                raise ConnectionError("database unavailable")
+            await super().complete(job, result)
+
+    queue = FlakyQueue()
+
+    async def handler(job):
+        return {"ok": True}
+
+    pool = JobWorkerPool(queue, handler, workers=1, poll_interval=0.01)
+    pool.start()
+    try:
+        lost = await pool.submit("analyze_pr", {})
+        done = await pool.submit("analyze_pr", {})
+        await wait_for_status(queue, done.id, JobStatus.SUCCEEDED)
+        # Left running until its lease runs out
+        assert (await queue.get(lost.id)).status == JobStatus.RUNNING
+    finally:
+        await pool.stop()
+
+
+async def test_database_queue_round_trip(session_manager):
+    queue = DatabaseJobQueue(session_manager.session)
+    first = await queue.enqueue(Job(kind="analyze_pr", params={"pr_id": 1}))
+    second = await queue.enqueue(Job(kind="analyze_pr", params={"pr_id": 2}))
+
+    claimed = await queue.claim(lease=60)
+    assert (claimed.id, claimed.status, claimed.attempts) == (
+        first.id,
+        JobStatus.RUNNING,
+        1,
+    )
+    assert claimed.params == {"pr_id": 1}
+    await queue.complete(claimed, {"stored": True})
+
+    claimed = await queue.claim(lease=60)
+    assert claimed.id == second.id
+    # Nothing else is due while the second job holds its lease
+    assert await queue.claim(lease=60) is None
+    await queue.fail(claimed, "Qdrant unavailable", retry_at=claimed.created_at)
+
+    retried = await queue.claim(lease=60)
+    assert (retried.id, retried.attempts) == (second.id, 2)
+    await queue.fail(retried, "PR number 2 not found", retry_at=None)
+
+    first = await queue.get(first.id)
+    assert (first.status, first.result) == (JobStatus.SUCCEEDED, {"stored": True})
+    second = await queue.get(second.id)
+    assert (second.status, second.error) == (
+        JobStatus.FAILED,
+        "PR number 2 not found",
+    )
+    assert await queue.get("missing") is None
+
+
+async def test_jobs_time_out():
+    queue = InMemoryJobQueue()
+
+    async def handler(job):
+        await asyncio.sleep(10)
+
+    pool = JobWorkerPool(
+        queue, handler, max_attempts=1, job_timeout=0.01, poll_interval=0.01
+    )
+    pool.start()
+    try:
+        job = await pool.submit("analyze_pr", {})
+        job = await wait_for_status(queue, job.id, JobStatus.FAILED)
+        assert job.error.startswith("Timed out")
+    finally:
+        await pool.stop()
+
+
+def test_analyze_pr_returns_a_job_to_poll():
+    # Not started, so jobs stay queued
+    pool = JobWorkerPool(InMemoryJobQueue(), handler=None)
+    app.dependency_overrides[get_job_pool] = lambda: pool
+    try:
+        client = TestClient(app)
+        response = client.post("/analyze-pr/7", params={"owner": "o", "repo": "r"})
+        assert response.status_code == 202
+        job_id = response.json()["id"]
+
+        response = client.get(f"/jobs/{job_id}")
+        assert response.status_code == 200
+        assert response.json()["status"] == "queued"
+        assert response.json()["kind"] == "analyze_pr"
+
+        response = client.post("/analyze-prs", json={"owner": "o"})
+        assert response.status_code == 422
+
+        assert client.get("/jobs/missing").status_code == 404
+    finally:
+        app.dependency_overrides.clear()
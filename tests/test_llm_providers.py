@@ -0,0 +1,119 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from github_analysis.services.ai_service import AIService
+from github_analysis.services.llm_providers import (
+    FakeLLMProvider,
+    LLMProvider,
+    OpenAIChatProvider,
+    create_llm_provider,
+)
+
+PR_CONTEXT = {
+    "id": 1,
+    "title": "Add retries",
+    "description": "Retry failed requests",
+    "changes": [
+        {
+            "file": f"src/module_{n}.py",
+            "change_type": "modify",
+            "changes": [f"-old {n}\n+" + "x" * 300] * 5,
+        }
+        for n in range(3)
+    ],
+    "discussion": [],
+}
+
+
+class SlowProvider(LLMProvider):
+    def __init__(self, delay, **kwargs):
+        super().__init__(**kwargs)
+        self.model = "slow"
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def _complete_json(self, messages, temperature):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        return "{}"
+
+
+async def test_fake_provider_answers_analysis_and_summary_prompts():
+    provider = FakeLLMProvider()
+    service = AIService(
+        "test-key",
+        provider=provider,
+        prompt_token_budget=1000,
+        map_reduce_threshold=500,
+    )
+
+    analysis = await service.analyze_pr(PR_CONTEXT)
+
+    assert analysis["summary"].startswith("Add retries")
+    assert set(analysis) >= {"summary", "impact_level", "impact_details", "key_points"}
+    assert analysis["impact_level"] in ("low", "medium", "high")
+    # Map-reduce ran: one summary call plus the analysis
+    assert provider.calls >= 2
+    assert service.model == "fake-llm"
+
+
+async def test_fake_provider_is_deterministic():
+    messages = [{"role": "user", "content": "Title: Fix bug\nFile: a.py (modify)"}]
+
+    first = await FakeLLMProvider().complete_json(messages, 0.1)
+
+    assert first == await FakeLLMProvider().complete_json(messages, 0.1)
+    assert json.loads(first)["key_points"] == ["Changes a.py"]
+
+
+async def test_concurrency_is_capped_per_provider():
+    provider = SlowProvider(0.01, concurrency=2)
+
+    await asyncio.gather(*(provider.complete_json([], 0.1) for _ in range(6)))
+
+    assert provider.max_in_flight == 2
+
+
+async def test_completion_times_out_without_counting_queue_wait():
+    provider = SlowProvider(0.05, concurrency=1, timeout=0.08)
+
+    # Each waits for the other's slot but runs within the timeout
+    await asyncio.gather(
+        provider.complete_json([], 0.1), provider.complete_json([], 0.1)
+    )
+
+    provider.delay = 1.0
+    with pytest.raises(asyncio.TimeoutError):
+        await provider.complete_json([], 0.1)
+
+
+def test_provider_is_selected_from_settings():
+    settings = SimpleNamespace(
+        LLM_PROVIDER="local",
+        LLM_MODEL="llama3",
+        LLM_BASE_URL="http://localhost:11434/v1",
+        LLM_API_KEY=None,
+        LLM_CONCURRENCY=2,
+        LLM_TIMEOUT=30.0,
+        LLM_FAKE_LATENCY=0.0,
+        OPENAI_API_KEY="test-key",
+    )
+    provider = create_llm_provider(settings)
+    assert isinstance(provider, OpenAIChatProvider)
+    assert str(provider.client.base_url).startswith("http://localhost:11434/v1")
+    assert (provider.model, provider.concurrency) == ("llama3", 2)
+
+    settings.LLM_BASE_URL = None
+    with pytest.raises(ValueError, match="LLM_BASE_URL"):
+        create_llm_provider(settings)
+
+    settings.LLM_PROVIDER = "fake"
+    assert isinstance(create_llm_provider(settings), FakeLLMProvider)
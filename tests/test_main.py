@@ -1,7 +1,14 @@
+from datetime import datetime, timezone
+
+import httpx
 import pytest
 from fastapi.testclient import TestClient
 
+from github_analysis.dependencies import get_job_pool
 from github_analysis.main import app
+from github_analysis.models.models import PullRequest
+from github_analysis.services.job_queue import InMemoryJobQueue, JobWorkerPool
+from github_analysis.services.pr_context import load_pr_context
 
 client = TestClient(app)
 
@@ -10,3 +17,52 @@ def test_health_check():
     response = client.get("/health")
     assert response.status_code == 200
     assert response.json() == {"status": "healthy"}
+
+
+async def test_analyze_pr_jobs_pick_the_pr_by_owner_and_repo(db):
+    for github_id, repo in ((1, "app"), (2, "lib")):
+        db.add(
+            PullRequest(
+                github_id=github_id,
+                repo_owner="octo",
+                repo_name=repo,
+                number=7,
+                title=f"{repo} PR 7",
+                created_at=datetime(2024, 1, 1, tzinfo=timezone.utc),
+            )
+        )
+    await db.commit()
+
+    async def load_context(job):
+        context, _ = await load_pr_context(db, **job.params)
+        return {"repo": context["repo"]}
+
+    pool = JobWorkerPool(InMemoryJobQueue(), load_context)
+    app.dependency_overrides[get_job_pool] = lambda: pool
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test"
+        ) as client:
+            scoped = await client.post("/analyze-pr/7?owner=octo&repo=lib")
+            ambiguous = await client.post("/analyze-pr/7")
+            assert scoped.status_code == ambiguous.status_code == 202
+            assert (await pool.queue.get(scoped.json()["id"])).params == {
+                "pr_id": 7,
+                "owner": "octo",
+                "repo": "lib",
+            }
+
+            for _ in range(2):
+                await pool.run(await pool.queue.claim(lease=60))
+            scoped = (await client.get(f"/jobs/{scoped.json()['id']}")).json()
+            ambiguous = (await client.get(f"/jobs/{ambiguous.json()['id']}")).json()
+    finally:
+        app.dependency_overrides.clear()
+
+    assert scoped["status"] == "succeeded"
+    assert scoped["result"] == {"repo": "octo/lib"}
+    # Not retried: the job cannot succeed without a repository
+    assert ambiguous["status"] == "failed"
+    assert ambiguous["attempts"] == 1
+    assert "several repositories; pass owner and repo" in ambiguous["error"]
@@ -0,0 +1,164 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+from github_analysis.services.llm_providers import OpenAIChatProvider
+from github_analysis.services.openai_rate_limiter import OpenAIRateLimiter
+
+
+class FakeClock:
+    def __init__(self, now: float = 1_000.0):
+        self.now = now
+        self.slept = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float) -> None:
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def make_limiter(clock: FakeClock, **kwargs) -> OpenAIRateLimiter:
+    return OpenAIRateLimiter(clock=clock, sleep=clock.sleep, **kwargs)
+
+
+def rate_limit_error(code="rate_limit_exceeded", retry_after=None):
+    headers = {"retry-after": retry_after} if retry_after else {}
+    response = httpx.Response(
+        429,
+        headers=headers,
+        request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"),
+    )
+    return openai.RateLimitError("Rate limited", response=response, body={"code": code})
+
+
+def responses(*outcomes):
+    """A request that raises or returns each outcome in turn."""
+    outcomes = list(outcomes)
+
+    async def request():
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    return request
+
+
+async def test_waits_for_the_token_bucket():
+    clock = FakeClock()
+    limiter = make_limiter(clock, tokens_per_minute=6000)
+
+    await limiter.call("gpt", 5000, responses("a"))
+    await limiter.call("gpt", 5000, responses("b"))
+
+    # 4000 more tokens at 100 per second
+    assert clock.slept == [pytest.approx(40.0)]
+    assert limiter.stats()["queue_wait_seconds"]["max"] == pytest.approx(40.0)
+
+
+async def test_models_have_separate_buckets():
+    clock = FakeClock()
+    limiter = make_limiter(clock, requests_per_minute=1)
+
+    await limiter.call("gpt", 1, responses("a"))
+    await limiter.call("embedding", 1, responses("b"))
+
+    assert clock.slept == []
+
+
+async def test_rate_limit_halves_concurrency_and_honours_retry_after(monkeypatch):
+    monkeypatch.setattr("random.uniform", lambda a, b: 0.0)
+    clock = FakeClock()
+    limiter = make_limiter(clock, max_concurrency=8)
+
+    result = await limiter.call(
+        "gpt", 10, responses(rate_limit_error(retry_after="7"), "ok")
+    )
+
+    assert result == "ok"
+    assert clock.slept[0] == 7.0
+    stats = limiter.stats()
+    assert (stats["rate_limited"], stats["retries"], stats["calls"]) == (1, 1, 2)
+    assert stats["models"]["gpt"]["concurrency_limit"] == 4
+
+    # Grows back by one slot per cap's worth of successes
+    for _ in range(5):
+        await limiter.call("gpt", 10, responses("ok"))
+    assert limiter.stats()["models"]["gpt"]["concurrency_limit"] == 5
+
+
+async def test_exhausted_quota_is_not_retried():
+    limiter = make_limiter(FakeClock())
+
+    with pytest.raises(openai.RateLimitError):
+        await limiter.call(
+            "gpt", 10, responses(rate_limit_error(code="insufficient_quota"))
+        )
+
+    assert (limiter.retries, limiter.failures) == (0, 1)
+
+
+async def test_slow_attempts_time_out_and_are_retried():
+    limiter = make_limiter(FakeClock(), timeout=0.01, max_retries=2)
+    attempts = []
+
+    async def hangs():
+        attempts.append(1)
+        await asyncio.sleep(1)
+
+    with pytest.raises(asyncio.TimeoutError):
+        await limiter.call("gpt", 10, hangs)
+
+    assert len(attempts) == 3
+    assert (limiter.timeouts, limiter.retries, limiter.failures) == (3, 2, 1)
+
+
+async def test_caps_calls_in_flight():
+    limiter = make_limiter(FakeClock(), max_concurrency=3)
+    in_flight = []
+    peak = []
+
+    async def request():
+        in_flight.append(1)
+        peak.append(len(in_flight))
+        await asyncio.sleep(0.01)
+        in_flight.pop()
+        return "ok"
+
+    results = await asyncio.gather(
+        *(limiter.call("gpt", 10, request) for _ in range(10))
+    )
+
+    assert results == ["ok"] * 10
+    assert max(peak) == 3
+    assert limiter.stats()["models"]["gpt"]["in_flight"] == 0
+
+
+async def test_chat_provider_calls_go_through_the_limiter(monkeypatch):
+    monkeypatch.setattr("random.uniform", lambda a, b: 0.0)
+    clock = FakeClock()
+    limiter = OpenAIRateLimiter(clock=clock, sleep=clock.sleep)
+    provider = OpenAIChatProvider("test-key", "gpt", rate_limiter=limiter)
+    outcomes = [rate_limit_error(retry_after="2"), '{"summary": "ok"}']
+
+    async def create(**request):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        message = SimpleNamespace(content=outcome)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    provider.client = SimpleNamespace(
+        chat=SimpleNamespace(completions=SimpleNamespace(create=create))
+    )
+
+    assert await provider.complete_json([{"content": "hi"}], 0.1) == (
+        '{"summary": "ok"}'
+    )
+    assert clock.slept == [2.0]
+    assert limiter.stats()["rate_limited"] == 1
@@ -0,0 +1,130 @@
+from datetime import datetime, timezone
+
+import pytest
+from sqlalchemy import select
+
+from github_analysis.models.models import ChangeType, PullRequest
+from github_analysis.services.pr_context import load_pr_context, load_pr_contexts
+from github_analysis.services.pr_writer import PRWriter
+
+
+def details(github_id, number, repo, files=(), comments=()):
+    """PR details shaped like ``GitHubService._fetch_pr_details``."""
+    return {
+        "owner": "octo",
+        "repo": repo,
+        "pr_data": {
+            "id": github_id,
+            "number": number,
+            "title": f"{repo} PR {number}",
+            "body": None,
+            "created_at": "2024-01-01T00:00:00Z",
+            "updated_at": "2024-01-02T00:00:00Z",
+        },
+        "comments": [
+            {"id": github_id * 10 + n, "body": body, "user": {"login": "reviewer"}}
+            for n, body in enumerate(comments)
+        ],
+        "diffs": [
+            {
+                "file_path": path,
+                "change_type": (
+                    ChangeType.ADD if path.endswith(".md") else ChangeType.MODIFY
+                ),
+                "hunks": [
+                    {
+                        "old_start": start,
+                        "old_lines": 1,
+                        "new_start": start,
+                        "new_lines": 1,
+                        "content": content,
+                    }
+                    for start, content in enumerate(hunks, 1)
+                ],
+            }
+            for path, hunks in files
+        ],
+    }
+
+
+async def store(db, *batch):
+    await PRWriter(db).write(list(batch))
+    rows = await db.execute(select(PullRequest.github_id, PullRequest.id))
+    await db.commit()
+    return dict(rows.all())
+
+
+async def test_load_pr_contexts_builds_each_prs_context(db):
+    ids = await store(
+        db,
+        details(
+            1,
+            7,
+            "app",
+            files=[("app.py", ["+a", "+b"]), ("README.md", ["+docs"])],
+            comments=["First", "Second"],
+        ),
+        details(2, 7, "lib", files=[("lib.py", ["+a"])]),
+        details(3, 8, "lib"),
+    )
+
+    contexts = await load_pr_contexts(db, [ids[1], ids[2], ids[3], -1])
+
+    assert sorted(contexts) == sorted(ids.values())
+    assert contexts[ids[1]] == {
+        "id": 7,
+        "repo": "octo/app",
+        "title": "app PR 7",
+        "description": None,
+        "changes": [
+            {"file": "app.py", "change_type": "modify", "changes": ["+a", "+b"]},
+            {"file": "README.md", "change_type": "add", "changes": ["+docs"]},
+        ],
+        "discussion": [
+            {"author": "reviewer", "comment": "First"},
+            {"author": "reviewer", "comment": "Second"},
+        ],
+    }
+    # "+a" is stored once but belongs to both PRs
+    assert contexts[ids[2]]["changes"] == [
+        {"file": "lib.py", "change_type": "modify", "changes": ["+a"]}
+    ]
+    assert contexts[ids[3]]["changes"] == []
+    assert contexts[ids[3]]["discussion"] == []
+
+
+async def test_load_pr_context_picks_the_pr_of_the_given_repository(db):
+    ids = await store(db, details(1, 7, "app"), details(2, 7, "lib"))
+
+    context, db_id = await load_pr_context(db, 7, "octo", "lib")
+
+    assert db_id == ids[2]
+    assert context["repo"] == "octo/lib"
+    with pytest.raises(ValueError, match="PR number 7 not found"):
+        await load_pr_context(db, 7, "octo", "docs")
+
+
+async def test_load_pr_context_rejects_a_number_stored_for_several_repositories(db):
+    ids = await store(
+        db, details(1, 7, "app"), details(2, 7, "lib"), details(3, 8, "lib")
+    )
+
+    with pytest.raises(ValueError, match="several repositories; pass owner and repo"):
+        await load_pr_context(db, 7)
+    # Numbers stored for one repository need no owner and repo
+    assert (await load_pr_context(db, 8))[1] == ids[3]
+
+
+async def test_prs_stored_without_a_repository_have_no_repo(db):
+    legacy = PullRequest(
+        github_id=1,
+        number=7,
+        title="Legacy PR",
+        created_at=datetime(2023, 1, 1, tzinfo=timezone.utc),
+    )
+    db.add(legacy)
+    await db.commit()
+
+    context, _ = await load_pr_context(db, 7)
+
+    assert context["repo"] is None
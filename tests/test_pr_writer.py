@@ -0,0 +1,168 @@
+from sqlalchemy import func, select
+
+from github_analysis.models.models import (
+    ChangeType,
+    DiffHunk,
+    HunkContent,
+    PRComment,
+    PRDiff,
+    PullRequest,
+)
+from github_analysis.services.pr_writer import PRWriter
+
+
+def hunk(content, start=1):
+    return {
+        "old_start": start,
+        "old_lines": 1,
+        "new_start": start,
+        "new_lines": 2,
+        "content": content,
+    }
+
+
+def details(number, title=None, comments=(), diffs=None, repo="app", **pr_data):
+    """PR details shaped like ``GitHubService._fetch_pr_details``."""
+    if diffs is None:
+        diffs = [
+            {
+                "file_path": "app.py",
+                "change_type": ChangeType.MODIFY,
+                "hunks": [hunk(f"+print({number})")],
+            }
+        ]
+    return {
+        "owner": "octo",
+        "repo": repo,
+        "pr_data": {
+            "id": 1000 + number,
+            "number": number,
+            "title": title or f"PR {number}",
+            "body": "",
+            "created_at": "2024-01-01T00:00:00Z",
+            "updated_at": "2024-01-02T00:00:00Z",
+            **pr_data,
+        },
+        "comments": [
+            {"id": comment_id, "body": body, "user": {"login": "octocat"}}
+            for comment_id, body in comments
+        ],
+        "diffs": diffs,
+    }
+
+
+async def count(db, model):
+    return (await db.execute(select(func.count()).select_from(model))).scalar()
+
+
+async def test_new_prs_are_inserted_with_comments_diffs_and_hunks(db):
+    batch = [details(1, comments=[(1, "Looks good")]), details(2)]
+
+    results = await PRWriter(db).write(batch)
+
+    assert results == [
+        {"status": "success", "pr_number": 1},
+        {"status": "success", "pr_number": 2},
+    ]
+    prs = (
+        await db.execute(
+            select(PullRequest.number, PullRequest.title, PullRequest.repo_name)
+        )
+    ).all()
+    assert sorted(prs) == [(1, "PR 1", "app"), (2, "PR 2", "app")]
+    assert await count(db, PRComment) == 1
+    assert await count(db, PRDiff) == 2
+    assert await count(db, DiffHunk) == 2
+
+
+async def test_reingested_pr_is_updated_and_loses_deleted_comments(db):
+    writer = PRWriter(db)
+    await writer.write([details(1, comments=[(1, "First"), (2, "Second")])])
+
+    results = await writer.write(
+        [
+            details(
+                1,
+                title="PR 1, retitled",
+                comments=[(2, "Second, edited")],
+                updated_at="2024-01-03T00:00:00Z",
+            )
+        ]
+    )
+
+    assert results == [{"status": "updated", "pr_number": 1}]
+    assert (await db.execute(select(PullRequest.title))).scalars().all() == [
+        "PR 1, retitled"
+    ]
+    comments = (await db.execute(select(PRComment.github_id, PRComment.body))).all()
+    assert comments == [(2, "Second, edited")]
+
+
+async def test_pr_repeated_in_a_batch_is_written_once(db):
+    results = await PRWriter(db).write([details(1), details(1)])
+
+    assert [result["status"] for result in results] == ["success", "duplicate"]
+    assert await count(db, PullRequest) == 1
+    assert await count(db, PRDiff) == 1
+
+
+async def test_failing_pr_does_not_cost_the_rest_of_its_batch(db):
+    # A PR without a title violates NOT NULL, failing the bulk statement
+    broken = details(2)
+    broken["pr_data"]["title"] = None
+
+    results = await PRWriter(db).write([details(1), broken, details(3)])
+
+    assert [result["status"] for result in results] == ["success", "error", "success"]
+    assert "Database error" in results[1]["detail"]
+    numbers = (await db.execute(select(PullRequest.number))).scalars().all()
+    assert sorted(numbers) == [1, 3]
+    assert await count(db, PRDiff) == 2
+
+
+async def test_unchanged_pr_is_a_duplicate_and_keeps_its_diffs(db):
+    writer = PRWriter(db)
+    await writer.write([details(1)])
+    diff_ids = (await db.execute(select(PRDiff.id))).scalars().all()
+    await db.commit()
+
+    results = await writer.write([details(1)])
+
+    assert results == [{"status": "duplicate", "pr_number": 1}]
+    assert (await db.execute(select(PRDiff.id))).scalars().all() == diff_ids
+
+
+async def test_pr_with_a_new_diff_is_updated_and_its_diffs_replaced(db):
+    writer = PRWriter(db)
+    await writer.write([details(1)])
+
+    # Force-pushed: same updated_at, different diff
+    diffs = [
+        {
+            "file_path": "lib.py",
+            "change_type": ChangeType.ADD,
+            "hunks": [hunk("+import os"), hunk("+import sys", start=5)],
+        }
+    ]
+    results = await writer.write([details(1, diffs=diffs)])
+
+    assert results == [{"status": "updated", "pr_number": 1}]
+    assert (await db.execute(select(PRDiff.file_path))).scalars().all() == ["lib.py"]
+    assert await count(db, DiffHunk) == 2
+
+
+async def test_identical_hunks_share_one_content_row(db):
+    backport = [
+        {
+            "file_path": "app.py",
+            "change_type": ChangeType.MODIFY,
+            "hunks": [hunk("+fix()"), hunk("+fix()", start=40)],
+        }
+    ]
+
+    await PRWriter(db).write(
+        [details(1, diffs=backport), details(2, diffs=backport, repo="lib")]
+    )
+
+    assert await count(db, DiffHunk) == 4
+    assert (await db.execute(select(HunkContent.content))).scalars().all() == ["+fix()"]
@@ -0,0 +1,69 @@
+from github_analysis.services.prompt_budget import (
+    budget_changes,
+    budget_discussion,
+    change_tokens,
+    filter_changes,
+    group_changes,
+    is_generated_file,
+)
+from github_analysis.services.tokens import estimate_tokens
+
+
+def change(path, *hunks):
+    return {"file": path, "change_type": "modify", "changes": list(hunks)}
+
+
+def test_filters_generated_files_and_whitespace_hunks():
+    changes = filter_changes(
+        [
+            change("poetry.lock", "+x = 1"),
+            change("web/dist/app.min.js", "+a()"),
+            change("src/app.py", "-    x = 1\n+x  =  1", "-old\n+new"),
+        ]
+    )
+    assert changes[0]["changes"] == ["[generated file, diff omitted]"]
+    assert changes[1]["changes"] == ["[generated file, diff omitted]"]
+    assert changes[2]["changes"] == ["-old\n+new"]
+    assert not is_generated_file("src/builder.py")
+
+
+def test_budget_keeps_first_hunks_of_every_file():
+    big = "+" + "x" * 300  # 101 estimated tokens
+    small = "+y"
+    changes = [change("a.py", big, small), change("b.py", small, big)]
+
+    budgeted = budget_changes(changes, 150)
+
+    assert change_tokens(budgeted) <= 150 + estimate_tokens("[1 more hunks omitted]")
+    # First hunks rank above second ones; what is left goes to smaller hunks
+    assert budgeted[0]["changes"] == [big, small]
+    assert budgeted[1]["changes"] == [small, "[1 more hunks omitted]"]
+    assert budget_changes(changes, 10_000) == changes
+
+
+def test_budget_drops_files_once_headers_do_not_fit():
+    changes = [change(f"src/module_{n}.py") for n in range(100)]
+    budgeted = budget_changes(changes, 50)
+
+    assert budgeted[-1]["file"].startswith("[")
+    assert len(budgeted) < 100
+
+
+def test_discussion_keeps_earliest_comments():
+    comments = [{"author": "a", "comment": "c" * 30} for _ in range(10)]
+    kept = budget_discussion(comments, 40)
+
+    assert kept[:3] == comments[:3]
+    assert kept[-1]["comment"] == "7 more comments omitted"
+
+
+def test_groups_never_exceed_budget():
+    changes = [change(f"f{n}.py", "+" + "z" * 90) for n in range(10)]
+    changes.append(change("huge.py", *["+" + "w" * 90] * 20))
+
+    groups = group_changes(changes, 100)
+
+    assert all(change_tokens(group) <= 110 for group in groups)
+    assert [c["file"] for group in groups for c in group] == [
+        c["file"] for c in changes
+    ]
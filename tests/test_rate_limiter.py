@@ -0,0 +1,118 @@
+import pytest
+
+from github_analysis.services.rate_limiter import (
+    GitHubRateLimiter,
+    GitHubTokenPool,
+    NoTokensAvailable,
+)
+
+
+class FakeClock:
+    def __init__(self, now: float = 1_000.0):
+        self.now = now
+        self.slept = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float) -> None:
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def make_limiter(clock: FakeClock, **kwargs) -> GitHubRateLimiter:
+    return GitHubRateLimiter(clock=clock, sleep=clock.sleep, **kwargs)
+
+
+async def test_spreads_remaining_budget_over_window():
+    clock = FakeClock()
+    limiter = make_limiter(clock, reserve=50, burst=2)
+    limiter.record(
+        "token",
+        {
+            "X-RateLimit-Limit": "5000",
+            "X-RateLimit-Remaining": "1050",
+            "X-RateLimit-Reset": str(clock.now + 1_000),
+        },
+    )
+
+    for _ in range(3):
+        await limiter.acquire("token")
+
+    # Two requests fit in the burst, the third waits for ~1 request/second
+    assert len(clock.slept) == 1
+    assert 0.9 < clock.slept[0] < 1.1
+
+
+async def test_waits_for_reset_when_budget_is_spent():
+    clock = FakeClock()
+    limiter = make_limiter(clock, reserve=10)
+    limiter.record(
+        "token",
+        {"X-RateLimit-Remaining": "10", "X-RateLimit-Reset": str(clock.now + 300)},
+    )
+
+    await limiter.acquire("token")
+
+    assert sum(clock.slept) == 300
+
+
+async def test_retry_delay_honours_retry_after_and_blocks_token():
+    clock = FakeClock()
+    limiter = make_limiter(clock, backoff_base=0.0)
+
+    delay = limiter.retry_delay("token", 429, {"Retry-After": "30"})
+    # Never earlier than asked, plus a little jitter
+    assert 30 <= delay <= 33
+    await limiter.acquire("token")
+    assert sum(clock.slept) == pytest.approx(delay)
+    # Other tokens are not held back
+    assert limiter.budget("other").blocked_until == 0
+
+
+def test_retry_delay_backs_off_on_secondary_limit_only():
+    clock = FakeClock()
+    limiter = make_limiter(clock, backoff_base=1.0, max_backoff=10)
+
+    assert limiter.retry_delay("token", 403, {}, "Resource not accessible") is None
+    assert limiter.retry_delay("token", 404, {}) is None
+
+    secondary = "You have exceeded a secondary rate limit"
+    first = limiter.retry_delay("token", 403, {}, secondary, attempt=0)
+    later = limiter.retry_delay("token", 403, {}, secondary, attempt=6)
+    assert 1 <= first <= 3
+    assert 10 <= later <= 13
+
+
+async def test_token_pool_prefers_token_with_most_headroom():
+    clock = FakeClock()
+    limiter = make_limiter(clock)
+    reset = str(clock.now + 3_600)
+    limiter.record("low", {"X-RateLimit-Remaining": "200", "X-RateLimit-Reset": reset})
+    limiter.record(
+        "high", {"X-RateLimit-Remaining": "4000", "X-RateLimit-Reset": reset}
+    )
+    pool = GitHubTokenPool(["low", "high", "low"], limiter)
+
+    assert pool.active_tokens == ["low", "high"]
+    assert await pool.acquire() == "high"
+
+
+async def test_token_pool_falls_back_when_best_token_is_blocked():
+    clock = FakeClock()
+    limiter = make_limiter(clock, backoff_base=0.0)
+    pool = GitHubTokenPool(["a", "b"], limiter)
+    limiter.retry_delay("a", 429, {"Retry-After": "60"})
+
+    assert await pool.acquire() == "b"
+    assert clock.slept == []
+
+
+async def test_token_pool_drops_rejected_tokens():
+    pool = GitHubTokenPool(["a", "b"], make_limiter(FakeClock()))
+    pool.disable("a")
+    assert await pool.acquire() == "b"
+
+    pool.disable("b")
+    with pytest.raises(NoTokensAvailable):
+        await pool.acquire()